@@ -149,6 +149,8 @@ def auto_locations(paragraph_list, default_city=''):
     result, report = [], []
     addresses_seen = set()
     geocoder = SmartGeocoder()
+    # Collect all the addresses first, so they can be geocoded together.
+    found = []
     for para in paragraph_list:
         for addy, city in parse_addresses(para):
             # Skip addresses if they have a city that's a known suburb.
@@ -159,46 +161,54 @@ def auto_locations(paragraph_list, default_city=''):
             # Try geocoding the address. If a city was provided, first try
             # geocoding with the city, then fall back to just the address
             # (without the city).
-            point = None
             attempts = [addy]
             if default_city:
                 attempts.insert(0, '%s, %s' % (addy, default_city))
             if city and city.lower() != default_city.lower():
                 attempts.insert(0, '%s, %s' % (addy, city))
-            for attempt in attempts:
-                try:
-                    point = geocoder.geocode(attempt)
-                    break
-                except AmbiguousResult:
-                    report.append('got ambiguous address "%s"' % attempt)
-                    # Don't try any other address attempts, because they only
-                    # get *more* ambiguous. Plus, the subsequent attempts could
-                    # be incorrect. For example, with this:
-                    #    addy = '100 Broadway'
-                    #    city = 'Manhattan'
-                    #    default_city = 'Brooklyn'
-                    # There are multiple "100 Broadway" addresses in Manhattan,
-                    # so geocoding should fail at this point. It should not
-                    # roll back to try the default_city (Brooklyn).
-                    break
-                except (DoesNotExist, InvalidBlockButValidStreet):
-                    report.append('got nonexistent address "%s"' % attempt)
-                except ParsingError:
-                    report.append('got parsing error "%s"' % attempt)
-            if point is None:
-                continue # This address could not be geocoded.
-
-            if point['address'] in addresses_seen:
-                continue
-            if len(para) > 300:
-                try:
-                    excerpt = smart_excerpt(para, addy)
-                except ValueError:
-                    excerpt = para
+            found.append((para, addy, attempts))
+
+    all_attempts = [attempt for para, addy, attempts in found for attempt in attempts]
+    geocoded = dict(zip(all_attempts, geocoder.geocode_many(all_attempts)))
+
+    for para, addy, attempts in found:
+        point = None
+        for attempt in attempts:
+            if isinstance(geocoded[attempt], AmbiguousResult):
+                report.append('got ambiguous address "%s"' % attempt)
+                # Don't try any other address attempts, because they only
+                # get *more* ambiguous. Plus, the subsequent attempts could
+                # be incorrect. For example, with this:
+                #    addy = '100 Broadway'
+                #    city = 'Manhattan'
+                #    default_city = 'Brooklyn'
+                # There are multiple "100 Broadway" addresses in Manhattan,
+                # so geocoding should fail at this point. It should not
+                # roll back to try the default_city (Brooklyn).
+                break
+            elif isinstance(geocoded[attempt], (DoesNotExist, InvalidBlockButValidStreet)):
+                report.append('got nonexistent address "%s"' % attempt)
+            elif isinstance(geocoded[attempt], ParsingError):
+                report.append('got parsing error "%s"' % attempt)
+            elif isinstance(geocoded[attempt], Exception):
+                raise geocoded[attempt]
             else:
+                point = geocoded[attempt]
+                break
+        if point is None:
+            continue # This address could not be geocoded.
+
+        if point['address'] in addresses_seen:
+            continue
+        if len(para) > 300:
+            try:
+                excerpt = smart_excerpt(para, addy)
+            except ValueError:
                 excerpt = para
-            result.append((addy, point['point'], excerpt, point['block']))
-            addresses_seen.add(point['address'])
+        else:
+            excerpt = para
+        result.append((addy, point['point'], excerpt, point['block']))
+        addresses_seen.add(point['address'])
     return (result, '; '.join(report))
 
 def save_locations_for_ungeocoded_pages():
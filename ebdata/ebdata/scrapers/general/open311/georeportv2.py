@@ -19,7 +19,7 @@
 from django.contrib.gis.geos import Point
 from ebpub.utils.geodjango import get_default_bounds
 from ebpub.db.models import Schema, SchemaField, NewsItem, Lookup
-from ebpub.geocoder.reverse import reverse_geocode
+from ebpub.geocoder.reverse import reverse_geocode_many
 from httplib2 import Http
 from lxml import etree
 import datetime
@@ -153,11 +153,52 @@ class GeoReportV2Scraper(object):
         if response.fromcache:
             log.info("Requests from this time period are unchanged since last update (cached)")
         else:
+            block_names = self._reverse_geocode_requests(reqs)
             for req in reqs:
-                self._update_service_request(req)
+                self._update_service_request(req, block_names)
         return len(list(reqs))
 
-    def _update_service_request(self, sreq):
+    def _get_point(self, sreq):
+        """Returns the request's location as a Point, or None if it
+        has no valid location.
+        """
+        try:
+            return Point(float(sreq.find('long').text),
+                         float(sreq.find('lat').text),
+                         srid=4326)
+        except:
+            return None
+
+    def _reverse_geocode_requests(self, reqs):
+        """Reverse geocodes, in one batch, the locations of all
+        requests that have no address.
+
+        Returns a dict mapping service_request_id to block name.
+        """
+        ids, points = [], []
+        for sreq in reqs:
+            if self._get_request_field(sreq, 'address'):
+                continue
+            service_request_id = self._get_request_field(sreq, 'service_request_id')
+            point = self._get_point(sreq)
+            if service_request_id and point is not None:
+                ids.append(service_request_id)
+                points.append(point)
+        if not points:
+            return {}
+        try:
+            results = reverse_geocode_many(points)
+        except:
+            log.error("Failed to reverse geocode requests: %s" % traceback.format_exc())
+            return {}
+        block_names = {}
+        for service_request_id, result in zip(ids, results):
+            if result is not None:
+                block, distance = result
+                block_names[service_request_id] = block.pretty_name
+        return block_names
+
+    def _update_service_request(self, sreq, block_names=None):
         service_request_id = self._get_request_field(sreq, 'service_request_id')
 
         if not service_request_id:
@@ -166,11 +207,8 @@ class GeoReportV2Scraper(object):
 
 
         # pull out the location first, if we can't do this, we don't want it.
-        try:
-            point = Point(float(sreq.find('long').text), 
-                          float(sreq.find('lat').text),
-                          srid=4326)
-        except: 
+        point = self._get_point(sreq)
+        if point is None:
             log.debug("Skipping request with invalid location (%s)" % service_request_id)
             return
         if self.bounds is not None:
@@ -192,10 +230,11 @@ class GeoReportV2Scraper(object):
         ni.location_name = self._get_request_field(sreq, 'address')
         # try to reverse geocde this point
         if not ni.location_name:
+            if block_names is None:
+                block_names = self._reverse_geocode_requests([sreq])
             try:
-                block, distance = reverse_geocode(ni.location)
-                ni.location_name = block.pretty_name
-            except:
+                ni.location_name = block_names[service_request_id]
+            except KeyError:
                 log.debug("Failed to reverse geocode item %s" % service_request_id)
 
         # try to pull the requested_datetime into pubdate/itemdate
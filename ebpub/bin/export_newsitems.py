@@ -36,7 +36,9 @@ def export_newsitems(queryset, schema, out):
     s_fields.sort()
     writer = csv.writer(out)
     writer.writerow([f[1] for f in ni_fields + s_fields])
-    for ni in queryset:
+    # Preload attributes in bulk; we write raw Lookup IDs, so don't
+    # bother fetching the Lookups.
+    for ni in queryset.with_attributes(get_lookups=False):
         values = [getattr(ni, f[0]) for f in ni_fields]
         values += [ni.attributes[f[0]] for f in s_fields]
         writer.writerow(values)
@@ -20,10 +20,12 @@
 
 import sys
 from optparse import OptionParser
-from django.db import connection
 from django.contrib.gis.geos import fromstr
 from ebpub.db.bin.alphabetize_locations import alphabetize_locations
-from ebpub.db.models import Location, LocationType, NewsItem
+from ebpub.db.bin.import_locations import populate_ni_loc
+from ebpub.db.models import Location, LocationType
+from ebpub.db.utils import force_full_aggregate_update
+from ebpub.db.utils import refresh_location_neighbors
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.text import slugify
 from ebpub.metros.allmetros import get_metro
@@ -46,23 +48,9 @@ def swallow_out(f, start_msg=None, end_msg=None):
             sys.stdout.flush()
     return wrapped
 
-def populate_ni_loc(location):
-    ni_count = NewsItem.objects.count()
-    cursor = connection.cursor()
-    i = 0
-    while i < ni_count:
-        print i
-        cursor.execute("""
-            INSERT INTO db_newsitemlocation (news_item_id, location_id)
-            SELECT ni.id, loc.id FROM db_newsitem ni, db_location loc
-            WHERE intersecting_collection(ni.location, loc.location)
-                AND ni.id >= %s AND ni.id < %s
-                AND loc.id = %s """, (i, i+200, location.id))
-        connection._commit()
-        i += 200
-
 alphabetize_locations = swallow_out(alphabetize_locations, 'Re-alphabetizing locations ...', ' done.\n')
 populate_ni_loc = swallow_out(populate_ni_loc, 'Populating newsitemlocations ...', ' done.\n')
+refresh_location_neighbors = swallow_out(refresh_location_neighbors, 'Refreshing location neighbors ...', ' done.\n')
 
 def add_location(name, wkt, loc_type, source='UNKNOWN'):
     geom = fromstr(wkt, srid=4326)
@@ -95,6 +83,8 @@ def main(argv=None):
     p.add_option('-s', '--source', dest='source',
                  default='UNKNOWN',
                  help='source of data - name or URL of the place you found it.')
+    p.add_option('-j', '--processes', type='int', default=1,
+                 help='how many processes to populate newsitem locations with (default: 1)')
 
     opts, args = p.parse_args(argv)
 
@@ -109,7 +99,9 @@ def main(argv=None):
     location = add_location(args[0], args[1], loc_type, opts.source)
 
     alphabetize_locations(opts.loc_type_slug)
-    populate_ni_loc(location)
+    populate_ni_loc(location, opts.processes)
+    refresh_location_neighbors()
+    force_full_aggregate_update()
 
 if __name__ == '__main__':
     sys.exit(main())
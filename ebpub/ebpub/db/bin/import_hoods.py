@@ -57,7 +57,8 @@ def main(argv=None):
         location_type(),
         opts.source,
         opts.filter_bounds,
-        opts.verbose
+        opts.verbose,
+        opts.processes,
     )
     num_created = importer.save(opts.name_field)
     if opts.verbose:
@@ -23,36 +23,101 @@ import datetime
 from optparse import OptionParser
 from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.geos import Polygon
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import Max, Min
 from django.db.utils import IntegrityError
 from ebpub.db.models import Location, LocationType, NewsItem
+from ebpub.db.utils import force_full_aggregate_update
+from ebpub.db.utils import refresh_location_neighbors
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.text import slugify
 from ebpub.utils.geodjango import ensure_valid
 from ebpub.utils.geodjango import flatten_geomcollection
 from ebpub.metros.allmetros import get_metro
 
-def populate_ni_loc(location):
+# How many NewsItem IDs each populate_ni_loc() job covers.
+POPULATE_CHUNK_SIZE = 20000
+
+def _populate_worker(args):
     """
-    Add NewsItemLocations for all NewsItems that overlap with the new
-    Location.
+    Adds NewsItemLocations for NewsItems with IDs in [start, end)
+    that overlap any of the given Locations, with one spatial join.
+    Returns the number added.
     """
-    ni_count = NewsItem.objects.count()
+    location_ids, start, end = args
     cursor = connection.cursor()
-    i = 0
-    while i < ni_count:
+    try:
         cursor.execute("""
             INSERT INTO db_newsitemlocation (news_item_id, location_id)
             SELECT ni.id, loc.id FROM db_newsitem ni, db_location loc
-            WHERE intersecting_collection(ni.location, loc.location)
-                AND ni.id >= %s AND ni.id < %s
-                AND loc.id = %s
-        """, (i, i+200, location.id))
-        connection._commit()
-        i += 200
+            WHERE loc.id IN (%s)
+                AND ni.id >= %%s AND ni.id < %%s
+                AND ni.location && loc.location
+                AND intersecting_collection(ni.location, loc.location)
+                AND NOT EXISTS (SELECT 1 FROM db_newsitemlocation nil
+                                WHERE nil.news_item_id = ni.id AND nil.location_id = loc.id)
+        """ % ', '.join(['%s'] * len(location_ids)), list(location_ids) + [start, end])
+        count = cursor.rowcount
+        transaction.commit_unless_managed()
+    except Exception:
+        transaction.rollback_unless_managed()
+        raise
+    return count
+
+def _close_connection():
+    # Each worker must open its own database connection,
+    # rather than sharing the one inherited from the parent.
+    connection.close()
+
+def _count_progress(results, num_jobs, verbose):
+    total = 0
+    for done, count in enumerate(results):
+        total += count
+        if verbose:
+            print >> sys.stderr, 'Populated %d of %d NewsItem ID ranges, %d NewsItemLocations so far' % (
+                done + 1, num_jobs, total)
+    return total
+
+def populate_ni_loc(locations, processes=1, chunk_size=POPULATE_CHUNK_SIZE, verbose=False):
+    """
+    Add NewsItemLocations for all NewsItems that overlap with the new
+    Location, or list of Locations.
+
+    The NewsItems are split into ranges of chunk_size IDs, each
+    joined against all the Locations at once. If processes is more
+    than 1, the current transaction is committed and that many ranges
+    are done concurrently. Returns the number of NewsItemLocations
+    added.
+    """
+    if isinstance(locations, Location):
+        locations = [locations]
+    location_ids = [loc.id for loc in locations]
+    id_range = NewsItem.objects.filter(location__isnull=False).aggregate(
+        min_id=Min('id'), max_id=Max('id'))
+    if not location_ids or id_range['min_id'] is None:
+        return 0
+    jobs = [(location_ids, i, i + chunk_size)
+            for i in range(id_range['min_id'], id_range['max_id'] + 1, chunk_size)]
+
+    if processes > 1 and len(jobs) > 1:
+        import multiprocessing
+        # The workers can't see anything we haven't committed.
+        transaction.commit_unless_managed()
+        _close_connection()
+        pool = multiprocessing.Pool(min(processes, len(jobs)), _close_connection)
+        try:
+            results = pool.imap_unordered(_populate_worker, jobs)
+            total = _count_progress(results, len(jobs), verbose)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        total = _count_progress((_populate_worker(job) for job in jobs), len(jobs), verbose)
+    return total
 
 class LocationImporter(object):
-    def __init__(self, layer, location_type, source='UNKNOWN', filter_bounds=False, verbose=False):
+    def __init__(self, layer, location_type, source='UNKNOWN', filter_bounds=False, verbose=False,
+                 processes=1):
         self.layer = layer
         metro = get_metro()
         self.metro_name = metro['metro_name'].upper()
@@ -61,6 +126,7 @@ class LocationImporter(object):
         self.source = source
         self.filter_bounds = filter_bounds
         self.verbose = verbose
+        self.processes = processes
         if self.filter_bounds:
             from ebpub.utils.geodjango import get_default_bounds
             self.bounds = get_default_bounds()
@@ -87,6 +153,7 @@ class LocationImporter(object):
                 continue
             locs.append(fields)
         num_created = 0
+        saved = []
         for i, loc_fields in enumerate(sorted(locs, key=lambda h: h['name'])):
             kwargs = dict(
                 loc_fields,
@@ -115,13 +182,17 @@ class LocationImporter(object):
             if created:
                 num_created += 1
 
+            saved.append(loc)
+
             if verbose:
                 print >> sys.stderr, '%s %s %s' % (created and 'Created' or 'Already had', self.location_type.name, loc)
-            if verbose:
-                sys.stderr.write('Populating newsitem locations ... ')
-            populate_ni_loc(loc)
-            if verbose:
-                sys.stderr.write('done.\n')
+        if verbose:
+            print >> sys.stderr, 'Populating newsitem locations ...'
+        populate_ni_loc(saved, self.processes, verbose=verbose)
+        if verbose:
+            print >> sys.stderr, 'Refreshing location neighbors ...'
+        refresh_location_neighbors()
+        force_full_aggregate_update()
         return num_created
 
     def should_create_location(self, fields):
@@ -140,6 +211,8 @@ optparser.add_option('-n', '--name-field', dest='name_field', default='name', he
 optparser.add_option('-i', '--layer-index', dest='layer_id', default=0, help='index of layer in shapefile')
 optparser.add_option('-s', '--source', dest='source', default='UNKNOWN', help='source metadata of the shapefile')
 optparser.add_option('-v', '--verbose',  action='store_true', default=False, help='be verbose')
+optparser.add_option('-j', '--processes', type='int', default=1,
+                     help='how many processes to populate newsitem locations with (default 1)')
 optparser.add_option('-b', '--filter-bounds', action='store_true', default=False,
                      help="exclude locations not within the lon/lat bounds of "
                      " your metro's extent (from your settings.py) (default false)")
@@ -191,7 +264,8 @@ def main():
         location_type,
         opts.source,
         opts.filter_bounds,
-        opts.verbose
+        opts.verbose,
+        opts.processes,
     )
     num_created = importer.save(opts.name_field)
 
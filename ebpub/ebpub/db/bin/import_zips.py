@@ -21,6 +21,8 @@
 import datetime
 from django.contrib.gis.geos import MultiPolygon
 from ebpub.db.models import Location, LocationType
+from ebpub.db.utils import force_full_aggregate_update
+from ebpub.db.utils import refresh_location_neighbors
 from ebpub.utils.geodjango import ensure_valid
 from ebpub.utils.geodjango import flatten_geomcollection
 from ebpub.db.bin import import_locations
@@ -109,6 +111,8 @@ class ZipImporter(import_locations.LocationImporter):
             created = self.create_location(zipcode, geom, display_order=i)
             if created:
                 num_created += 1
+        refresh_location_neighbors()
+        force_full_aggregate_update()
         return num_created
 
 def parse_args(optparser, argv):
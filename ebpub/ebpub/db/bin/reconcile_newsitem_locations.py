@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Updates the NewsItemLocations of NewsItems that were saved while
+NewsItemLocation updates were deferred, eg. by a bulk load that
+crashed before it could reconcile them itself.
+
+With --benchmark, instead compares loading NewsItems with and without
+deferring NewsItemLocation updates.
+"""
+
+from django.db import connection, transaction
+from ebpub.db.models import NewsItem, NewsItemLocation, Location, Schema
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+import time
+
+logger = logging.getLogger('ebpub.db.bin.reconcile_newsitem_locations')
+
+
+@transaction.commit_on_success
+def reconcile():
+    """
+    Reconciles all pending NewsItemLocations.
+    Returns the number of NewsItemLocations inserted.
+    """
+    pending = NewsItemLocation.objects.pending_count()
+    logger.info('%d NewsItems pending' % pending)
+    count = NewsItemLocation.objects.reconcile()
+    logger.info('Inserted %d NewsItemLocations' % count)
+    return count
+
+
+def _insert_newsitems(count, schema, extent, seed):
+    """
+    Inserts count NewsItems at random points within extent,
+    the same points each time for a given seed.
+    Returns the IDs of the first and last new NewsItems.
+    """
+    xmin, ymin, xmax, ymax = extent
+    cursor = connection.cursor()
+    cursor.execute("SELECT setseed(%s)", [seed])
+    cursor.execute("""
+        INSERT INTO %s (schema_id, title, description, url, pub_date, item_date,
+                        last_modification, location, location_name)
+        SELECT %%s, 'Benchmark ' || n, '', '', now(), current_date, now(),
+            ST_SetSRID(ST_MakePoint(%%s + random() * %%s, %%s + random() * %%s), 4326),
+            'Benchmark'
+        FROM generate_series(1, %%s) AS n
+        RETURNING id
+    """ % NewsItem._meta.db_table,
+                   [schema.id, xmin, xmax - xmin, ymin, ymax - ymin, count])
+    ids = [row[0] for row in cursor.fetchall()]
+    return min(ids), max(ids)
+
+def _count_newsitemlocations(first_id, last_id):
+    return NewsItemLocation.objects.filter(news_item__id__range=(first_id, last_id)).count()
+
+def benchmark(count, seed=0.5):
+    """
+    Inserts count NewsItems with the trigger updating their
+    NewsItemLocations one at a time, then the same NewsItems again
+    with updates deferred and reconciled afterward. Rolls everything
+    back when done.
+
+    Returns a dict of the seconds each took, and the number of
+    NewsItemLocations each made (which should be the same).
+    """
+    schema = Schema.objects.all()[0]
+    extent = Location.objects.extent()
+    results = {}
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        NewsItemLocation.objects.undefer_trigger()
+        start = time.time()
+        first_id, last_id = _insert_newsitems(count, schema, extent, seed)
+        results['per_row'] = time.time() - start
+        results['per_row_locations'] = _count_newsitemlocations(first_id, last_id)
+        logger.info('Per-row: %(per_row).2f seconds, %(per_row_locations)d NewsItemLocations'
+                    % results)
+
+        NewsItemLocation.objects.defer_trigger()
+        try:
+            start = time.time()
+            first_id, last_id = _insert_newsitems(count, schema, extent, seed)
+        finally:
+            NewsItemLocation.objects.undefer_trigger()
+        results['deferred_insert'] = time.time() - start
+        NewsItemLocation.objects.reconcile()
+        results['deferred'] = time.time() - start
+        results['deferred_locations'] = _count_newsitemlocations(first_id, last_id)
+        logger.info('Deferred: %(deferred).2f seconds (%(deferred_insert).2f inserting), '
+                    '%(deferred_locations)d NewsItemLocations' % results)
+    finally:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+    return results
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options]
+
+Updates NewsItemLocations for NewsItems saved while updates were
+deferred (see NewsItemLocation.objects.deferred()).
+
+With --benchmark N, instead inserts N NewsItems at random points
+within your Locations, first with per-row updates and then deferred,
+prints the times, and rolls it all back. Don't run that on a busy
+production database.
+''')
+    optparser.add_option('-b', '--benchmark', type='int', metavar='N',
+                         help='Compare loading N NewsItems with and without deferring.')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+
+    if opts.benchmark:
+        if not Schema.objects.count():
+            optparser.error('You need at least one Schema to benchmark.')
+        if not Location.objects.count():
+            optparser.error('You need at least one Location to benchmark.')
+        results = benchmark(opts.benchmark)
+        print 'Per-row:  %(per_row).2f seconds, %(per_row_locations)d NewsItemLocations' % results
+        print 'Deferred: %(deferred).2f seconds, %(deferred_locations)d NewsItemLocations' % results
+        if results['per_row_locations'] != results['deferred_locations']:
+            sys.exit('NewsItemLocations differ!')
+    else:
+        reconcile()
+
+if __name__ == "__main__":
+    main()
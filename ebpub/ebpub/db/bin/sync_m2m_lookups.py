@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Rebuilds the NewsItemLookup table from many-to-many lookup attributes.
+
+This is only needed if attributes have been written directly to the
+db_attribute table, bypassing NewsItem.attributes.
+"""
+
+from django.db import connection, transaction
+from ebpub.db.models import Schema, SchemaField, NewsItemLookup
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+
+logger = logging.getLogger('ebpub.db.bin.sync_m2m_lookups')
+
+def sync_schema_field(cursor, sf, dry_run=False):
+    """
+    Replaces all NewsItemLookup rows for the given SchemaField.
+    Returns the number of rows inserted.
+    """
+    table = NewsItemLookup._meta.db_table
+    cursor.execute("DELETE FROM %s WHERE schema_field_id = %%s" % table, [sf.id])
+    cursor.execute("""
+        INSERT INTO %s (news_item_id, schema_field_id, lookup_id)
+        SELECT DISTINCT split.news_item_id, %%s, l.id
+        FROM (
+            SELECT news_item_id, regexp_split_to_table(%s, ',') AS lookup_id
+            FROM db_attribute
+            WHERE schema_id = %%s AND %s IS NOT NULL
+        ) AS split, db_lookup l
+        WHERE l.schema_field_id = %%s
+            AND l.id::text = trim(split.lookup_id)""" % (table, sf.real_name, sf.real_name),
+                   [sf.id, sf.schema_id, sf.id])
+    count = cursor.rowcount
+    logger.info("%s.%s: %d rows" % (sf.schema.slug, sf.name, count))
+    if dry_run:
+        transaction.rollback()
+    else:
+        transaction.commit()
+    return count
+
+@transaction.commit_manually
+def sync_m2m_lookups(schema_slug=None, dry_run=False):
+    cursor = connection.cursor()
+    fields = SchemaField.objects.filter(is_lookup=True).select_related('schema')
+    if schema_slug is not None:
+        schema = Schema.objects.get(slug=schema_slug)
+        fields = fields.filter(schema__id=schema.id)
+    total = 0
+    try:
+        for sf in fields:
+            if sf.is_many_to_many_lookup():
+                total += sync_schema_field(cursor, sf, dry_run=dry_run)
+    except:
+        transaction.rollback()
+        raise
+    logger.info("Done, %d rows total" % total)
+    return total
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] [schema]
+
+Rebuilds the index of many-to-many lookup values
+for the given schema (default: all schemas).
+''')
+    add_verbosity_options(optparser)
+    optparser.add_option('-d', '--dry-run', action='store_true',
+                         help='Dry run, change nothing.')
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    sync_m2m_lookups(*args[:1], dry_run=opts.dry_run)
+
+if __name__ == "__main__":
+    main()
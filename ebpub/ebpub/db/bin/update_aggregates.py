@@ -17,7 +17,6 @@
 #   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from django.conf import settings
 from django.db import connection, transaction
 from ebpub.db import constants
 from ebpub.db.models import Schema, SchemaField, NewsItem, AggregateAll, AggregateDay, AggregateLocationDay, AggregateLocation, AggregateFieldLookup
@@ -25,64 +24,150 @@ from ebpub.db.utils import today
 from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
 import datetime
 import logging
+import time
 
 logger = logging.getLogger('ebpub.db.bin.update_aggregates')
 
-def smart_update(cursor, new_values, table_name, field_names, comparable_fields,
-                 where, pk_name='id', dry_run=False):
-    # new_values is a list of dictionaries, each with a value for each field in field_names.
+class AggregateReport(object):
+    """
+    Collects the number of rows touched and time spent, per aggregate
+    table, and the time spent per schema.
+    """
+    def __init__(self):
+        self.tables = {}
+        self.schemas = {}
+
+    def add(self, table_name, inserted=0, updated=0, deleted=0, seconds=0.0):
+        stats = self.tables.setdefault(table_name, {'inserted': 0, 'updated': 0,
+                                                    'deleted': 0, 'seconds': 0.0})
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['deleted'] += deleted
+        stats['seconds'] += seconds
+
+    def add_schema(self, schema_slug, seconds):
+        self.schemas[schema_slug] = self.schemas.get(schema_slug, 0.0) + seconds
+
+    def merge(self, other):
+        """
+        Adds the numbers from another report, eg. from a worker process.
+        """
+        for table_name, stats in other.tables.items():
+            self.add(table_name, **stats)
+        for schema_slug, seconds in other.schemas.items():
+            self.add_schema(schema_slug, seconds)
+
+    def log(self, prefix=''):
+        for table_name in sorted(self.tables):
+            stats = self.tables[table_name]
+            logger.info('%s%s: %d inserted, %d updated, %d deleted in %.2f seconds'
+                        % (prefix, table_name, stats['inserted'], stats['updated'],
+                           stats['deleted'], stats['seconds']))
+        # Slowest first.
+        for schema_slug, seconds in sorted(self.schemas.items(), key=lambda i: -i[1]):
+            logger.info('%sschema %s: %.2f seconds' % (prefix, schema_slug, seconds))
+
+
+def upsert_aggregates(cursor, table_name, select_sql, params, key_fields, where,
+                      scope_sql='', scope_params=(), dry_run=False, report=None):
+    """
+    Brings the rows of an aggregate table in line with the results of a query,
+    using a few set-based statements rather than one statement per row.
 
-    # Run a query to determine the current values in the DB.
+    select_sql must return the columns in key_fields, followed by the total.
+
+    where is a dictionary of column values shared by all rows, eg. schema_id.
+
+    Existing rows matching ``where`` that aren't in the query results
+    are deleted; if scope_sql is given, only existing rows that also
+    match that SQL condition are considered for deletion. This is how
+    incremental updates avoid deleting buckets they didn't recompute.
+
+    If dry_run is True, the changes are rolled back, but still counted.
+
+    Returns a tuple of (inserted, updated, deleted) row counts.
+    """
+    start = time.time()
     where = where.items()
+    where_sql = ' AND '.join(['t.%s = %%s' % k for k, v in where])
+    where_params = [v for k, v in where]
+    match_sql = ''.join([' AND t.%s = n.%s' % (k, k) for k in key_fields])
+    new_fields = tuple(key_fields) + ('total',)
+
+    if dry_run:
+        cursor.execute("SAVEPOINT update_aggregates_dry_run")
+    cursor.execute("CREATE TEMPORARY TABLE new_aggregates (%s) AS %s" % (
+            ', '.join(new_fields), select_sql), params)
+
     cursor.execute("""
-        SELECT %s, %s
-        FROM %s
-        WHERE %s""" % (pk_name, ','.join(field_names), table_name,
-            ' AND '.join(['%s=%%s' % k for k, v in where])), tuple([v for k, v in where]))
-    old_values = dict([(tuple(row[1:len(comparable_fields)+1]), dict(zip((pk_name,)+field_names, row))) for row in cursor.fetchall()])
-    for new_value in new_values:
-        key = tuple([new_value[i] for i in comparable_fields])
-        try:
-            old_value = old_values.pop(key)
-        except KeyError:
-            logger.debug(
-                "INSERT INTO %s (%s) VALUES (%s)" % (table_name, ', '.join(field_names + tuple([i[0] for i in where])), ', '.join([str(new_value[i]) for i in field_names] + [str(i[1]) for i in where])))
-            if not dry_run:
-                cursor.execute("INSERT INTO %s (%s) VALUES (%s)" % \
-                    (table_name, ', '.join(field_names + tuple([i[0] for i in where])), ','.join(['%s' for _ in tuple(field_names) + tuple(where)])),
-                    tuple([new_value[i] for i in field_names] + [i[1] for i in where]))
-        else:
-            for k, v in new_value.items():
-                if old_value[k] != v:
-                    logger.debug(
-                        "UPDATE %s SET %s WHERE %s=%s" % (table_name, ', '.join(['%s=%s' % (k, v) for k, v in new_value.items()]), pk_name, old_value[pk_name]))
-                    if not dry_run:
-                        new_value_tuple = new_value.items()
-                        cursor.execute("UPDATE %s SET %s WHERE %s=%%s" % \
-                            (table_name, ', '.join(['%s=%%s' % k for k, v in new_value_tuple]), pk_name),
-                            tuple([v for k, v in new_value_tuple] + [old_value[pk_name]]))
-                    break
-    for old_value in old_values.values():
-        logger.debug("DELETE FROM %s WHERE %s = %s" % (table_name, pk_name, old_value[pk_name]))
-        if not dry_run:
-            cursor.execute("DELETE FROM %s WHERE %s = %%s" % (table_name, pk_name), (old_value[pk_name],))
+        UPDATE %s t SET total = n.total
+        FROM new_aggregates n
+        WHERE %s%s AND t.total <> n.total""" % (table_name, where_sql, match_sql),
+                   where_params)
+    updated = cursor.rowcount
+
+    cursor.execute("""
+        INSERT INTO %s (%s)
+        SELECT %s
+        FROM new_aggregates n
+        WHERE NOT EXISTS (SELECT 1 FROM %s t WHERE %s%s)""" % (
+            table_name, ', '.join(new_fields + tuple([k for k, v in where])),
+            ', '.join(['n.%s' % f for f in new_fields] + ['%s' for _ in where]),
+            table_name, where_sql, match_sql),
+                   where_params + where_params)
+    inserted = cursor.rowcount
+
+    cursor.execute("""
+        DELETE FROM %s t
+        WHERE %s%s
+            AND NOT EXISTS (SELECT 1 FROM new_aggregates n WHERE TRUE%s)""" % (
+            table_name, where_sql, scope_sql and (' AND ' + scope_sql) or '', match_sql),
+                   where_params + list(scope_params))
+    deleted = cursor.rowcount
+
+    cursor.execute("DROP TABLE new_aggregates")
+    if dry_run:
+        cursor.execute("ROLLBACK TO SAVEPOINT update_aggregates_dry_run")
+
+    elapsed = time.time() - start
+    logger.debug('%s %s: %d inserted, %d updated, %d deleted in %.2f seconds'
+                 % (table_name, dict(where), inserted, updated, deleted, elapsed))
+    if report is not None:
+        report.add(table_name, inserted, updated, deleted, elapsed)
+    return inserted, updated, deleted
+
 
-def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
+def update_aggregates(schema_id_or_slug, dry_run=False, reset=False,
+                      incremental=False, report=None):
     """
     Updates all Aggregate* tables for the given schema_id/slug,
     deleting/updating the existing records if necessary.
 
-    If dry_run is True, then the records won't be updated -- only the SQL
-    will be output.
+    If dry_run is True, then the records won't be updated, but the
+    number of affected rows is still reported.
 
     If reset is True, then all aggregates for this schema will be deleted before
     updating.
+
+    If incremental is True, per-day aggregates are only recomputed for
+    dates that have NewsItems modified since the last update
+    (AggregateAll.updated_through).  If the day totals then don't add
+    up -- which happens when NewsItems are deleted or their item_date
+    changes -- we fall back to recomputing all days.  Likewise if the
+    location/day totals don't add up to the number of
+    NewsItemLocations, eg. because Locations were imported, we
+    recompute all location/days.
+
+    Returns an AggregateReport.
     """
     logger.info('... %s' % schema_id_or_slug)
+    schema_start = time.time()
     if not str(schema_id_or_slug).isdigit():
         schema_id = Schema.objects.get(slug=schema_id_or_slug).id
     else:
-        schema_id = schema_id_or_slug
+        schema_id = int(schema_id_or_slug)
+    if report is None:
+        report = AggregateReport()
     cursor = connection.cursor()
 
     if reset and not dry_run:
@@ -91,36 +176,65 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
             logger.info('... deleting all %s for schema %s' % (aggmodel.__name__, schema_id_or_slug))
             aggmodel.objects.filter(schema__id=schema_id).delete()
 
+    # Items saved after this point will be picked up next time; so
+    # will items saved a little before, in case they're in a
+    # transaction that hasn't committed yet.
+    # NewsItem.last_modification uses the app server's clock, so we do too.
+    updated_through = datetime.datetime.now() - constants.AGGREGATE_UPDATE_SAFETY_MARGIN
+    last_updated_through = None
+    if incremental and not reset:
+        last_updated_through = AggregateAll.objects.filter(schema__id=schema_id).values_list(
+            'updated_through', flat=True)[:1]
+        last_updated_through = last_updated_through and last_updated_through[0] or None
+        if last_updated_through is None:
+            logger.info('... no previous update for schema %s, doing a full update' % schema_id_or_slug)
+
     # AggregateAll
-    cursor.execute("SELECT COUNT(*) FROM db_newsitem WHERE schema_id = %s", (schema_id,))
-    new_values = [{'total': row[0]} for row in cursor.fetchall()]
-    smart_update(cursor, new_values, AggregateAll._meta.db_table, ('total',),
-                 (), {'schema_id': schema_id}, dry_run=dry_run)
+    upsert_aggregates(cursor, AggregateAll._meta.db_table,
+                      "SELECT COUNT(*) FROM db_newsitem WHERE schema_id = %s",
+                      (schema_id,), (), {'schema_id': schema_id},
+                      dry_run=dry_run, report=report)
 
-    # AggregateDay
-    cursor.execute("""
-        SELECT item_date, COUNT(*)
-        FROM db_newsitem
-        WHERE schema_id = %s
-        GROUP BY 1""", (schema_id,))
-    new_values = [{'date_part': row[0], 'total': row[1]} for row in cursor.fetchall()]
-    smart_update(cursor, new_values, AggregateDay._meta.db_table, ('date_part', 'total'),
-                 ('date_part',), {'schema_id': schema_id}, dry_run=dry_run,
-                 )
-
-    # AggregateLocationDay
-    cursor.execute("""
-        SELECT nl.location_id, ni.item_date, loc.location_type_id, COUNT(*)
-        FROM db_newsitemlocation nl, db_newsitem ni, db_location loc
-        WHERE nl.news_item_id = ni.id
-            AND ni.schema_id = %s
-            AND nl.location_id = loc.id
-        GROUP BY 1, 2, 3""", (schema_id,))
-    new_values = [{'location_id': row[0], 'date_part': row[1], 'location_type_id': row[2], 'total': row[3]} for row in cursor.fetchall()]
-    smart_update(cursor, new_values, AggregateLocationDay._meta.db_table, ('location_id', 'date_part', 'location_type_id', 'total'),
-                 ('location_id', 'date_part', 'location_type_id'),
-                 {'schema_id': schema_id}, dry_run=dry_run,
-                 )
+    # Which days need recomputing?
+    if last_updated_through is not None:
+        cursor.execute("""
+            SELECT DISTINCT item_date FROM db_newsitem
+            WHERE schema_id = %s AND last_modification >= %s""",
+                       (schema_id, last_updated_through))
+        changed_dates = [row[0] for row in cursor.fetchall()]
+        logger.info('... %d days changed since %s' % (len(changed_dates), last_updated_through))
+        _update_day_aggregates(cursor, schema_id, changed_dates, dry_run, report)
+        _update_location_day_aggregates(cursor, schema_id, changed_dates, dry_run, report)
+        if not dry_run:
+            # Recomputed days are exact; any other day can only be
+            # stale by being too high (items deleted or moved away).
+            # So if the days add up to the total, nothing is stale.
+            cursor.execute("""
+                SELECT (SELECT COALESCE(SUM(total), 0) FROM %s WHERE schema_id = %%s),
+                       (SELECT COUNT(*) FROM db_newsitem WHERE schema_id = %%s)""" % AggregateDay._meta.db_table,
+                           (schema_id, schema_id))
+            day_sum, total = cursor.fetchone()
+            if day_sum != total:
+                logger.info('... day totals are stale (%d != %d), updating all days' % (day_sum, total))
+                _update_day_aggregates(cursor, schema_id, None, dry_run, report)
+            # The same goes for location/days, except that
+            # NewsItemLocations can also be added or removed without
+            # the NewsItem changing, eg. when Locations are imported;
+            # the import scripts take care of that by forcing a full
+            # update next time, but we check anyway.
+            cursor.execute("""
+                SELECT (SELECT COALESCE(SUM(total), 0) FROM %s WHERE schema_id = %%s),
+                       (SELECT COUNT(*) FROM db_newsitemlocation nl, db_newsitem ni
+                        WHERE nl.news_item_id = ni.id AND ni.schema_id = %%s)""" % AggregateLocationDay._meta.db_table,
+                           (schema_id, schema_id))
+            location_day_sum, total = cursor.fetchone()
+            if location_day_sum != total:
+                logger.info('... location/day totals are stale (%d != %d), updating all location/days'
+                            % (location_day_sum, total))
+                _update_location_day_aggregates(cursor, schema_id, None, dry_run, report)
+    else:
+        _update_day_aggregates(cursor, schema_id, None, dry_run, report)
+        _update_location_day_aggregates(cursor, schema_id, None, dry_run, report)
 
     # AggregateLocation
     # This query is a bit clever -- we just sum up the totals created in a
@@ -140,19 +254,15 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
         # Note that BETWEEN is inclusive on both ends, so to get
         # AggregateLocationDays for eg. 30 days, we'd need a timedelta of 29
         start_date = end_date - constants.DAYS_AGGREGATE_TIMEDELTA
-        cursor.execute("""
+        upsert_aggregates(cursor, AggregateLocation._meta.db_table, """
             SELECT location_id, location_type_id, SUM(total)
             FROM %s
             WHERE schema_id = %%s
                 AND date_part BETWEEN %%s AND %%s
             GROUP BY 1, 2""" % AggregateLocationDay._meta.db_table,
-                (schema_id, start_date, end_date))
-        new_values = [{'location_id': row[0], 'location_type_id': row[1], 'total': row[2]} for row in cursor.fetchall()]
-        smart_update(cursor, new_values, AggregateLocation._meta.db_table,
-                     ('location_id', 'location_type_id', 'total'),
-                     ('location_id', 'location_type_id'), {'schema_id': schema_id},
-                     dry_run=dry_run,
-                     )
+                          (schema_id, start_date, end_date),
+                          ('location_id', 'location_type_id'), {'schema_id': schema_id},
+                          dry_run=dry_run, report=report)
 
     for sf in SchemaField.objects.filter(schema__id=schema_id, is_filter=True, is_lookup=True):
         try:
@@ -164,26 +274,23 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
 
         if sf.is_many_to_many_lookup():
             # AggregateFieldLookup
-            cursor.execute("""
-                SELECT id, (
-                    SELECT COUNT(*) FROM db_attribute a, db_newsitem ni
-                    WHERE a.news_item_id = ni.id
-                        AND a.schema_id = %%s
-                        AND ni.schema_id = %%s
-                        AND a.%s ~ ('[[:<:]]' || db_lookup.id || '[[:>:]]')
-                        AND ni.item_date BETWEEN %%s AND %%s
-                )
-                FROM db_lookup
-                WHERE schema_field_id = %%s""" % sf.real_name, (schema_id, schema_id, start_date, end_date, sf.id))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
-            smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table,
-                         ('lookup_id', 'total'), ('lookup_id',),
-                         {'schema_id': schema_id, 'schema_field_id': sf.id},
-                         dry_run=dry_run,
-                         )
+            # Uses the NewsItemLookup index table rather than
+            # regex-matching the comma-separated attribute values.
+            select_sql = """
+                SELECT l.id, COUNT(ni.id)
+                FROM db_lookup l
+                LEFT JOIN db_newsitemlookup nil
+                    ON nil.lookup_id = l.id
+                LEFT JOIN db_newsitem ni
+                    ON ni.id = nil.news_item_id
+                    AND ni.schema_id = %s
+                    AND ni.item_date BETWEEN %s AND %s
+                WHERE l.schema_field_id = %s
+                GROUP BY l.id"""
+            params = (schema_id, start_date, end_date, sf.id)
         else:
             # AggregateFieldLookup
-            cursor.execute("""
+            select_sql = """
                 SELECT a.%s, COUNT(*)
                 FROM db_attribute a, db_newsitem ni
                 WHERE a.news_item_id = ni.id
@@ -191,24 +298,134 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
                     AND ni.schema_id = %%s
                     AND %s IS NOT NULL
                     AND ni.item_date BETWEEN %%s AND %%s
-                GROUP BY 1""" % (sf.real_name, sf.real_name), (schema_id, schema_id, start_date, end_date))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
-            smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table,
-                         ('lookup_id', 'total'), ('lookup_id',),
-                         {'schema_id': schema_id, 'schema_field_id': sf.id},
-                         dry_run=dry_run)
+                GROUP BY 1""" % (sf.real_name, sf.real_name)
+            params = (schema_id, schema_id, start_date, end_date)
+        upsert_aggregates(cursor, AggregateFieldLookup._meta.db_table,
+                          select_sql, params, ('lookup_id',),
+                          {'schema_id': schema_id, 'schema_field_id': sf.id},
+                          dry_run=dry_run, report=report)
 
+    if not dry_run:
+        AggregateAll.objects.filter(schema__id=schema_id).update(updated_through=updated_through)
     transaction.commit_unless_managed()
+    report.add_schema(schema_id_or_slug, time.time() - schema_start)
+    return report
+
+def _date_scope(dates):
+    """
+    Returns SQL (and params) restricting NewsItems and aggregate rows
+    to the given dates, or to all dates if ``dates`` is None.
+    """
+    if dates is None:
+        return '', (), '', ()
+    placeholders = ', '.join(['%s' for d in dates])
+    return (' AND ni.item_date IN (%s)' % placeholders, tuple(dates),
+            't.date_part IN (%s)' % placeholders, tuple(dates))
+
+def _update_day_aggregates(cursor, schema_id, dates, dry_run, report):
+    """
+    Updates AggregateDay for the given dates, or for all dates if
+    ``dates`` is None.
+    """
+    if dates is not None and not dates:
+        return
+    date_sql, date_params, scope_sql, scope_params = _date_scope(dates)
+    upsert_aggregates(cursor, AggregateDay._meta.db_table, """
+        SELECT ni.item_date, COUNT(*)
+        FROM db_newsitem ni
+        WHERE ni.schema_id = %%s%s
+        GROUP BY 1""" % date_sql, (schema_id,) + date_params,
+                      ('date_part',), {'schema_id': schema_id},
+                      scope_sql, scope_params, dry_run=dry_run, report=report)
+
+def _update_location_day_aggregates(cursor, schema_id, dates, dry_run, report):
+    """
+    Updates AggregateLocationDay for the given dates, or for all dates
+    if ``dates`` is None.
+    """
+    if dates is not None and not dates:
+        return
+    date_sql, date_params, scope_sql, scope_params = _date_scope(dates)
+    upsert_aggregates(cursor, AggregateLocationDay._meta.db_table, """
+        SELECT nl.location_id, ni.item_date, loc.location_type_id, COUNT(*)
+        FROM db_newsitemlocation nl, db_newsitem ni, db_location loc
+        WHERE nl.news_item_id = ni.id
+            AND ni.schema_id = %%s
+            AND nl.location_id = loc.id%s
+        GROUP BY 1, 2, 3""" % date_sql, (schema_id,) + date_params,
+                      ('location_id', 'date_part', 'location_type_id'),
+                      {'schema_id': schema_id},
+                      scope_sql, scope_params, dry_run=dry_run, report=report)
 
-def update_all_aggregates(dry_run=False, reset=False):
-    for schema in Schema.objects.all():
+def _update_aggregates_worker(args):
+    """
+    Runs update_aggregates() in a worker process.
+    Returns a tuple of (schema slug, AggregateReport or None, error message or None).
+    """
+    schema_slug, kwargs = args
+    try:
+        return (schema_slug, update_aggregates(schema_slug, **kwargs), None)
+    except Exception, e:
+        logger.exception('Updating %s aggregates failed' % schema_slug)
+        transaction.rollback_unless_managed()
+        return (schema_slug, None, '%s: %s' % (e.__class__.__name__, e))
+
+def _close_connection():
+    # Each worker must open its own database connection,
+    # rather than sharing the one inherited from the parent.
+    connection.close()
+
+def update_all_aggregates(dry_run=False, reset=False, incremental=False,
+                          schemas=None, processes=1):
+    """
+    Updates aggregates for all schemas, or those whose slugs are in
+    ``schemas``.
+
+    If processes is more than 1, that many schemas are updated
+    concurrently, each worker process with its own database connection.
+
+    Returns an AggregateReport. Raises an exception listing any schemas
+    that failed, after the others have finished.
+    """
+    schema_qs = Schema.objects.all()
+    if schemas:
+        schema_qs = schema_qs.filter(slug__in=schemas)
+        unknown = set(schemas) - set(schema_qs.values_list('slug', flat=True))
+        if unknown:
+            raise Schema.DoesNotExist('No schemas with slugs: %s' % ', '.join(sorted(unknown)))
+    for schema in schema_qs:
         if dry_run:
             logger.info('Dry run: Updating %s aggregates' % schema.plural_name)
         elif reset:
             logger.info('Resetting all %s aggregates' % schema.plural_name)
         else:
             logger.info('Updating %s aggregates' % schema.plural_name)
-        update_aggregates(schema.id, dry_run=dry_run, reset=reset)
+    kwargs = {'dry_run': dry_run, 'reset': reset, 'incremental': incremental}
+    jobs = [(slug, kwargs) for slug in schema_qs.values_list('slug', flat=True)]
+
+    report = AggregateReport()
+    if processes > 1 and len(jobs) > 1:
+        import multiprocessing
+        _close_connection()
+        pool = multiprocessing.Pool(min(processes, len(jobs)), _close_connection)
+        try:
+            results = list(pool.imap_unordered(_update_aggregates_worker, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_update_aggregates_worker(job) for job in jobs]
+
+    errors = []
+    for schema_slug, schema_report, error in results:
+        if error:
+            errors.append('%s (%s)' % (schema_slug, error))
+        else:
+            report.merge(schema_report)
+    if errors:
+        report.log()
+        raise RuntimeError('Updating aggregates failed for: %s' % '; '.join(errors))
+    return report
 
 def main(argv=None):
     import sys
@@ -219,6 +436,11 @@ def main(argv=None):
 
 Updates aggregate statistics for the given schema (default: all schemas).
 ''')
+    optparser.add_option('-s', '--schemas', action='append', default=[],
+                         help='Only update these schemas. Comma-separated slugs; may be given more than once.')
+    optparser.add_option('-j', '--processes', type='int',
+                         default=constants.AGGREGATE_PROCESSES,
+                         help='How many schemas to update at once, each in its own process. Default %default.')
     optparser.add_option('-r', '--reset', action='store_true',
                          help='Delete all aggregates before updating.')
 
@@ -226,16 +448,25 @@ Updates aggregate statistics for the given schema (default: all schemas).
 
     optparser.add_option('-d', '--dry-run', action='store_true',
                          help='Dry run, change nothing.')
+    optparser.add_option('-i', '--incremental', action='store_true',
+                         help='Only recompute days with NewsItems modified since the last update.')
 
     opts, args = optparser.parse_args(argv)
 
 
     setup_logging_from_opts(opts, logger)
 
-    if args:
-        return update_aggregates(*args, reset=opts.reset, dry_run=opts.dry_run)
+    schemas = [slug.strip() for value in opts.schemas for slug in value.split(',')
+               if slug.strip()]
+    if args and not schemas:
+        report = update_aggregates(*args, reset=opts.reset, dry_run=opts.dry_run,
+                                   incremental=opts.incremental)
     else:
-        return update_all_aggregates(reset=opts.reset, dry_run=opts.dry_run)
+        report = update_all_aggregates(reset=opts.reset, dry_run=opts.dry_run,
+                                       incremental=opts.incremental,
+                                       schemas=schemas + list(args),
+                                       processes=opts.processes)
+    report.log(prefix=opts.dry_run and 'Dry run: ' or '')
 
 if __name__ == "__main__":
     main()
@@ -39,6 +39,10 @@ FILTER_PER_PAGE = 30
 # Number of NewsItems to fetch for place_detail.
 NUM_NEWS_ITEMS_PLACE_DETAIL = 300
 
+# How many NewsItems NewsItemQuerySet.with_attributes() preloads
+# attributes for at a time.
+ATTRIBUTE_PRELOAD_CHUNK_SIZE = 500
+
 # Regular expression that parses block-page URLs. The last part of it is for
 # the optional pre-directional and/or post-directional (for example,
 # 'n', 'ne', 'n-w', '-sw').
@@ -46,3 +50,35 @@ BLOCK_URL_REGEX = r'(\d{1,6})-(\d{1,6})([nsew]{1,2})?(?:-([nsew]{0,2}))?'
 
 # How long the Schema managers should cache allowed_schema_ids()
 ALLOWED_IDS_CACHE_TIME = 60 * 10
+
+# How often (in seconds) each process checks whether another process
+# has changed Schemas or SchemaFields; see SchemaFieldRegistry.
+SCHEMAFIELD_REGISTRY_CHECK_INTERVAL = 10
+
+# How long (in seconds) SchemaFieldRegistry keeps SchemaFields before
+# reloading them anyway, in case the cache isn't shared between
+# processes.
+SCHEMAFIELD_REGISTRY_MAX_AGE = 60 * 5
+
+# How many schemas update_aggregates refreshes concurrently by default,
+# each in its own process and database connection.
+AGGREGATE_PROCESSES = 1
+
+# How far before the start of its run update_aggregates --incremental
+# sets AggregateAll.updated_through. A NewsItem saved just before the
+# run, in a transaction that commits after the run has read it, would
+# otherwise never be counted; so this should be at least as long as
+# any transaction that saves NewsItems.
+AGGREGATE_UPDATE_SAFETY_MARGIN = datetime.timedelta(hours=1)
+
+# Simplified copies of each Location's geometry, as (resolution name,
+# tolerance in degrees). API and map views choose one with a
+# ``resolution`` query parameter; without one, they use the full
+# geometry. The database trigger in
+# ebpub/db/migrations/0030_location_simplified_geometries.py keeps the
+# Location.location_simplified_* fields up to date with these tolerances.
+LOCATION_RESOLUTIONS = (
+    ('high', 0.0001),    # About 10 meters; for street-level maps.
+    ('medium', 0.001),   # About 100 meters; for neighborhood maps.
+    ('low', 0.01),       # About 1 kilometer; for whole-city maps.
+    )
@@ -0,0 +1,233 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+In-memory spatial index of Locations, so that scrapers and importers
+can find which Locations contain a point without a database query::
+
+    from ebpub.db.locationindex import location_index
+    for loc in location_index.locations_containing(point):
+        print loc.id, loc.name
+
+Bounding boxes go in an R-tree packed with the Sort-Tile-Recursive
+algorithm, and candidates are checked against prepared GEOS
+geometries.
+"""
+
+from collections import namedtuple
+from ebpub.utils.registry import Registry
+from math import ceil, sqrt
+import logging
+
+logger = logging.getLogger('ebpub.db.locationindex')
+
+# What the index returns for each matching Location.
+IndexedLocation = namedtuple('IndexedLocation',
+                             'id name slug location_type_slug location_type_name')
+
+
+def _box_union(entries):
+    return (min([e[0][0] for e in entries]), min([e[0][1] for e in entries]),
+            max([e[0][2] for e in entries]), max([e[0][3] for e in entries]))
+
+def _center_x(entry):
+    return entry[0][0] + entry[0][2]
+
+def _center_y(entry):
+    return entry[0][1] + entry[0][3]
+
+
+class STRtree(object):
+    """
+    A read-only R-tree of bounding boxes, each (xmin, ymin, xmax, ymax),
+    for finding which of many items' boxes overlap a given box.
+
+    >>> tree = STRtree([((0, 0, 1, 1), 'a'), ((2, 2, 3, 3), 'b'),
+    ...                 ((0.5, 0.5, 2.5, 2.5), 'c')])
+    >>> sorted(tree.query((0.8, 0.8, 0.8, 0.8)))
+    ['a', 'c']
+    >>> sorted(tree.query((0, 0, 3, 3)))
+    ['a', 'b', 'c']
+    >>> tree.query((5, 5, 6, 6))
+    []
+    """
+
+    # Maximum number of children of each node.
+    node_capacity = 10
+
+    def __init__(self, items, node_capacity=None):
+        if node_capacity is not None:
+            self.node_capacity = node_capacity
+        # Each entry is (box, children, item); leaves have no children.
+        entries = [(tuple(box), None, item) for box, item in items]
+        self._len = len(entries)
+        while len(entries) > self.node_capacity:
+            entries = self._pack(entries)
+        self._root = entries
+
+    def __len__(self):
+        return self._len
+
+    def _pack(self, entries):
+        # Sort by x into vertical slices of about sqrt(number of
+        # nodes) nodes each, then each slice by y into nodes.
+        capacity = self.node_capacity
+        num_nodes = int(ceil(len(entries) / float(capacity)))
+        slice_size = int(ceil(sqrt(num_nodes))) * capacity
+        entries = sorted(entries, key=_center_x)
+        nodes = []
+        for i in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[i:i + slice_size], key=_center_y)
+            for j in range(0, len(vertical_slice), capacity):
+                children = vertical_slice[j:j + capacity]
+                nodes.append((_box_union(children), children, None))
+        return nodes
+
+    def query(self, box):
+        """
+        Returns a list of the items whose boxes overlap the given box.
+        """
+        xmin, ymin, xmax, ymax = box
+        results = []
+        stack = [self._root]
+        while stack:
+            for entry_box, children, item in stack.pop():
+                if (entry_box[0] <= xmax and xmin <= entry_box[2]
+                    and entry_box[1] <= ymax and ymin <= entry_box[3]):
+                    if children is None:
+                        results.append(item)
+                    else:
+                        stack.append(children)
+        return results
+
+
+class LocationIndex(object):
+    """
+    Finds the Locations whose geometries contain or intersect a given
+    geometry, using an STRtree of their extents and prepared
+    geometries.
+    """
+
+    def __init__(self, locations=None):
+        """
+        Indexes the given Locations, or by default, all except
+        'custom' ones drawn by users.
+        """
+        if locations is None:
+            from ebpub.db.models import Location, SIMPLIFIED_LOCATION_FIELDS
+            locations = Location.objects.filter(location__isnull=False)
+            locations = locations.exclude(location_type__slug='custom')
+            locations = locations.select_related('location_type').defer(
+                *SIMPLIFIED_LOCATION_FIELDS)
+        items = []
+        for loc in locations:
+            if loc.location is None or loc.location.empty:
+                continue
+            info = IndexedLocation(loc.id, loc.name, loc.slug,
+                                   loc.location_type.slug, loc.location_type.name)
+            # Keep the geometry too; the prepared geometry needs it.
+            items.append((loc.location.extent, (info, loc.location, loc.location.prepared)))
+        self._tree = STRtree(items)
+
+    def __len__(self):
+        return len(self._tree)
+
+    def _matches(self, geom, predicate, location_type):
+        results = []
+        for info, unused, prepared in self._tree.query(geom.extent):
+            if location_type is not None and info.location_type_slug != location_type:
+                continue
+            if getattr(prepared, predicate)(geom):
+                results.append(info)
+        # Same order as Location.objects.
+        results.sort(key=lambda info: info.slug)
+        return results
+
+    def locations_containing(self, point, location_type=None):
+        """
+        Returns a list of IndexedLocations for the Locations that
+        contain the given point (or other geometry), optionally only
+        those with the given LocationType slug.
+        """
+        return self._matches(point, 'contains', location_type)
+
+    def locations_intersecting(self, geom, location_type=None):
+        """
+        Like locations_containing(), but for Locations that intersect
+        the given geometry.
+        """
+        return self._matches(geom, 'intersects', location_type)
+
+
+class LocationIndexRegistry(Registry):
+    """
+    Keeps the process-wide LocationIndex, building it the first time
+    it's needed.
+
+    Like ebpub.geocoder.names.NameRegistry, saving or deleting a
+    Location throws it away in this process (see the signal handlers
+    at the bottom of ebpub.db.models), and changes a version key in
+    the Django cache so that other processes notice within
+    check_interval seconds. See ebpub.utils.registry.Registry for
+    details.
+    """
+
+    version_cache_key = 'db_location_index_version'
+
+    # Building it loads every Location geometry, so don't check (or,
+    # with an unshared cache, rebuild) as often as other registries.
+    check_interval = 60
+
+    def _load(self):
+        logger.debug('Building location index')
+        return LocationIndex()
+
+    def locations_containing(self, point, location_type=None):
+        return self.get_data().locations_containing(point, location_type)
+
+    def locations_intersecting(self, geom, location_type=None):
+        return self.get_data().locations_intersecting(geom, location_type)
+
+location_index = LocationIndexRegistry()
+
+def invalidate_location_index(sender, **kwargs):
+    """
+    Signal handler for changes to Locations.
+    """
+    location_index.invalidate()
+
+def _city_locations(method, geom):
+    from ebpub.metros.allmetros import get_metro
+    metro = get_metro()
+    if not metro['multiple_cities']:
+        return []
+    return [info for info in getattr(location_index, method)(geom, metro['city_location_type'])
+            if not info.location_type_name.startswith('Unknown')]
+
+def city_locations_containing(geom):
+    """
+    Like ebpub.db.models.get_city_locations(), but only those that
+    contain geom, from the location_index.
+    """
+    return _city_locations('locations_containing', geom)
+
+def city_locations_intersecting(geom):
+    """
+    Like city_locations_containing(), but those that intersect geom.
+    """
+    return _city_locations('locations_intersecting', geom)
@@ -28,8 +28,10 @@ from ebpub.db import constants
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.geodjango import flatten_geomcollection
 from ebpub.utils.geodjango import ensure_valid
+from ebpub.utils.registry import Registry
 from ebpub.utils.text import slugify
 from .fields import OpenblockImageField
+from contextlib import contextmanager
 
 import datetime
 import logging
@@ -64,13 +66,70 @@ def field_mapping(schema_id_list):
         {1: {u'crime_type': 'varchar01', u'crime_date', 'date01'},
          2: {u'permit_number': 'varchar01', 'to_date': 'date01'},
         }
+
+    This doesn't hit the database, unless schemafield_registry needs
+    to be (re)loaded.
     """
     result = {}
-    for sf in SchemaField.objects.filter(schema__id__in=(schema_id_list)).values('schema', 'name', 'real_name'):
-        result.setdefault(sf['schema'], {})[sf['name']] = sf['real_name']
+    for schema_id in schema_id_list:
+        for sf in schemafield_registry.get_fields(schema_id):
+            result.setdefault(schema_id, {})[sf.name] = sf.real_name
     return result
 
 
+class SchemaFieldRegistry(Registry):
+    """
+    Process-local cache of all SchemaFields (with their Schemas),
+    grouped by Schema ID and ordered by display_order.
+
+    Schema metadata almost never changes, but it's needed every time
+    we touch NewsItem.attributes, so we load it all in one query and
+    keep it around.  Saving or deleting a Schema or SchemaField clears
+    the registry in this process (see the signal handlers at the
+    bottom of this module), and changes a version key in the Django
+    cache so that other processes notice within
+    constants.SCHEMAFIELD_REGISTRY_CHECK_INTERVAL seconds. See
+    ebpub.utils.registry.Registry for details.
+
+    Don't modify the SchemaField instances returned; they're shared.
+    """
+
+    version_cache_key = 'schemafield_registry_version'
+    check_interval = constants.SCHEMAFIELD_REGISTRY_CHECK_INTERVAL
+    max_age = constants.SCHEMAFIELD_REGISTRY_MAX_AGE
+
+    def _load(self):
+        fields_by_schema = {}
+        for sf in SchemaField.objects.select_related('schema').order_by('display_order'):
+            fields_by_schema.setdefault(sf.schema_id, []).append(sf)
+        return fields_by_schema
+
+    def get_fields(self, schema_id, **flags):
+        """
+        Returns a list of SchemaFields for the given Schema ID, ordered
+        by display_order.
+
+        Optional keyword args filter on SchemaField attributes,
+        eg. get_fields(schema.id, is_filter=True).
+        """
+        fields = self.get_data().get(schema_id, ())
+        return [sf for sf in fields
+                if all(getattr(sf, key) == val for key, val in flags.items())]
+
+    def get_field(self, schema_id, name):
+        """
+        Returns the SchemaField with the given name, or raises
+        SchemaField.DoesNotExist.
+        """
+        for sf in self.get_data().get(schema_id, ()):
+            if sf.name == name:
+                return sf
+        raise SchemaField.DoesNotExist(
+            'No SchemaField %r for schema %r' % (name, schema_id))
+
+schemafield_registry = SchemaFieldRegistry()
+
+
 class SchemaQuerySet(models.query.GeoQuerySet):
 
     def update(self, *args, **kwargs):
@@ -371,6 +430,13 @@ class LocationType(models.Model):
     objects = LocationTypeManager()
 
 
+# The Location fields holding simplified geometries, which queries of
+# many Locations should usually defer(). (We don't defer them in a
+# default manager, because Django 1.3 can't serialize instances of
+# deferred models, and save() would load each deferred field first.)
+SIMPLIFIED_LOCATION_FIELDS = tuple(['location_simplified_%s' % resolution
+                                    for resolution, tolerance in constants.LOCATION_RESOLUTIONS])
+
 class LocationManager(models.GeoManager):
     def get_by_natural_key(self, slug, location_type_slug):
         return self.get(slug=slug, location_type__slug=location_type_slug)
@@ -390,6 +456,14 @@ class Location(models.Model):
         # the db trigger is created by ebpub/db/migrations/0004_st_intersects_patch.py.
         )
     population = models.IntegerField(blank=True, null=True) # from the 2000 Census
+    # Simplified copies of self.location; see constants.LOCATION_RESOLUTIONS.
+    # These are populated automatically by the same db trigger as area.
+    location_simplified_high = models.GeometryField(null=True, blank=True, editable=False,
+                                                    spatial_index=False)
+    location_simplified_medium = models.GeometryField(null=True, blank=True, editable=False,
+                                                      spatial_index=False)
+    location_simplified_low = models.GeometryField(null=True, blank=True, editable=False,
+                                                   spatial_index=False)
     user_id = models.IntegerField(
         blank=True, null=True,
         help_text="Used for 'custom' Locations created by end users.")
@@ -412,6 +486,20 @@ class Location(models.Model):
             DeprecationWarning)
         return self.location.centroid
 
+    def simplified_location(self, resolution=None):
+        """
+        Returns self.location simplified for the named resolution, one
+        of those in constants.LOCATION_RESOLUTIONS; or the full
+        geometry if resolution is None or 'full', or if the simplified
+        one hasn't been saved yet. Raises ValueError for any other
+        resolution.
+        """
+        if resolution in (None, 'full'):
+            return self.location
+        if resolution not in dict(constants.LOCATION_RESOLUTIONS):
+            raise ValueError('Unknown resolution %r' % resolution)
+        return getattr(self, 'location_simplified_%s' % resolution) or self.location
+
     def clean(self):
         if self.location:
             try:
@@ -491,6 +579,95 @@ class LocationSynonym(models.Model):
     def __unicode__(self):
         return self.pretty_name
 
+class LocationNeighbor(models.Model):
+    """
+    A significant Location near another Location, as found by
+    ebpub.db.utils.get_locations_near_place(), which keeps these
+    up to date.
+    """
+    location = models.ForeignKey(Location, related_name='neighbor_links')
+    neighbor = models.ForeignKey(Location, related_name='neighbor_of')
+    display_order = models.SmallIntegerField()
+
+    class Meta:
+        unique_together = (('location', 'neighbor'),)
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.location, self.neighbor)
+
+class BlockNeighbor(models.Model):
+    """
+    Like LocationNeighbor, for a Block and a block radius (see
+    ebpub.constants.BLOCK_RADIUS_CHOICES).
+
+    block_id isn't a ForeignKey, to keep db independent of streets;
+    rows for deleted Blocks are never looked at, and are cleared out
+    along with everything else by
+    ebpub.db.utils.refresh_location_neighbors().
+    """
+    block_id = models.IntegerField()
+    block_radius = models.SmallIntegerField()
+    neighbor = models.ForeignKey(Location, related_name='block_neighbor_of')
+    display_order = models.SmallIntegerField()
+
+    class Meta:
+        unique_together = (('block_id', 'block_radius', 'neighbor'),)
+
+    def __unicode__(self):
+        return u'Block %s (%s) - %s' % (self.block_id, self.block_radius, self.neighbor)
+
+def _lookup_ids(value):
+    """
+    Returns a list of Lookup IDs from a many-to-many lookup attribute
+    value, which is normally a comma-separated string of IDs as stored
+    in the Attribute table, but may also be a Lookup, an int, or a
+    list of those.
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, basestring):
+        value = value.split(',')
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    ids = []
+    for val in value:
+        if isinstance(val, Lookup):
+            val = val.id
+        val = unicode(val).strip()
+        if val.isdigit() and int(val) not in ids:
+            ids.append(int(val))
+    return ids
+
+def sync_many_to_many_lookups(news_item_id, schema_id, values):
+    """
+    Keeps the NewsItemLookup table in sync with many-to-many lookup
+    attribute values.
+
+    ``values`` is a dictionary mapping SchemaField names to new
+    attribute values; fields that aren't many-to-many lookups,
+    or aren't in ``values``, are left alone.
+
+    You shouldn't need to call this yourself, as long as you
+    assign to NewsItem.attributes.
+    """
+    cursor = connection.cursor()
+    table = NewsItemLookup._meta.db_table
+    for sf in schemafield_registry.get_fields(schema_id, is_lookup=True):
+        if sf.name not in values or not sf.is_many_to_many_lookup():
+            continue
+        cursor.execute("DELETE FROM %s WHERE news_item_id = %%s AND schema_field_id = %%s" % table,
+                       [news_item_id, sf.id])
+        ids = _lookup_ids(values[sf.name])
+        if ids:
+            # Select from db_lookup so we silently skip bogus IDs
+            # rather than violating a foreign key constraint.
+            cursor.execute("""
+                INSERT INTO %s (news_item_id, schema_field_id, lookup_id)
+                SELECT %%s, %%s, id FROM %s
+                WHERE schema_field_id = %%s AND id IN (%s)""" % (
+                    table, Lookup._meta.db_table, ','.join(['%s' for i in ids])),
+                [news_item_id, sf.id, sf.id] + ids)
+
 class AttributesDescriptor(object):
     """
     This class provides the functionality that makes the attributes available
@@ -529,6 +706,8 @@ class AttributesDescriptor(object):
                 INSERT INTO %s (news_item_id, schema_id, %s)
                 VALUES (%%s, %%s, %s)""" % (Attribute._meta.db_table, ','.join([v for k, v in mapping]), ','.join(['%s' for k in mapping])),
                 [instance.id, instance.schema_id] + values)
+        sync_many_to_many_lookups(instance.id, instance.schema_id,
+                                  dict([(k, value.get(k, None)) for k, v in mapping]))
         transaction.commit_unless_managed()
 
 class AttributeDict(dict):
@@ -590,11 +769,114 @@ class AttributeDict(dict):
                 INSERT INTO %s (news_item_id, schema_id, %s)
                 VALUES (%%s, %%s, %%s)""" % (Attribute._meta.db_table, real_name),
                 [self.news_item_id, self.schema_id, value])
+        sync_many_to_many_lookups(self.news_item_id, self.schema_id, {name: value})
         transaction.commit_unless_managed()
         dict.__setitem__(self, name, value)
 
 class NewsItemQuerySet(models.query.GeoQuerySet):
 
+    # Set by with_attributes().
+    _preload_attributes = False
+    _preload_lookups = True
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('_preload_attributes', self._preload_attributes)
+        kwargs.setdefault('_preload_lookups', self._preload_lookups)
+        return super(NewsItemQuerySet, self)._clone(*args, **kwargs)
+
+    def with_attributes(self, get_lookups=True):
+        """
+        Returns a clone of this QuerySet that, when evaluated, preloads
+        the ``attributes`` of every NewsItem in bulk, along with their
+        Schemas.
+
+        This costs a constant number of queries per chunk of results
+        (see constants.ATTRIBUTE_PRELOAD_CHUNK_SIZE), instead of several
+        queries per NewsItem.  Useful whenever you're going to
+        serialize all the attributes of a lot of NewsItems.
+
+        If get_lookups is True, Lookup values are dereferenced into
+        Lookup instances, as per ebpub.db.utils.populate_attributes().
+        """
+        return self._clone(_preload_attributes=True,
+                           _preload_lookups=get_lookups)
+
+    def iterator(self):
+        if not self._preload_attributes:
+            for obj in super(NewsItemQuerySet, self).iterator():
+                yield obj
+            return
+        from ebpub.db.utils import populate_attributes
+        chunk = []
+        for obj in super(NewsItemQuerySet, self).iterator():
+            chunk.append(obj)
+            if len(chunk) >= constants.ATTRIBUTE_PRELOAD_CHUNK_SIZE:
+                populate_attributes(chunk, get_lookups=self._preload_lookups)
+                for item in chunk:
+                    yield item
+                chunk = []
+        populate_attributes(chunk, get_lookups=self._preload_lookups)
+        for item in chunk:
+            yield item
+
+    def after_item(self, item_date, item_id, descending=True):
+        """
+        Returns a QuerySet of the NewsItems that come after the one
+        with the given item_date and id, when ordered by
+        ``('-item_date', '-id')`` -- or ``('item_date', 'id')`` if
+        descending is False.
+
+        This is "keyset" pagination: unlike slicing with an offset, the
+        database doesn't have to scan all the preceding items, so deep
+        pages are as fast as the first. Note that it doesn't set the
+        ordering for you.
+        """
+        op = descending and '<' or '>'
+        return self.extra(
+            where=['(db_newsitem.item_date, db_newsitem.id) %s (%%s, %%s)' % op],
+            params=[item_date, item_id])
+
+    def top_n_per_schema(self, n_by_schema):
+        """
+        Returns a QuerySet of at most N NewsItems per Schema, where
+        ``n_by_schema`` maps Schema IDs to N; Schemas not in
+        ``n_by_schema`` are excluded.
+
+        The first N per Schema are chosen according to this QuerySet's
+        ordering, which must be on NewsItem's own fields, eg.
+        ``order_by('-item_date', '-id')``. The result keeps that
+        ordering, so items from different Schemas are interleaved.
+
+        This uses a single query with a window function (so it needs
+        PostgreSQL 8.4 or later), rather than one query per Schema.
+        """
+        n_by_schema = dict([(int(k), int(v)) for k, v in n_by_schema.items() if v > 0])
+        if not n_by_schema:
+            return self.none()
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        order_by = self.query.order_by or self.model._meta.ordering
+        order_sql = []
+        for name in order_by:
+            desc = name.startswith('-')
+            field = self.model._meta.get_field(name.lstrip('-'))
+            order_sql.append('%s.%s %s' % (table, qn(field.column), desc and 'DESC' or 'ASC'))
+        clone = self.filter(schema__id__in=n_by_schema.keys())
+        ranked = clone.order_by().extra(
+            select={'schema_rank': 'row_number() OVER (PARTITION BY %s.%s ORDER BY %s)' % (
+                    table, qn('schema_id'), ', '.join(order_sql))})
+        ranked = ranked.values('id', 'schema', 'schema_rank')
+        ranked_sql, ranked_params = ranked.query.get_compiler(using=self.db).as_sql()
+        limits = sorted(n_by_schema.items())
+        case_sql = 'CASE ranked.schema_id %s END' % ' '.join(['WHEN %s THEN %s' for i in limits])
+        case_params = []
+        for schema_id, n in limits:
+            case_params.extend([schema_id, n])
+        return clone.extra(
+            where=['%s.%s IN (SELECT ranked.id FROM (%s) AS ranked WHERE ranked.schema_rank <= %s)' % (
+                    table, qn('id'), ranked_sql, case_sql)],
+            params=list(ranked_params) + case_params)
+
     def prepare_attribute_qs(self):
         clone = self._clone()
         if 'db_attribute' not in clone.query.extra_tables:
@@ -619,7 +901,11 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
         query.
         """
 
-        clone = self.prepare_attribute_qs()
+        if schema_field.is_many_to_many_lookup():
+            # No need to join on db_attribute; see below.
+            clone = self._clone()
+        else:
+            clone = self.prepare_attribute_qs()
         real_name = str(schema_field.real_name)
         if not isinstance(att_value, (list, tuple)):
             att_value = [att_value]
@@ -636,13 +922,16 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
                 return clone
             att_value = [val.id for val in att_value]
         if schema_field.is_many_to_many_lookup():
-            # We have to use a regular expression search to look for all rows
-            # with the given att_value *somewhere* in the column. The [[:<:]]
-            # thing is a word boundary.
+            # Many-to-many values are stored as comma-separated
+            # strings, which can't be indexed usefully; so we use the
+            # normalized copy in NewsItemLookup instead.
             for value in att_value:
                 if not str(value).isdigit():
                     raise ValueError('Only integer strings allowed for att_value in many-to-many SchemaFields')
-            clone = clone.extra(where=("db_attribute.%s ~ '[[:<:]]%s[[:>:]]'" % (real_name, '|'.join([str(val) for val in att_value])),))
+            clone = clone.extra(
+                where=("db_newsitem.id IN (SELECT news_item_id FROM %s WHERE schema_field_id = %%s AND lookup_id IN (%s))" % (
+                        NewsItemLookup._meta.db_table, ','.join(['%s' for val in att_value])),),
+                params=[schema_field.id] + [int(val) for val in att_value])
         elif None in att_value:
             if att_value != [None]:
                 raise ValueError('by_attribute() att_value list cannot have more than one element if it includes None')
@@ -669,35 +958,16 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
         """
         real_name = "db_attribute." + str(schema_field.real_name)
         if schema_field.is_many_to_many_lookup():
-            # First prepare a subquery to get a *single* count of
-            # attribute rows that match each relevant m2m lookup
-            # value.  It's very important to get a single row here or
-            # else we get a DataBaseError with "more than one row
-            # returned by a subquery used as an expression". (Bug #146)
-            clone = self.prepare_attribute_qs()
-            clone = clone.filter(schema__id=schema_field.schema_id)
-            # This is a regex search for the lookup id.
-            clone = clone.extra(where=[real_name + " ~ ('[[:<:]]' || db_lookup.id || '[[:>:]]')"])
-            # We want to count the current queryset and get a single
-            # row for injecting into the subsequent Lookup query, but
-            # we don't want Django's aggregation support to
-            # automatically group by fields that aren't relevant and
-            # would cause multiple rows as a result. So we call
-            # `values()' on a field that we're already filtering by,
-            # in this case, schema, as essentially a harmless identify
-            # function.
-            # See http://docs.djangoproject.com/en/dev/topics/db/aggregation/#values
-            clone = clone.values('schema')
-
-            # Fix #146: Having any `ORDER BY foo` in this subquery causes
-            # Django to also add a `GROUP BY foo`, which potentially
-            # returns multiple rows. So, remove the ordering.
-            clone = clone.order_by()
-            clone = clone.annotate(count=Count('schema'))
-            # Unusual: We don't run the clone query, we just stuff its SQL
-            # into our Lookup qs.
-            qs = Lookup.objects.filter(schema_field__id=schema_field.id)
-            qs = qs.extra(select={'lookup_id': 'id', 'item_count': clone.values('count').query})
+            # Count the indexed NewsItemLookup rows for the items in
+            # this queryset, grouped by Lookup. The ordering is
+            # irrelevant in the subquery, so drop it.
+            item_ids = self.filter(schema__id=schema_field.schema_id).order_by().values('id')
+            lookup_col = NewsItemLookup._meta.db_table + '.lookup_id'
+            qs = NewsItemLookup.objects.filter(schema_field__id=schema_field.id,
+                                               news_item__in=item_ids)
+            qs = qs.extra(select={'lookup_id': lookup_col})
+            qs.query.group_by = [lookup_col]
+            qs = qs.values('lookup_id').annotate(item_count=Count('id'))
         else:
             # Counts of attribute rows matching each relevant Lookup.
             # Much easier when is_many_to_many_lookup == False :-)
@@ -756,6 +1026,15 @@ class NewsItemManager(models.GeoManager):
     def by_request(self, request):
         return self.get_query_set().by_request(request)
 
+    def with_attributes(self, *args, **kwargs):
+        return self.get_query_set().with_attributes(*args, **kwargs)
+
+    def top_n_per_schema(self, *args, **kwargs):
+        return self.get_query_set().top_n_per_schema(*args, **kwargs)
+
+    def after_item(self, *args, **kwargs):
+        return self.get_query_set().after_item(*args, **kwargs)
+
 class NewsItem(models.Model):
     """
     Lowest common denominator metadata for News-like things.
@@ -889,7 +1168,7 @@ class NewsItem(models.Model):
         Return a list of AttributeForTemplate objects for this NewsItem. The
         objects are ordered by SchemaField.display_order.
         """
-        fields = SchemaField.objects.filter(schema__id=self.schema_id).select_related().order_by('display_order')
+        fields = schemafield_registry.get_fields(self.schema_id)
         if not fields:
             return []
         if not self.attributes:
@@ -911,9 +1190,9 @@ class AttributeForTemplate(object):
             # Don't do unnecessary work.
             if isinstance(self.raw_value, Lookup):
                 self.values = [self.raw_value]
-            elif (isinstance(self.raw_value, list) and self.raw_value
-                  and isinstance(self.raw_value[0], Lookup)):
-                self.values = self.raw_values
+            elif isinstance(self.raw_value, list):
+                # Many-to-many lookups that were already dereferenced.
+                self.values = self.raw_value
             elif self.raw_value is None or self.raw_value == '':
                 self.values = []
             elif self.sf.is_many_to_many_lookup():
@@ -1104,14 +1383,151 @@ class Lookup(models.Model):
     def __unicode__(self):
         return u'%s - %s' % (self.schema_field, self.name)
 
+class NewsItemLookup(models.Model):
+    """
+    Many-to-many mapping of NewsItems to the Lookups in their
+    many-to-many lookup attributes.
+
+    This duplicates the comma-separated IDs stored in the Attribute
+    table, in a form we can index, for fast filtering and counting.
+    It's maintained automatically when you assign to
+    NewsItem.attributes; if you write to the Attribute table some
+    other way, run the ``sync_m2m_lookups`` script.
+    """
+    news_item = models.ForeignKey(NewsItem)
+    schema_field = models.ForeignKey(SchemaField)
+    lookup = models.ForeignKey(Lookup)
+
+    class Meta:
+        unique_together = (('lookup', 'news_item'),)
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.news_item, self.lookup)
+
+class NewsItemLocationManager(models.Manager):
+    """
+    Controls the trigger that populates NewsItemLocations.
+
+    Normally the trigger finds the Locations of each NewsItem as it's
+    saved, which is slow for bulk loads. After defer_trigger(), it
+    just records the IDs of NewsItems whose location changed in the
+    db_newsitemlocation_pending table, and reconcile() updates them
+    all at once. For example::
+
+        with NewsItemLocation.objects.deferred():
+            for item in items:
+                item.save()
+
+    Deleting a NewsItem still deletes its NewsItemLocations right away.
+    """
+
+    pending_table = 'db_newsitemlocation_pending'
+
+    # The trigger defers its work in sessions that have a temp table
+    # by this name (see the newsitem_location_deferred() function).
+    flag_table = 'ebpub_defer_newsitem_location'
+
+    def is_trigger_deferred(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT newsitem_location_deferred()")
+        return cursor.fetchone()[0]
+
+    def defer_trigger(self):
+        """
+        Defer NewsItemLocation updates for the rest of this database
+        session, or until undefer_trigger().
+
+        If the current transaction is rolled back, so is this.
+        """
+        if not self.is_trigger_deferred():
+            cursor = connection.cursor()
+            cursor.execute("CREATE TEMP TABLE %s (flag integer)" % self.flag_table)
+
+    def undefer_trigger(self):
+        """
+        Go back to updating NewsItemLocations as NewsItems are saved.
+        Doesn't reconcile() anything that's pending.
+        """
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS pg_temp.%s" % self.flag_table)
+
+    def pending_count(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM %s" % self.pending_table)
+        return cursor.fetchone()[0]
+
+    def reconcile(self):
+        """
+        Replaces the NewsItemLocations of all pending NewsItems, using
+        the spatial index on db_location to find candidate Locations.
+        Returns the number of NewsItemLocations inserted.
+
+        Like the trigger, this checks each part of a geometry
+        collection separately.
+
+        NewsItems that become pending while this runs are left for
+        next time.
+        """
+        params = {'pending': self.pending_table,
+                  'claimed': 'ebpub_reconciling_newsitem_location',
+                  'newsitemlocation': self.model._meta.db_table,
+                  'newsitem': NewsItem._meta.db_table,
+                  'location': Location._meta.db_table}
+        cursor = connection.cursor()
+        # Claim the IDs that are pending now.
+        cursor.execute("DROP TABLE IF EXISTS pg_temp.%(claimed)s" % params)
+        cursor.execute("""
+            CREATE TEMP TABLE %(claimed)s AS SELECT news_item_id FROM %(pending)s
+        """ % params)
+        # This waits for any transactions that have updated those
+        # NewsItems (the trigger locks their pending rows), so the
+        # following statements see their new locations.
+        cursor.execute("""
+            DELETE FROM %(pending)s p USING %(claimed)s c
+            WHERE p.news_item_id = c.news_item_id
+        """ % params)
+        cursor.execute("""
+            DELETE FROM %(newsitemlocation)s nil USING %(claimed)s c
+            WHERE nil.news_item_id = c.news_item_id
+        """ % params)
+        cursor.execute("""
+            INSERT INTO %(newsitemlocation)s (news_item_id, location_id)
+            SELECT DISTINCT parts.id, loc.id
+            FROM (SELECT ni.id, (ST_Dump(ni.location)).geom AS geom
+                  FROM %(newsitem)s ni, %(claimed)s c
+                  WHERE ni.id = c.news_item_id AND ni.location IS NOT NULL
+                  ) AS parts, %(location)s loc
+            WHERE loc.location && parts.geom
+                AND intersecting_collection(parts.geom, loc.location)
+        """ % params)
+        count = cursor.rowcount
+        cursor.execute("DROP TABLE pg_temp.%(claimed)s" % params)
+        transaction.commit_unless_managed()
+        return count
+
+    @contextmanager
+    def deferred(self):
+        """
+        Context manager that defers NewsItemLocation updates,
+        then reconciles them and stops deferring on exit.
+        """
+        self.defer_trigger()
+        try:
+            yield
+        finally:
+            self.undefer_trigger()
+        self.reconcile()
+
 class NewsItemLocation(models.Model):
     """
     Many-to-many mapping of NewsItems to Locations where the geometries intersect.
-    Populated by triggers.
+    Populated by triggers; see NewsItemLocationManager for bulk loads.
     """
     news_item = models.ForeignKey(NewsItem)
     location = models.ForeignKey(Location)
 
+    objects = NewsItemLocationManager()
+
     class Meta:
         unique_together = (('news_item', 'location'),)
 
@@ -1136,7 +1552,9 @@ class AggregateBaseClass(models.Model):
 class AggregateAll(AggregateBaseClass):
     """Total items in the schema.
     """
-    pass
+    updated_through = models.DateTimeField(
+        blank=True, null=True,
+        help_text="NewsItems with last_modification before this time have been counted in all aggregates for this schema. Used by incremental updates.")
 
 class AggregateDay(AggregateBaseClass):
     """Total items in the schema with item_date on the given day
@@ -1217,7 +1635,7 @@ def get_city_locations():
     if metro['multiple_cities']:
         cities = Location.objects.filter(location_type__slug=metro['city_location_type'])
         cities = cities.exclude(location_type__name__startswith='Unknown')
-        return cities
+        return cities.defer(*SIMPLIFIED_LOCATION_FIELDS)
     else:
         return Location.objects.filter(id=None)
 
@@ -1257,3 +1675,51 @@ def clear_allowed_schema_ids_cache(sender, **kwargs):
 post_update.connect(clear_allowed_schema_ids_cache, sender=Schema)
 post_save.connect(clear_allowed_schema_ids_cache, sender=Schema)
 post_delete.connect(clear_allowed_schema_ids_cache, sender=Schema)
+
+def invalidate_schemafield_registry(sender, **kwargs):
+    schemafield_registry.invalidate()
+
+post_update.connect(invalidate_schemafield_registry, sender=Schema)
+post_save.connect(invalidate_schemafield_registry, sender=Schema)
+post_delete.connect(invalidate_schemafield_registry, sender=Schema)
+post_save.connect(invalidate_schemafield_registry, sender=SchemaField)
+post_delete.connect(invalidate_schemafield_registry, sender=SchemaField)
+
+from ebpub.geocoder.names import invalidate_name_registry
+
+post_save.connect(invalidate_name_registry, sender=Location)
+post_delete.connect(invalidate_name_registry, sender=Location)
+post_save.connect(invalidate_name_registry, sender=LocationSynonym)
+post_delete.connect(invalidate_name_registry, sender=LocationSynonym)
+
+def clear_location_neighbors(sender, instance, created=False, **kwargs):
+    """
+    Signal handler that forgets the LocationNeighbors and
+    BlockNeighbors involving a Location, or the Locations of a
+    LocationType, when it changes; they're recomputed as needed.
+
+    Other places don't gain a new (or newly nearby, or newly
+    significant) Location as a neighbor until
+    ebpub.db.utils.refresh_location_neighbors() is run, as the
+    location import scripts do. Deleted Locations' rows are deleted
+    along with them.
+    """
+    if created:
+        # Nothing refers to it yet.
+        return
+    if sender is LocationType:
+        LocationNeighbor.objects.filter(location__location_type=instance).delete()
+        LocationNeighbor.objects.filter(neighbor__location_type=instance).delete()
+        BlockNeighbor.objects.filter(neighbor__location_type=instance).delete()
+    else:
+        LocationNeighbor.objects.filter(location=instance).delete()
+        LocationNeighbor.objects.filter(neighbor=instance).delete()
+        BlockNeighbor.objects.filter(neighbor=instance).delete()
+
+post_save.connect(clear_location_neighbors, sender=Location)
+post_save.connect(clear_location_neighbors, sender=LocationType)
+
+from ebpub.db.locationindex import invalidate_location_index
+
+post_save.connect(invalidate_location_index, sender=Location)
+post_delete.connect(invalidate_location_index, sender=Location)
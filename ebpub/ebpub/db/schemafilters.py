@@ -355,6 +355,7 @@ class LocationFilter(NewsitemFilter):
             return {}
         else:
             lookup_list = models.Location.objects.filter(location_type__slug=self.location_type_slug, is_public=True).order_by('display_order')
+            lookup_list = lookup_list.defer(*models.SIMPLIFIED_LOCATION_FIELDS)
             if not lookup_list:
                 raise FilterError("empty lookup list")
             location_type = lookup_list[0].location_type
@@ -6,6 +6,8 @@ truncate table db_attribute cascade;
 truncate table db_lookup cascade;
 truncate table db_newsitem cascade;
 truncate table db_newsitemlocation cascade;
+truncate table db_newsitemlocation_pending;
+truncate table db_newsitemlookup cascade;
 truncate table db_schemafield cascade;
 truncate table db_schema cascade;
 truncate table db_aggregate cascade;
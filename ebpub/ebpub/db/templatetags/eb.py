@@ -16,7 +16,8 @@
 #   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from ebpub.db.models import NewsItem, SchemaField
+from ebpub.db.models import NewsItem
+from ebpub.db.models import schemafield_registry
 from ebpub.db.utils import populate_attributes_if_needed
 from ebpub.utils.bunch import bunch, bunchlong, stride
 from ebpub.metros.allmetros import METRO_LIST, get_metro
@@ -197,7 +198,7 @@ class GetNewsItemListByAttributeNode(template.Node):
         schema_id = self.schema_id_variable.resolve(context)
         newsitem_id = self.newsitem_id_variable.resolve(context)
         att_value = self.att_value_variable.resolve(context)
-        sf = SchemaField.objects.select_related().get(schema__id=schema_id, name=self.att_name)
+        sf = schemafield_registry.get_field(schema_id, self.att_name)
         ni_list = NewsItem.objects.select_related().filter(schema__id=schema_id).exclude(id=newsitem_id).by_attribute(sf, att_value).order_by('-item_date')
         populate_attributes_if_needed(ni_list, [sf.schema])
 
@@ -24,3 +24,6 @@ if not settings.TEST_RUNNER.count('Nose'):
     from .test_models import *
     from .test_schemafilters import *
     from .test_templatetags import *
+    from .test_update_aggregates import *
+    from .test_import_locations import *
+    from .test_locationindex import *
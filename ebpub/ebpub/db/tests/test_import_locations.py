@@ -0,0 +1,50 @@
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests for the import_locations script.
+"""
+
+from ebpub.utils.django_testcase_backports import TestCase
+from ebpub.db.bin.import_locations import populate_ni_loc
+from ebpub.db.models import Location, NewsItem, NewsItemLocation
+
+class PopulateNewsItemLocationsTestCase(TestCase):
+    fixtures = ('test-locationdetail-views.json',)
+
+    def _make_item(self, item_id, loc):
+        return NewsItem.objects.create(id=item_id, schema_id=1, title='Populate me',
+                                       description='', location_name='Somewhere',
+                                       location=loc.location.point_on_surface)
+
+    def test_populate(self):
+        hood1, hood2 = Location.objects.get(id=2000), Location.objects.get(id=3000)
+        # IDs far beyond the number of NewsItems.
+        self._make_item(50000, hood1)
+        self._make_item(90000, hood2)
+        # Forget what the trigger did.
+        NewsItemLocation.objects.filter(news_item__id__gte=50000).delete()
+        self.assertEqual(populate_ni_loc([hood1, hood2], chunk_size=1000), 2)
+        self.assertEqual(list(NewsItem.objects.get(id=50000).location_set.all()), [hood1])
+        self.assertEqual(list(NewsItem.objects.get(id=90000).location_set.all()), [hood2])
+        # Existing NewsItemLocations are left alone.
+        self.assertEqual(populate_ni_loc(hood1), 0)
+
+    def test_populate__no_newsitems(self):
+        NewsItem.objects.all().delete()
+        self.assertEqual(populate_ni_loc(Location.objects.all()), 0)
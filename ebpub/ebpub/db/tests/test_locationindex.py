@@ -0,0 +1,125 @@
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests for ebpub.db.locationindex.
+"""
+
+from django.contrib.gis.geos import Point
+from ebpub.db.locationindex import STRtree, LocationIndex, location_index
+from ebpub.db.models import Location
+from ebpub.utils.django_testcase_backports import TestCase
+import mock
+import random
+import unittest
+
+class STRtreeTestCase(unittest.TestCase):
+
+    def test_query__same_as_brute_force(self):
+        rand = random.Random(0)
+        items = []
+        for i in range(500):
+            x, y = rand.uniform(0, 100), rand.uniform(0, 100)
+            items.append(((x, y, x + rand.uniform(0, 5), y + rand.uniform(0, 5)), i))
+        tree = STRtree(items, node_capacity=4)
+        self.assertEqual(len(tree), 500)
+        for unused in range(50):
+            x, y = rand.uniform(0, 100), rand.uniform(0, 100)
+            box = (x, y, x + rand.uniform(0, 10), y + rand.uniform(0, 10))
+            expected = [i for b, i in items
+                        if b[0] <= box[2] and box[0] <= b[2] and b[1] <= box[3] and box[1] <= b[3]]
+            self.assertEqual(sorted(tree.query(box)), expected)
+
+    def test_empty(self):
+        self.assertEqual(STRtree([]).query((0, 0, 1, 1)), [])
+
+
+class LocationIndexTestCase(TestCase):
+    fixtures = ('test-locationdetail-views.json',)
+
+    def setUp(self):
+        location_index.clear()
+
+    def tearDown(self):
+        location_index.clear()
+
+    def _inside(self, loc_id):
+        return Location.objects.get(id=loc_id).location.point_on_surface
+
+    def test_locations_containing(self):
+        index = LocationIndex()
+        self.assertEqual(len(index), 2)
+        self.assertEqual([loc.id for loc in index.locations_containing(self._inside(2000))],
+                         [2000])
+        self.assertEqual([loc.name for loc in index.locations_containing(self._inside(3000))],
+                         ['Hood 2'])
+        self.assertEqual(index.locations_containing(Point(0, 0, srid=4326)), [])
+
+    def test_same_as_database(self):
+        index = LocationIndex()
+        for loc_id in (2000, 3000):
+            point = self._inside(loc_id)
+            expected = list(Location.objects.filter(location__contains=point).values_list('id', flat=True))
+            self.assertEqual([loc.id for loc in index.locations_containing(point)], expected)
+
+    def test_location_type(self):
+        point = self._inside(2000)
+        self.assertEqual(len(location_index.locations_containing(point, 'neighborhoods')), 1)
+        self.assertEqual(location_index.locations_containing(point, 'zipcodes'), [])
+
+    def test_locations_intersecting(self):
+        hood1 = Location.objects.get(id=2000)
+        results = location_index.locations_intersecting(hood1.location.centroid.buffer(1))
+        self.assertEqual(sorted(loc.id for loc in results), [2000, 3000])
+
+    def test_no_queries_once_loaded(self):
+        point = self._inside(2000)
+        location_index.locations_containing(point)
+        self.assertNumQueries(0, location_index.locations_containing, point)
+
+    def test_invalidated_on_save(self):
+        point = self._inside(2000)
+        self.assertEqual(len(location_index.locations_containing(point)), 1)
+        hood1 = Location.objects.get(id=2000)
+        hood1.location = Location.objects.get(id=3000).location
+        hood1.save()
+        self.assertEqual(location_index.locations_containing(point), [])
+
+    @mock.patch('ebpub.utils.registry.cache')
+    def test_invalidated_by_other_process(self, mock_cache):
+        mock_cache.get.return_value = 'version 1'
+        point = self._inside(2000)
+        self.assertEqual(len(location_index.locations_containing(point)), 1)
+        # Bypass the signals, as if another process did it.
+        Location.objects.filter(id=2000).update(
+            location=Location.objects.get(id=3000).location)
+        with mock.patch.object(location_index, 'check_interval', -1):
+            self.assertEqual(len(location_index.locations_containing(point)), 1)
+            mock_cache.get.return_value = 'version 2'
+            self.assertEqual(location_index.locations_containing(point), [])
+
+    @mock.patch('ebpub.utils.registry.cache')
+    def test_reloaded_when_old(self, mock_cache):
+        mock_cache.get.return_value = None
+        point = self._inside(2000)
+        self.assertEqual(len(location_index.locations_containing(point)), 1)
+        Location.objects.filter(id=2000).update(
+            location=Location.objects.get(id=3000).location)
+        self.assertEqual(len(location_index.locations_containing(point)), 1)
+        with mock.patch.object(location_index, 'max_age', -1):
+            self.assertEqual(location_index.locations_containing(point), [])
@@ -216,6 +216,66 @@ class DatabaseExtensionsTestCase(TestCase):
         self.assertEqual(top_lookups[1]['count'], 2)
         self.assertEqual(top_lookups[1]['lookup'].slug, u'tag-2')
 
+    def test_by_attribute__m2m(self):
+        from ebpub.db.models import SchemaField
+        sf = SchemaField.objects.get(name='tags many-to-many')
+        qs = NewsItem.objects.by_attribute(sf, [72], is_lookup=True)
+        self.assertEqual(sorted([ni.id for ni in qs]), [1, 2])
+        qs = NewsItem.objects.by_attribute(sf, [72, 73], is_lookup=True)
+        self.assertEqual(sorted([ni.id for ni in qs]), [1, 2])
+        qs = NewsItem.objects.by_attribute(sf, [73], is_lookup=True)
+        self.assertEqual([ni.id for ni in qs], [1])
+
+    def test_top_n_per_schema(self):
+        qs = NewsItem.objects.order_by('-item_date', '-id')
+        self.assertEqual([ni.id for ni in qs.top_n_per_schema({1: 2})], [3, 2])
+        self.assertEqual([ni.id for ni in qs.top_n_per_schema({1: 10})], [3, 2, 1])
+        qs = NewsItem.objects.order_by('item_date', 'id')
+        self.assertEqual([ni.id for ni in qs.top_n_per_schema({1: 2})], [1, 2])
+        # Other filters still apply.
+        qs = qs.filter(id__gt=1)
+        self.assertEqual([ni.id for ni in qs.top_n_per_schema({1: 1})], [2])
+        self.assertEqual(list(qs.top_n_per_schema({1: 0})), [])
+        self.assertEqual(list(qs.top_n_per_schema({2: 5})), [])
+
+    def test_m2m_lookups_synced_on_save(self):
+        from ebpub.db.models import NewsItemLookup
+        ni = NewsItem.objects.get(id=3)
+        ni.attributes['tags many-to-many'] = u'72,73'
+        self.assertEqual(
+            sorted(NewsItemLookup.objects.filter(news_item__id=3).values_list('lookup_id', flat=True)),
+            [72, 73])
+        ni.attributes['tags many-to-many'] = u''
+        self.assertEqual(NewsItemLookup.objects.filter(news_item__id=3).count(), 0)
+        # Other items are untouched.
+        self.assertEqual(NewsItemLookup.objects.filter(news_item__id=1).count(), 3)
+
+
+    def test_with_attributes(self):
+        # Attributes and Schemas for the whole result set are
+        # preloaded in a constant number of queries.
+        from django.db import connection
+        from ebpub.db.models import schemafield_registry
+        schemafield_registry.get_fields(1)  # Make sure it's loaded.
+        connection.queries = []
+        with self.settings(DEBUG=True):
+            items = list(NewsItem.objects.all().with_attributes())
+            self.assert_(len(items) > 1)
+            # NewsItems, Schemas, Attributes, Lookups.
+            self.assertEqual(len(connection.queries), 4)
+            for item in items:
+                item.schema.slug
+                item.attributes_for_template()
+            self.assertEqual(len(connection.queries), 4)
+        connection.queries = []
+        ni = items[0]
+        self.assertEqual(ni.attributes['case_number'], u'case number 1')
+        self.assertEqual(ni.attributes['beat'].slug, u'beat-214')
+
+    def test_with_attributes__no_lookups(self):
+        items = list(NewsItem.objects.filter(id=1).with_attributes(get_lookups=False))
+        self.assertEqual(items[0].attributes['beat'],
+                         NewsItem.objects.get(id=1).attributes['beat'])
 
     def test_allowed_schema_ids(self):
         from ebpub.db.models import Schema
@@ -237,3 +297,154 @@ class DatabaseExtensionsTestCase(TestCase):
         request = mock.Mock()
         self.assertEqual(NewsItem.objects.by_request(request).count(), 0)
         self.assertEqual(mock_get_schema_manager.call_count, 1)
+
+
+class SchemaFieldRegistryTestCase(TestCase):
+    fixtures = ('crimes.json',)
+
+    def test_no_queries_once_loaded(self):
+        from django.db import connection
+        from ebpub.db.models import schemafield_registry, field_mapping
+        schemafield_registry.get_fields(1)
+        connection.queries = []
+        with self.settings(DEBUG=True):
+            fields = schemafield_registry.get_fields(1, is_filter=True)
+            self.assert_(len(fields) > 0)
+            self.assert_(all(sf.is_filter for sf in fields))
+            self.assertEqual(field_mapping([1])[1]['case_number'], 'varchar01')
+            ni = NewsItem.objects.get(id=1)
+            ni.attributes_for_template()
+            # One for the NewsItem, one for its Attribute row.
+            self.assertEqual(len(connection.queries), 2)
+        connection.queries = []
+
+    def test_invalidated_on_save(self):
+        from ebpub.db.models import SchemaField, schemafield_registry
+        sf = SchemaField.objects.get(id=schemafield_registry.get_field(1, 'beat').id)
+        sf.name = 'beat2'
+        sf.save()
+        self.assertRaises(SchemaField.DoesNotExist,
+                          schemafield_registry.get_field, 1, 'beat')
+        self.assertEqual(schemafield_registry.get_field(1, 'beat2').id, sf.id)
+
+    @mock.patch('ebpub.utils.registry.cache')
+    def test_invalidated_by_other_process(self, mock_cache):
+        from ebpub.db.models import SchemaField, SchemaFieldRegistry
+        mock_cache.get.return_value = 'version 1'
+        registry = SchemaFieldRegistry()
+        self.assertEqual(registry.get_field(1, 'beat').name, 'beat')
+        # Bypass the signals, as if another process did it.
+        SchemaField.objects.filter(schema__id=1, name='beat').update(name='beat2')
+        with mock.patch.object(registry, 'check_interval', -1):
+            self.assertEqual(registry.get_field(1, 'beat').name, 'beat')
+            mock_cache.get.return_value = 'version 2'
+            self.assertEqual(registry.get_field(1, 'beat2').name, 'beat2')
+
+    @mock.patch('ebpub.utils.registry.cache')
+    def test_reloaded_when_old(self, mock_cache):
+        from ebpub.db.models import SchemaField, SchemaFieldRegistry
+        # Eg. a DummyCache, or another process changed things
+        # without invalidating.
+        mock_cache.get.return_value = None
+        registry = SchemaFieldRegistry()
+        self.assertEqual(registry.get_field(1, 'beat').name, 'beat')
+        SchemaField.objects.filter(schema__id=1, name='beat').update(name='beat2')
+        self.assertEqual(registry.get_field(1, 'beat').name, 'beat')
+        with mock.patch.object(registry, 'max_age', -1):
+            self.assertEqual(registry.get_field(1, 'beat2').name, 'beat2')
+
+    def test_not_shared_cache(self):
+        from django.core.cache.backends.dummy import DummyCache
+        from ebpub.db.models import SchemaFieldRegistry
+        registry = SchemaFieldRegistry()
+        with mock.patch('ebpub.utils.registry.cache', DummyCache('', {})):
+            self.assertEqual(registry._get_max_age(), registry.check_interval)
+
+
+class LocationTestCase(TestCase):
+    fixtures = ('test-locationdetail-views.json',)
+
+    def test_simplified_location(self):
+        from ebpub.db.models import Location
+        loc = Location.objects.get(id=2000)
+        self.assertEqual(loc.simplified_location(), loc.location)
+        self.assertEqual(loc.simplified_location('full'), loc.location)
+        low = loc.simplified_location('low')
+        self.assertEqual(low, loc.location_simplified_low)
+        self.assert_(low.num_points <= loc.location.num_points)
+        self.assertRaises(ValueError, loc.simplified_location, 'bogus')
+
+    def test_simplified_location__updated(self):
+        from ebpub.db.models import Location
+        loc = Location.objects.get(id=2000)
+        loc.location = Location.objects.get(id=3000).location
+        loc.save()
+        loc = Location.objects.get(id=2000)
+        self.assert_(loc.location_simplified_high.equals_exact(
+                Location.objects.get(id=3000).location_simplified_high))
+
+    def test_simplified_location__not_saved_yet(self):
+        from ebpub.db.models import Location
+        loc = Location.objects.get(id=2000)
+        loc.location_simplified_medium = None
+        self.assertEqual(loc.simplified_location('medium'), loc.location)
+
+
+class NewsItemLocationTestCase(TestCase):
+    fixtures = ('test-locationdetail-views.json',)
+
+    def _make_item(self, loc_id):
+        from ebpub.db.models import Location
+        point = Location.objects.get(id=loc_id).location.point_on_surface
+        return NewsItem.objects.create(schema_id=1, title='Deferred', description='',
+                                       location=point, location_name='Somewhere')
+
+    def test_updated_by_trigger(self):
+        item = self._make_item(2000)
+        self.assertEqual([loc.id for loc in item.location_set.all()], [2000])
+
+    def test_deferred(self):
+        from ebpub.db.models import NewsItemLocation
+        NewsItemLocation.objects.defer_trigger()
+        try:
+            item = self._make_item(2000)
+            self.assertEqual(item.location_set.count(), 0)
+            # Moving it is recorded only once.
+            from ebpub.db.models import Location
+            item.location = Location.objects.get(id=3000).location.point_on_surface
+            item.save()
+            self.assertEqual(item.location_set.count(), 0)
+            self.assertEqual(NewsItemLocation.objects.pending_count(), 1)
+        finally:
+            NewsItemLocation.objects.undefer_trigger()
+        self.assertEqual(NewsItemLocation.objects.reconcile(), 1)
+        self.assertEqual([loc.id for loc in item.location_set.all()], [3000])
+        self.assertEqual(NewsItemLocation.objects.pending_count(), 0)
+        # Other items are untouched.
+        self.assertEqual(NewsItemLocation.objects.filter(location__id=2000).count(), 2)
+
+    def test_deferred_context_manager(self):
+        from ebpub.db.models import NewsItemLocation
+        with NewsItemLocation.objects.deferred():
+            item = self._make_item(3000)
+            self.assertEqual(item.location_set.count(), 0)
+        self.assertEqual([loc.id for loc in item.location_set.all()], [3000])
+        # And we're no longer deferring.
+        item2 = self._make_item(2000)
+        self.assertEqual([loc.id for loc in item2.location_set.all()], [2000])
+
+    def test_defer_trigger_twice(self):
+        from ebpub.db.models import NewsItemLocation
+        self.failIf(NewsItemLocation.objects.is_trigger_deferred())
+        NewsItemLocation.objects.defer_trigger()
+        NewsItemLocation.objects.defer_trigger()
+        self.assert_(NewsItemLocation.objects.is_trigger_deferred())
+        NewsItemLocation.objects.undefer_trigger()
+        self.failIf(NewsItemLocation.objects.is_trigger_deferred())
+        NewsItemLocation.objects.undefer_trigger()
+
+    def test_queryset_defer_still_works(self):
+        from ebpub.db.models import NewsItemLocation
+        qs = NewsItemLocation.objects.defer('location')
+        self.assertEqual(qs.count(), NewsItemLocation.objects.count())
+        self.failIf(NewsItemLocation.objects.is_trigger_deferred())
@@ -0,0 +1,136 @@
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests for the update_aggregates script.
+"""
+
+from ebpub.utils.django_testcase_backports import TestCase
+from ebpub.db.bin.update_aggregates import update_aggregates, update_all_aggregates
+from ebpub.db.models import AggregateAll, AggregateDay, AggregateLocationDay
+from ebpub.db.models import Location, NewsItem, NewsItemLocation
+import datetime
+
+class UpdateAggregatesTestCase(TestCase):
+    fixtures = ('crimes.json',)
+
+    def _day_totals(self):
+        return dict(AggregateDay.objects.filter(schema__id=1).values_list('date_part', 'total'))
+
+    def test_full(self):
+        report = update_aggregates(1)
+        self.assertEqual(AggregateAll.objects.get(schema__id=1).total, 3)
+        self.assertEqual(self._day_totals(),
+                         {datetime.date(2006, 9, 26): 1, datetime.date(2006, 11, 8): 2})
+        self.assertEqual(report.tables['db_aggregateday']['inserted'], 2)
+        # Running again changes nothing.
+        report = update_aggregates(1)
+        stats = report.tables['db_aggregateday']
+        self.assertEqual((stats['inserted'], stats['updated'], stats['deleted']), (0, 0, 0))
+
+    def test_dry_run(self):
+        report = update_aggregates(1, dry_run=True)
+        self.assertEqual(report.tables['db_aggregateday']['inserted'], 2)
+        self.assertEqual(AggregateDay.objects.count(), 0)
+
+    def test_incremental__only_changed_days(self):
+        update_aggregates(1)
+        # Move a count to a bogus day; the sum stays consistent, so an
+        # incremental update shouldn't notice days that didn't change.
+        AggregateDay.objects.filter(date_part=datetime.date(2006, 9, 26)).update(total=0)
+        AggregateDay.objects.create(schema_id=1, date_part=datetime.date(2006, 1, 1), total=1)
+        # Only item 2 has changed since that update.
+        NewsItem.objects.update(last_modification=datetime.datetime(2000, 1, 1))
+        NewsItem.objects.get(id=2).save()
+        report = update_aggregates(1, incremental=True)
+        self.assertEqual(self._day_totals(),
+                         {datetime.date(2006, 1, 1): 1, datetime.date(2006, 9, 26): 0,
+                          datetime.date(2006, 11, 8): 2})
+        stats = report.tables['db_aggregateday']
+        self.assertEqual((stats['inserted'], stats['updated'], stats['deleted']), (0, 0, 0))
+
+    def test_incremental__falls_back_if_stale(self):
+        update_aggregates(1)
+        item = NewsItem.objects.get(id=3)
+        item.item_date = datetime.date(2006, 11, 9)
+        item.save()
+        NewsItem.objects.filter(id=1).delete()
+        update_aggregates(1, incremental=True)
+        self.assertEqual(self._day_totals(),
+                         {datetime.date(2006, 11, 8): 1, datetime.date(2006, 11, 9): 1})
+        self.assertEqual(AggregateAll.objects.get(schema__id=1).total, 2)
+
+    def test_incremental__safety_margin(self):
+        update_aggregates(1)
+        # Item 3 was saved just before that update started, but not
+        # committed until it was done. The sum stays consistent, so
+        # only the safety margin gets it counted.
+        NewsItem.objects.update(last_modification=datetime.datetime(2000, 1, 1))
+        NewsItem.objects.filter(id=3).update(
+            last_modification=datetime.datetime.now() - datetime.timedelta(minutes=1))
+        AggregateDay.objects.filter(date_part=datetime.date(2006, 11, 8)).update(total=1)
+        AggregateDay.objects.create(schema_id=1, date_part=datetime.date(2006, 1, 1), total=1)
+        update_aggregates(1, incremental=True)
+        self.assertEqual(self._day_totals()[datetime.date(2006, 11, 8)], 2)
+
+    def test_update_all__schemas(self):
+        from ebpub.db.models import Schema
+        slug = Schema.objects.get(id=1).slug
+        report = update_all_aggregates(schemas=[slug])
+        self.assertEqual(report.schemas.keys(), [slug])
+        self.assertEqual(AggregateAll.objects.get(schema__id=1).total, 3)
+        self.assertRaises(Schema.DoesNotExist, update_all_aggregates,
+                          schemas=[slug, 'no-such-schema'])
+
+    def test_main__schemas_and_processes(self):
+        from ebpub.db.bin.update_aggregates import main
+        from ebpub.db.models import Schema
+        slug = Schema.objects.get(id=1).slug
+        # Only one schema, so this doesn't actually start any workers.
+        main(['--quiet', '-j', '2', '-s', slug])
+        self.assertEqual(AggregateAll.objects.get(schema__id=1).total, 3)
+        self.assertRaises(Schema.DoesNotExist, main,
+                          ['--quiet', '--schemas', '%s,no-such-schema' % slug])
+
+
+class UpdateLocationAggregatesTestCase(TestCase):
+    fixtures = ('test-locationdetail-views.json',)
+
+    def _location_total(self, location_id):
+        return sum(AggregateLocationDay.objects.filter(
+                schema__id=1, location__id=location_id).values_list('total', flat=True))
+
+    def test_incremental__new_newsitemlocations(self):
+        NewsItemLocation.objects.filter(location__id=3000).delete()
+        update_aggregates(1)
+        self.assertEqual(self._location_total(3000), 0)
+        NewsItem.objects.update(last_modification=datetime.datetime(2000, 1, 1))
+        # As if Location 3000 had just been imported; none of the
+        # NewsItems change.
+        from ebpub.db.bin.import_locations import populate_ni_loc
+        added = populate_ni_loc(Location.objects.get(id=3000))
+        self.assertNotEqual(added, 0)
+        update_aggregates(1, incremental=True)
+        self.assertEqual(self._location_total(3000), added)
+
+    def test_force_full_aggregate_update(self):
+        from ebpub.db.utils import force_full_aggregate_update
+        update_aggregates(1)
+        self.assertNotEqual(AggregateAll.objects.get(schema__id=1).updated_through, None)
+        force_full_aggregate_update()
+        self.assertEqual(AggregateAll.objects.get(schema__id=1).updated_through, None)
@@ -57,3 +57,80 @@ class TestDoFilterUrl(TestCase):
                                  ni2.attributes[key])
             else:
                 self.assertEqual(val, ni2.attributes[key])
+
+
+class TestCursors(TestCase):
+
+    def test_round_trip(self):
+        from ebpub.db.utils import make_cursor, parse_cursor
+        import datetime
+        import mock
+        item = mock.Mock(item_date=datetime.date(2011, 2, 3), id=42)
+        cursor = make_cursor(item)
+        self.assert_(cursor.isalnum())
+        self.assertEqual(parse_cursor(cursor), (datetime.date(2011, 2, 3), 42))
+
+    def test_invalid(self):
+        from ebpub.db.utils import parse_cursor
+        for bad in ('', 'oops', 'MjAxMS0wMS0wMQ', u'\xe9'):
+            self.assertRaises(ValueError, parse_cursor, bad)
+
+
+class TestLocationNeighbors(TestCase):
+
+    fixtures = ('test-locationdetail-views.json',)
+
+    def _live(self, place, radius):
+        from ebpub.db.utils import _find_locations_near, make_search_buffer
+        buf = make_search_buffer(place.location.centroid, radius).union(place.location)
+        return list(_find_locations_near(place, buf))
+
+    def test_location_neighbors_saved(self):
+        from ebpub.db.models import Location, LocationNeighbor
+        from ebpub.db.utils import get_locations_near_place
+        place = Location.objects.get(slug='hood-1')
+        expected = self._live(place, 3)
+        self.assertEqual(LocationNeighbor.objects.count(), 0)
+        nearby, unused = get_locations_near_place(place)
+        self.assertEqual(list(nearby), expected)
+        self.assertEqual(LocationNeighbor.objects.filter(location=place).count(),
+                         len(expected))
+        # Second time, they're read from the table.
+        nearby, unused = get_locations_near_place(place)
+        self.assertEqual(list(nearby), expected)
+        self.failIf(place in nearby)
+
+    def test_refresh_and_clear(self):
+        from ebpub.db.models import BlockNeighbor, Location, LocationNeighbor
+        from ebpub.db.utils import refresh_location_neighbors
+        count = refresh_location_neighbors()
+        expected = sum([len(self._live(loc, 3)) for loc in Location.objects.all()])
+        self.assertEqual(count, expected)
+        self.assertEqual(LocationNeighbor.objects.count(), expected)
+        # Changing a Location forgets only the rows involving it.
+        hood1, hood2 = Location.objects.get(slug='hood-1'), Location.objects.get(slug='hood-2')
+        BlockNeighbor.objects.create(block_id=1, block_radius=1, neighbor=hood1, display_order=0)
+        BlockNeighbor.objects.create(block_id=1, block_radius=1, neighbor=hood2, display_order=1)
+        involved = set(LocationNeighbor.objects.filter(location=hood2)) | \
+            set(LocationNeighbor.objects.filter(neighbor=hood2))
+        self.assert_(involved)
+        hood2.save()
+        self.assertEqual(LocationNeighbor.objects.count(), expected - len(involved))
+        self.assertEqual(LocationNeighbor.objects.filter(location=hood2).count(), 0)
+        self.assertEqual(LocationNeighbor.objects.filter(neighbor=hood2).count(), 0)
+        self.assertEqual([bn.neighbor for bn in BlockNeighbor.objects.all()], [hood1])
+
+    def test_block_neighbors(self):
+        import mock
+        from django.contrib.gis.geos import LineString
+        from ebpub.db.models import BlockNeighbor
+        from ebpub.db.utils import get_locations_near_place
+        block = mock.Mock(id=12345,
+                          location=LineString((-71.09, 42.35), (-71.08, 42.35), srid=4326))
+        expected = self._live(block, 1)
+        nearby, unused = get_locations_near_place(block, 1)
+        self.assertEqual(list(nearby), expected)
+        self.assertEqual(BlockNeighbor.objects.filter(block_id=12345, block_radius=1).count(),
+                         len(expected))
+        nearby, unused = get_locations_near_place(block, 1)
+        self.assertEqual(list(nearby), expected)
@@ -135,6 +135,27 @@ class LocationDetailTestCase(BaseTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
 
+    def test_get_location_charts(self):
+        from ebpub.db.models import AggregateLocation, LocationType, Schema
+        from ebpub.db.views import get_location_charts
+        AggregateLocation.objects.create(schema_id=1, location_type_id=1000,
+                                         location_id=2000, total=3)
+        AggregateLocation.objects.create(schema_id=1, location_type_id=1000,
+                                         location_id=3000, total=1)
+        schema = Schema.objects.get(id=1)
+        location_types = LocationType.objects.filter(is_significant=True)
+        charts = get_location_charts(schema, location_types, 10, count=1)
+        self.assertEqual(len(charts), 1)
+        self.assertEqual(charts[0]['location_type'].slug, 'neighborhoods')
+        self.assertEqual([agg.location.slug for agg in charts[0]['locations']],
+                         ['hood-1'])
+        # Unknown is the total minus *all* public locations, not just the top ones.
+        self.assertEqual(charts[0]['unknown'], 6)
+        # No geometries were loaded.
+        loc = charts[0]['locations'][0].location
+        for field in ('location', 'location_simplified_low'):
+            self.failIf(field in loc.__dict__)
+
 
 class TestAjaxViews(BaseTestCase):
     fixtures = ('crimes.json',)
@@ -504,6 +525,12 @@ class TestSchemaFilterView(BaseTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 404)
 
+    def test_filter__pagination__invalid_cursor(self):
+        url = filter_reverse('crime', [('by-status', 'status 9-19')])
+        url += '?cursor=oops'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
     @mock.patch('ebpub.db.views.FilterChain', spec=True)
     def test_filter__pagination__has_more(self, mock_chain):
         url = filter_reverse('crime', [('by-status', 'status 9-19')])
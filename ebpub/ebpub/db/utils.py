@@ -17,12 +17,15 @@
 #
 
 from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connection, transaction
 from django.db.models import Q
+from django.db.utils import IntegrityError
 from django.http import Http404
 from django.shortcuts import get_object_or_404
-from ebpub.db.models import AttributeDict
-from ebpub.db.models import Location
-from ebpub.db.models import field_mapping
+from ebpub.db.models import AggregateAll, AttributeDict
+from ebpub.db.models import Location, LocationNeighbor, BlockNeighbor
+from ebpub.db.models import SIMPLIFIED_LOCATION_FIELDS
 from ebpub.streets.models import Block
 from ebpub.streets.models import City
 from ebpub.metros.allmetros import get_metro
@@ -30,6 +33,7 @@ from ebpub.constants import BLOCK_RADIUS_CHOICES, BLOCK_RADIUS_DEFAULT
 from ebpub.constants import BLOCK_RADIUS_COOKIE_NAME
 from ebpub.utils.view_utils import make_pid
 from ebpub.savedplaces.models import SavedPlace
+import base64
 import datetime
 
 
@@ -42,8 +46,9 @@ def populate_attributes_if_needed(newsitem_list, schema_list,
     minimal amount of database queries.
 
     The values in the NewsItem.attributes pseudo-dictionary are Lookup
-    instances in the case of Lookup fields. Otherwise, they're the
-    direct values from the Attribute table.
+    instances in the case of Lookup fields (unless get_lookups is
+    False). Otherwise, they're the direct values from the Attribute
+    table.
 
     (Note this is different than accessing NewsItem.attributes without
     having called this function, in which case Lookups are not
@@ -56,42 +61,72 @@ def populate_attributes_if_needed(newsitem_list, schema_list,
 
     Note that the list is edited in place; there is no return value.
     """
-    from ebpub.db.models import Attribute, Lookup, SchemaField
-    # To accomplish this, we determine which NewsItems in ni_list require
-    # attribute prepopulation, and run a single DB query that loads all of the
-    # attributes. Another way to do this would be to load all of the attributes
-    # when loading the NewsItems in the first place (via a JOIN), but we want
-    # to avoid joining such large tables.
-
     preload_schema_ids = set([s.id for s in schema_list if s.uses_attributes_in_list])
     if not preload_schema_ids:
         return
     preloaded_nis = [ni for ni in newsitem_list if ni.schema_id in preload_schema_ids]
-    if not preloaded_nis:
+    populate_attributes(preloaded_nis, get_lookups=get_lookups)
+
+
+def populate_attributes(newsitem_list, get_lookups=True):
+    """
+    Like populate_attributes_if_needed(), but unconditionally populates
+    every NewsItem in newsitem_list, regardless of
+    Schema.uses_attributes_in_list.
+
+    Also caches each NewsItem's Schema, so that serializing the whole
+    list takes a constant number of queries (at most one each for
+    Schemas, Attributes and Lookups) rather than several per NewsItem.
+    SchemaFields come from ebpub.db.models.schemafield_registry.
+
+    See also NewsItemQuerySet.with_attributes(), which calls this
+    for you as the QuerySet is evaluated.
+
+    Note that the list is edited in place; there is no return value.
+    """
+    from ebpub.db.models import Attribute, Lookup, Schema
+    from ebpub.db.models import schemafield_registry
+    # To accomplish this, we run a single DB query that loads all of the
+    # attributes. Another way to do this would be to load all of the attributes
+    # when loading the NewsItems in the first place (via a JOIN), but we want
+    # to avoid joining such large tables.
+    if not newsitem_list:
         return
+
+    # Make sure every item has its Schema, without one query per item.
+    # TODO: This relies on undocumented Django APIs -- the "_schema_cache" name.
+    schemas = dict([(ni.schema_id, ni._schema_cache) for ni in newsitem_list
+                    if hasattr(ni, '_schema_cache')])
+    missing_ids = set([ni.schema_id for ni in newsitem_list]) - set(schemas)
+    if missing_ids:
+        schemas.update(Schema.objects.in_bulk(list(missing_ids)))
+    for ni in newsitem_list:
+        ni._schema_cache = schemas[ni.schema_id]
+
     # fmap is a mapping like:
     # {schema_id: {'fields': [(name, real_name)], 'lookups': [real_name1, real_name2]}}
     fmap = {}
     attribute_columns_to_select = set(['news_item'])
 
-    for sf in SchemaField.objects.filter(schema__id__in=[s.id for s in schema_list]).values('schema', 'name', 'real_name', 'is_lookup'):
-        fmap.setdefault(sf['schema'], {'fields': [], 'lookups': []})['fields'].append((sf['name'], sf['real_name']))
-        if sf['is_lookup']:
-            fmap[sf['schema']]['lookups'].append(sf['real_name'])
-        attribute_columns_to_select.add(str(sf['real_name']))
-
-    att_dict = dict([(i['news_item'], i) for i in Attribute.objects.filter(news_item__id__in=[ni.id for ni in preloaded_nis]).values(*list(attribute_columns_to_select))])
+    for schema_id in schemas:
+        for sf in schemafield_registry.get_fields(schema_id):
+            fmap.setdefault(sf.schema_id, {'fields': [], 'lookups': []})['fields'].append((sf.name, sf.real_name))
+            if sf.is_lookup:
+                fmap[sf.schema_id]['lookups'].append(sf.real_name)
+            attribute_columns_to_select.add(str(sf.real_name))
 
     if not fmap:
         return
 
+    att_dict = dict([(i['news_item'], i) for i in Attribute.objects.filter(news_item__id__in=[ni.id for ni in newsitem_list if ni.schema_id in fmap]).values(*list(attribute_columns_to_select))])
+
     # Determine which Lookup objects need to be retrieved.
     lookup_ids = set()
-    for ni in preloaded_nis:
-        # Fix for #38: not all Schemas have SchemaFields, can be 100% vanilla.
-        if not ni.schema_id in fmap:
-            continue
-        for real_name in fmap[ni.schema_id]['lookups']:
+    if get_lookups:
+        for ni in newsitem_list:
+            # Fix for #38: not all Schemas have SchemaFields, can be 100% vanilla.
+            if not ni.schema_id in fmap:
+                continue
             if ni.id not in att_dict:
                 # AFAICT this should not happen, but if you have
                 # newsitems created before a schema defined any
@@ -99,21 +134,22 @@ def populate_attributes_if_needed(newsitem_list, schema_list,
                 # then you might get some NewsItems that don't have a
                 # corresponding att_dict result.
                 continue
-            value = att_dict[ni.id][real_name]
-            if ',' in str(value):
-                lookup_ids.update(value.split(','))
-            else:
-                lookup_ids.add(value)
-
-    # Retrieve only the Lookups that are referenced in preloaded_nis.
-    lookup_ids = [i for i in lookup_ids if i]
+            for real_name in fmap[ni.schema_id]['lookups']:
+                value = att_dict[ni.id][real_name]
+                if isinstance(value, basestring):
+                    # Many-to-many lookups are comma-separated strings.
+                    lookup_ids.update([int(i) for i in value.split(',') if i])
+                elif value is not None:
+                    lookup_ids.add(value)
+
+    # Retrieve only the Lookups that are referenced in newsitem_list.
     if lookup_ids:
-        lookup_objs = Lookup.objects.in_bulk(lookup_ids)
+        lookup_objs = Lookup.objects.in_bulk(list(lookup_ids))
     else:
         lookup_objs = {}
 
-    # Cache attribute values for each NewsItem in preloaded_nis.
-    for ni in preloaded_nis:
+    # Cache attribute values for each NewsItem in newsitem_list.
+    for ni in newsitem_list:
         # Fix for #38: Schemas may not have any SchemaFields, and thus
         # the ni will have no attributes, and the schema won't be in
         # fmap, and that's OK.
@@ -126,13 +162,17 @@ def populate_attributes_if_needed(newsitem_list, schema_list,
         att_values = {}
         for field_name, real_name in fmap[ni.schema_id]['fields']:
             value = att[real_name]
-            if real_name in fmap[ni.schema_id]['lookups']:
+            if get_lookups and real_name in fmap[ni.schema_id]['lookups']:
                 if real_name.startswith('int'):
-                    value = lookup_objs[value]
-                else: # Many-to-many lookups are comma-separated strings.
-                    value = [lookup_objs[int(i)] for i in value.split(',') if i]
+                    value = lookup_objs.get(value)
+                elif value:
+                    # Many-to-many lookups are comma-separated strings.
+                    value = [lookup_objs[int(i)] for i in value.split(',')
+                             if i and int(i) in lookup_objs]
+                else:
+                    value = []
             att_values[field_name] = value
-        select_dict = field_mapping([ni.schema_id]).get(ni.schema_id, {})
+        select_dict = dict(fmap[ni.schema_id]['fields'])
         ni._attributes_cache = AttributeDict(ni.id, ni.schema_id, select_dict)
         ni._attributes_cache.cached = True
         ni._attributes_cache.update(att_values)
@@ -142,25 +182,145 @@ def populate_schema(newsitem_list, schema):
         # TODO: This relies on undocumented Django APIs -- the "_schema_cache" name.
         ni._schema_cache = schema
 
+def make_cursor(newsitem):
+    """
+    Returns an opaque string identifying the position of the given
+    NewsItem in a list ordered by (item_date, id), for use with
+    parse_cursor() and NewsItemQuerySet.after_item().
+    """
+    raw = '%s,%d' % (newsitem.item_date.strftime('%Y-%m-%d'), newsitem.id)
+    return base64.urlsafe_b64encode(raw).rstrip('=')
+
+def parse_cursor(cursor):
+    """
+    Inverse of make_cursor(). Returns an (item_date, id) tuple.
+    Raises ValueError if the cursor is invalid.
+    """
+    try:
+        cursor = str(cursor)
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_str, item_id = raw.split(',')
+        return (datetime.datetime.strptime(date_str, '%Y-%m-%d').date(), int(item_id))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor %r' % cursor)
+
 def today():
     if settings.EB_TODAY_OVERRIDE:
         return settings.EB_TODAY_OVERRIDE
     return datetime.date.today()
 
-def get_locations_near_place(place, block_radius=3):
+# The block radius used to find the neighbors of Locations, as
+# opposed to Blocks.
+LOCATION_NEIGHBOR_RADIUS = 3
+
+def _find_locations_near(place, search_buf):
     nearby = Location.objects.filter(location_type__is_significant=True)
-    nearby = nearby.select_related()
+    nearby = nearby.select_related().defer(*SIMPLIFIED_LOCATION_FIELDS)
     if isinstance(place, Location):
         nearby = nearby.exclude(id=place.id)
+    nearby = nearby.filter(location__bboverlaps=search_buf)
+    nearby = nearby.order_by('location_type__id', 'name')
+    return nearby
+
+def _save_neighbors(place, block_radius, nearby):
+    if isinstance(place, Location):
+        sql = """INSERT INTO %s (location_id, neighbor_id, display_order)
+                 VALUES (%%s, %%s, %%s)""" % LocationNeighbor._meta.db_table
+        rows = [(place.id, loc.id, i) for i, loc in enumerate(nearby)]
+    else:
+        sql = """INSERT INTO %s (block_id, block_radius, neighbor_id, display_order)
+                 VALUES (%%s, %%s, %%s, %%s)""" % BlockNeighbor._meta.db_table
+        rows = [(place.id, int(block_radius), loc.id, i) for i, loc in enumerate(nearby)]
+    if not rows:
+        return
+    cursor = connection.cursor()
+    sid = transaction.savepoint()
+    try:
+        cursor.executemany(sql, rows)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # Another request just saved them.
+        transaction.savepoint_rollback(sid)
+    transaction.commit_unless_managed()
+
+def _place_search_buffer(place, block_radius):
     # If the location is a point, or very small, we want to expand
     # the area we care about via make_search_buffer().  But if
     # it's not, we probably want the extent of its geometry.
     # Let's just take the union to cover both cases.
     search_buf = make_search_buffer(place.location.centroid, block_radius)
-    search_buf = search_buf.union(place.location)
-    nearby = nearby.filter(location__bboverlaps=search_buf)
-    nearby = nearby.order_by('location_type__id', 'name')
-    return nearby, search_buf
+    return search_buf.union(place.location)
+
+def _place_search_bbox(place, block_radius):
+    # The bounding box of _place_search_buffer(), without the cost of
+    # computing the union.
+    buf_extent = make_search_buffer(place.location.centroid, block_radius).extent
+    place_extent = place.location.extent
+    bbox = Polygon.from_bbox((min(buf_extent[0], place_extent[0]),
+                              min(buf_extent[1], place_extent[1]),
+                              max(buf_extent[2], place_extent[2]),
+                              max(buf_extent[3], place_extent[3])))
+    bbox.srid = place.location.srid
+    return bbox
+
+def get_locations_near_place(place, block_radius=LOCATION_NEIGHBOR_RADIUS):
+    """
+    Returns a tuple of (significant Locations that overlap a buffer
+    around the place, the buffer). The place may be a Location or a
+    Block.
+
+    The Locations are saved as LocationNeighbors or BlockNeighbors the
+    first time, and just looked up after that, until a Location
+    changes. (Places with no neighbors are searched for every time.)
+    When they're looked up, the buffer returned is just its bounding
+    box, which is all callers use it for.
+    """
+    if isinstance(place, Location):
+        if int(block_radius) != LOCATION_NEIGHBOR_RADIUS:
+            search_buf = _place_search_buffer(place, block_radius)
+            return _find_locations_near(place, search_buf), search_buf
+        nearby = Location.objects.filter(neighbor_of__location=place)
+        nearby = nearby.order_by('neighbor_of__display_order')
+    else:
+        nearby = Location.objects.filter(block_neighbor_of__block_id=place.id,
+                                         block_neighbor_of__block_radius=int(block_radius))
+        nearby = nearby.order_by('block_neighbor_of__display_order')
+    nearby = nearby.select_related().defer(*SIMPLIFIED_LOCATION_FIELDS)
+    if not nearby:
+        search_buf = _place_search_buffer(place, block_radius)
+        nearby = _find_locations_near(place, search_buf)
+        _save_neighbors(place, block_radius, nearby)
+        return nearby, search_buf
+    return nearby, _place_search_bbox(place, block_radius)
+
+def refresh_location_neighbors():
+    """
+    Saves the LocationNeighbors of every Location, and deletes all
+    BlockNeighbors so they'll be found again as needed. Run this after
+    importing Locations. Returns the number of LocationNeighbors saved.
+    """
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s" % LocationNeighbor._meta.db_table)
+    cursor.execute("DELETE FROM %s" % BlockNeighbor._meta.db_table)
+    count = 0
+    places = Location.objects.filter(location__isnull=False).defer(*SIMPLIFIED_LOCATION_FIELDS)
+    for place in places.iterator():
+        search_buf = _place_search_buffer(place, LOCATION_NEIGHBOR_RADIUS)
+        nearby = list(_find_locations_near(place, search_buf))
+        _save_neighbors(place, None, nearby)
+        count += len(nearby)
+    transaction.commit_unless_managed()
+    return count
+
+def force_full_aggregate_update():
+    """
+    Makes the next ``update_aggregates --incremental`` recompute the
+    aggregates for every day of every schema, since NewsItemLocations
+    can change without touching NewsItem.last_modification. Run this
+    after importing Locations.
+    """
+    AggregateAll.objects.update(updated_through=None)
+    transaction.commit_unless_managed()
 
 def get_place_info_for_request(request, *args, **kwargs):
     """
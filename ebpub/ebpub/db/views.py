@@ -23,6 +23,7 @@ from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect, HttpResponsePermanentRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.utils import simplejson
@@ -35,12 +36,15 @@ from ebpub.db import breadcrumbs
 from ebpub.db import constants
 from ebpub.db.models import AggregateDay, AggregateLocation, AggregateFieldLookup
 from ebpub.db.models import NewsItem, Schema, SchemaField, LocationType, Location, SearchSpecialCase
+from ebpub.db.models import schemafield_registry
+from ebpub.db.models import SIMPLIFIED_LOCATION_FIELDS
 from ebpub.db.schemafilters import FilterError
 from ebpub.db.schemafilters import FilterChain
 from ebpub.db.schemafilters import BadAddressException
 from ebpub.db.schemafilters import BadDateException
 
 from ebpub.db.utils import populate_attributes_if_needed, populate_schema, today
+from ebpub.db.utils import make_cursor, parse_cursor
 from ebpub.db.utils import url_to_place
 from ebpub.db.utils import get_place_info_for_request
 from ebpub import geocoder
@@ -58,7 +62,6 @@ from ebpub.utils.logutils import log_exception
 import datetime
 import hashlib
 import logging
-import operator
 import re
 
 logger = logging.getLogger('ebpub.db.views')
@@ -115,6 +118,54 @@ def get_date_chart(schemas, start_date, end_date, counts):
     return result
 
 
+def get_location_charts(schema, location_type_list, total_count, count=9):
+    """
+    Returns a list of location charts for the given schema: one
+    {'location_type', 'locations', 'unknown'} dictionary for each
+    LocationType that has any AggregateLocations, with its top ``count``
+    AggregateLocations as 'locations', and the number of items not in
+    any public Location of that type as 'unknown'.
+
+    This takes one query, however many location types there are, and
+    doesn't load the Location geometries. It ranks the locations with
+    a window function, so it needs PostgreSQL 8.4 or later.
+    """
+    location_types = dict([(lt.id, lt) for lt in location_type_list])
+    if not location_types:
+        return []
+    # Public locations only, ranked within each type.
+    ranked_sql = """
+        SELECT a.id, row_number() OVER (PARTITION BY a.location_type_id ORDER BY a.total DESC, a.id) AS type_rank
+        FROM db_aggregatelocation a, db_location l
+        WHERE a.location_id = l.id AND l.is_public = true
+            AND a.schema_id = %%s AND a.location_type_id IN (%s)""" % (
+        ', '.join(['%s' for lt_id in location_types]))
+    known_sql = """
+        SELECT COALESCE(SUM(a.total), 0)
+        FROM db_aggregatelocation a, db_location l
+        WHERE a.location_id = l.id AND l.is_public = true
+            AND a.schema_id = db_aggregatelocation.schema_id
+            AND a.location_type_id = db_aggregatelocation.location_type_id"""
+    ranked_params = [schema.id] + location_types.keys()
+    aggs = AggregateLocation.objects.select_related('location').defer(
+        'location__location', *['location__%s' % f for f in SIMPLIFIED_LOCATION_FIELDS])
+    aggs = aggs.extra(
+        select={'known_count': known_sql},
+        where=['db_aggregatelocation.id IN (SELECT ranked.id FROM (%s) AS ranked WHERE ranked.type_rank <= %%s)' % ranked_sql],
+        params=ranked_params + [count])
+    aggs = aggs.order_by('location_type__slug', '-total', 'id')
+
+    charts = SortedDict()
+    for agg in aggs:
+        lt = location_types[agg.location_type_id]
+        # Save a query per location when building filter URLs.
+        agg.location._location_type_cache = lt
+        if lt.id not in charts:
+            charts[lt.id] = {'location_type': lt, 'locations': [],
+                             'unknown': max(0, total_count - agg.known_count)}
+        charts[lt.id]['locations'].append(agg)
+    return [charts[lt.id] for lt in location_type_list if lt.id in charts]
+
 def block_bbox(block, radius):
     """
     Assumes `block' has `wkt' attribute
@@ -254,6 +305,9 @@ def newsitems_geojson(request):
         newsitem_qs = newsitem_qs.select_related().order_by('-item_date', '-id')
         newsitem_qs = newsitem_qs[:constants.NUM_NEWS_ITEMS_PLACE_DETAIL]
 
+    # Serializing includes all attributes; fetch them in bulk.
+    newsitem_qs = newsitem_qs.with_attributes()
+
     # Done preparing the query; cache based on the raw SQL
     # to be sure we capture everything that matters.
     cache_seconds = 60 * 5
@@ -276,7 +330,11 @@ def _make_cache_key_from_queryset(qs):
 @cache_page(60 * 60)
 def place_kml(request, *args, **kwargs):
     place = url_to_place(*args, **kwargs)
-    return render_to_kml('place.kml', {'place': place})
+    try:
+        geometry = place.simplified_location(request.GET.get('resolution') or None)
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    return render_to_kml('place.kml', {'place': place, 'geometry': geometry})
 
 
 #########
@@ -404,6 +462,7 @@ def search(request, schema_slug=''):
     # Failing that, display a list of ZIP codes if this looks like a ZIP.
     if re.search(r'^\s*\d{5}(?:-\d{4})?\s*$', q):
         z_list = Location.objects.filter(location_type__slug='zipcodes', is_public=True).select_related().order_by('name')
+        z_list = z_list.defer(*SIMPLIFIED_LOCATION_FIELDS)
         if z_list:
             return eb_render(request, 'db/search_error_zip_list.html', {'query': q, 'zipcode_list': z_list})
 
@@ -431,7 +490,7 @@ def newsitem_detail(request, schema_slug, newsitem_id):
 
     if has_location:
         locations_within = Location.objects.select_related().filter(
-            newsitemlocation__news_item__id=ni.id)
+            newsitemlocation__news_item__id=ni.id).defer(*SIMPLIFIED_LOCATION_FIELDS)
         center_x = ni.location.centroid.x
         center_y = ni.location.centroid.y
     else:
@@ -531,7 +590,7 @@ def schema_detail(request, slug):
             latest_dates = [date['date'] for date in date_chart['dates'] if date['count']]
 
         # Populate schemafield_list and lookup_list.
-        schemafield_list = list(s.schemafield_set.filter(is_filter=True).order_by('display_order'))
+        schemafield_list = schemafield_registry.get_fields(s.id, is_filter=True)
         # XXX this duplicates part of schema_filter()
         LOOKUP_MIN_DISPLAYED = 7
         LOOKUP_BUFFER = 4
@@ -547,24 +606,8 @@ def schema_detail(request, slug):
                 has_more = False
             lookup_list.append({'sf': sf, 'top_values': top_values, 'has_more': has_more})
 
-        location_chartfield_list = []
-
-        # Populate location_chartfield_list.
-        for lt in location_type_list:
-            # Collect the locations in the location_type here so we don't have
-            # to query them again in the select_related() below.
-            locations = dict([(loc.id, loc) for loc in lt.location_set.iterator()])
-
-            ni_totals = AggregateLocation.objects.filter(
-                schema__id=s.id,
-                location_type__id=lt.id,
-                location__is_public=True).select_related('location').order_by('-total')
-
-            if ni_totals:  # This runs the query.
-                known_count = reduce(operator.add, (n.total for n in ni_totals))
-                total_count = date_chart.get('total_count', 0)
-                unknown_count = max(0, total_count - known_count)
-                location_chartfield_list.append({'location_type': lt, 'locations': ni_totals[:9], 'unknown': unknown_count})
+        location_chartfield_list = get_location_charts(
+            s, location_type_list, date_chart.get('total_count', 0))
         ni_list = ()
     else:
         date_chart = {}
@@ -573,8 +616,8 @@ def schema_detail(request, slug):
         populate_schema(ni_list, s)
         populate_attributes_if_needed(ni_list, [s])
 
-    textsearch_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_searchable=True).order_by('display_order'))
-    boolean_lookup_list = [sf for sf in SchemaField.objects.filter(schema__id=s.id, is_filter=True, is_lookup=False).order_by('display_order') if sf.is_type('bool')]
+    textsearch_sf_list = schemafield_registry.get_fields(s.id, is_searchable=True)
+    boolean_lookup_list = [sf for sf in schemafield_registry.get_fields(s.id, is_filter=True, is_lookup=False) if sf.is_type('bool')]
 
     templates_to_try = ('db/schema_detail/%s.html' % s.slug, 'db/schema_detail.html')
 
@@ -614,7 +657,7 @@ def schema_detail_special_report(request, schema):
 
     if schema.allow_charting:
         browsable_locationtype_list = LocationType.objects.filter(is_significant=True)
-        schemafield_list = list(schema.schemafield_set.filter(is_filter=True).order_by('display_order'))
+        schemafield_list = schemafield_registry.get_fields(schema.id, is_filter=True)
     else:
         browsable_locationtype_list = []
         schemafield_list = []
@@ -635,8 +678,8 @@ def schema_filter_geojson(request, slug, args_from_url):
     if not s.allow_charting:
         return HttpResponse(status=404)
 
-    filter_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_filter=True).order_by('display_order'))
-    textsearch_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_searchable=True).order_by('display_order'))
+    filter_sf_list = schemafield_registry.get_fields(s.id, is_filter=True)
+    textsearch_sf_list = schemafield_registry.get_fields(s.id, is_searchable=True)
 
     # Use SortedDict to preserve the display_order.
     filter_sf_dict = SortedDict([(sf.name, sf) for sf in filter_sf_list] + [(sf.name, sf) for sf in textsearch_sf_list])
@@ -710,8 +753,8 @@ def schema_filter(request, slug, args_from_url):
     # so it'll get the full context no matter what.
     context['breadcrumbs'] = breadcrumbs.schema_filter(context)
 
-    filter_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_filter=True).order_by('display_order'))
-    textsearch_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_searchable=True).order_by('display_order'))
+    filter_sf_list = schemafield_registry.get_fields(s.id, is_filter=True)
+    textsearch_sf_list = schemafield_registry.get_fields(s.id, is_searchable=True)
 
     # Use SortedDict to preserve the display_order.
     filter_sf_dict = SortedDict([(sf.name, sf) for sf in filter_sf_list] + [(sf.name, sf) for sf in textsearch_sf_list])
@@ -800,8 +843,22 @@ def schema_filter(request, slug, args_from_url):
 
     idx_start = (page - 1) * constants.FILTER_PER_PAGE
     idx_end = page * constants.FILTER_PER_PAGE
+    # If we have a cursor from the previous page, use it instead of
+    # an offset, which gets slower the further you page.
+    # The page number is then just for display.
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            item_date, item_id = parse_cursor(cursor)
+        except ValueError:
+            raise Http404('Invalid cursor')
+        page_qs = qs.after_item(item_date, item_id, descending=not s.is_event)
+        offset = 0
+    else:
+        page_qs = qs
+        offset = idx_start
     # Get one extra, so we can tell whether there's a next page.
-    ni_list = list(qs[idx_start:idx_end+1])
+    ni_list = list(page_qs[offset:offset + constants.FILTER_PER_PAGE + 1])
     if page > 1 and not ni_list:
         raise Http404('No objects on page %s' % page)
     if len(ni_list) > constants.FILTER_PER_PAGE:
@@ -853,6 +910,7 @@ def schema_filter(request, slug, args_from_url):
         'page_number': page,
         'previous_page_number': page - 1,
         'next_page_number': page + 1,
+        'next_cursor': has_next and make_cursor(ni_list[-1]) or None,
         'page_start_index': idx_start + 1,
         'page_end_index': idx_end,
         'lookup_list': lookup_list,
@@ -904,6 +962,7 @@ def location_type_detail(request, slug):
     lt = get_object_or_404(LocationType, slug=slug)
     order_by = get_metro()['multiple_cities'] and ('city', 'display_order') or ('display_order',)
     loc_list = Location.objects.filter(location_type__id=lt.id, is_public=True).order_by(*order_by)
+    loc_list = loc_list.defer(*SIMPLIFIED_LOCATION_FIELDS)
     lt_list = [{'location_type': i, 'is_current': i == lt} for i in LocationType.objects.filter(is_significant=True).order_by('plural_name')]
     context = {
         'location_type': lt,
@@ -1094,7 +1153,8 @@ def _preconfigured_map(context):
                                          'slug': location.slug})
         loc_boundary = {
             'url': loc_json_url,
-            'params': {},
+            # Plenty of detail at the zoom levels of place pages.
+            'params': {'resolution': 'high'},
             'title': "%s Boundary" % location.pretty_name,
             'visible': True
         }
@@ -1165,18 +1225,14 @@ def place_detail_overview(request, *args, **kwargs):
     context['breadcrumbs'] = breadcrumbs.place_detail_overview(context)
 
     schema_list = SortedDict([(s.id, s) for s in schema_manager.filter(is_special_report=False).order_by('plural_name')])
-    # needed = set(schema_list.keys())
-
-    # We actually want two lists of schemas, since we care whether
-    # they are news-like or future-event-like.
-    import copy
-    eventish_schema_list = copy.deepcopy(schema_list)
-    newsish_schema_list = copy.deepcopy(schema_list)
-    for s_id, schema in schema_list.items():
+
+    # We care whether schemas are news-like or future-event-like.
+    news_limits, event_limits = {}, {}
+    for schema in schema_list.values():
         if schema.is_event:
-            del(newsish_schema_list[s_id])
+            event_limits[schema.id] = schema.number_in_overview
         else:
-            del(eventish_schema_list[s_id])
+            news_limits[schema.id] = schema.number_in_overview
 
     filterchain = FilterChain(request=request, context=context)
     filterchain.add('location', context['place'])
@@ -1207,16 +1263,17 @@ def place_detail_overview(request, *args, **kwargs):
     for sf in charted_lookups.order_by('schema__id', 'display_order'):
         sf_dict.setdefault(sf['schema_id'], []).append(sf)
 
-    # Now retrieve newsitems per schema.
+    # Now retrieve the latest newsitems for each schema,
+    # in one query for news and one for events.
+    newsitems_by_schema = {}
+    for qs, limits in ((newsitem_qs, news_limits), (events_qs, event_limits)):
+        if limits:
+            for ni in qs.top_n_per_schema(limits):
+                newsitems_by_schema.setdefault(ni.schema_id, []).append(ni)
+
     schema_groups, all_newsitems = [], []
     for schema in schema_list.values():
-        if schema.id in newsish_schema_list:
-            newsitems = newsitem_qs.filter(schema__id=schema.id)
-        elif schema.id in eventish_schema_list:
-            newsitems = events_qs.filter(schema__id=schema.id)
-        else:
-            raise RuntimeError("should never get here")
-        newsitems = list(newsitems[:s.number_in_overview])
+        newsitems = newsitems_by_schema.get(schema.id, [])
         populate_schema(newsitems, schema)
         schema_groups.append({
             'schema': schema,
@@ -24,7 +24,9 @@ streets.Place, streets.Block, streets.Intersection ...
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
+from ebpub.geocoder.lru import LRUCache
 from ebpub.geocoder.parser.parsing import normalize, parse, ParsingError
+import copy
 import logging
 import re
 
@@ -109,6 +111,42 @@ class Address(dict):
         obj._cache_hit = True
         return obj
 
+# In-process cache of Geocoder results, in front of the GeocoderCache
+# table. Also remembers failures, for a shorter time.
+memory_cache = LRUCache(
+    maxsize=getattr(settings, 'EBPUB_GEOCODER_MEMORY_CACHE_SIZE', 1000),
+    timeout=getattr(settings, 'EBPUB_GEOCODER_MEMORY_CACHE_TIMEOUT', 60 * 60))
+
+def _memory_cache_key(geocoder, location):
+    return (geocoder.__class__.__name__, location)
+
+def _copy_address(address):
+    """
+    Copies the Address and its point, block and intersection, so that
+    changing one copy (eg. with point.transform()) doesn't affect the
+    other.
+    """
+    result = copy.copy(address)
+    for key in ('point', 'block', 'intersection'):
+        if result.get(key) is not None:
+            result[key] = copy.deepcopy(result[key])
+    return result
+
+def _copy_failure(exception):
+    """
+    Copies a GeocodingException, and the Addresses in its ``choices``
+    if it's an AmbiguousResult, like _copy_address().
+    """
+    result = copy.copy(exception)
+    if isinstance(result, AmbiguousResult):
+        result.choices = [_copy_address(choice) for choice in result.choices]
+    return result
+
+def _cache_failure(geocoder, location, exception):
+    timeout = getattr(settings, 'EBPUB_GEOCODER_MEMORY_CACHE_NEGATIVE_TIMEOUT', 60 * 5)
+    memory_cache.set(_memory_cache_key(geocoder, location), _copy_failure(exception),
+                     timeout)
+
 class Geocoder(object):
     """
     Generic Geocoder class.
@@ -121,6 +159,92 @@ class Geocoder(object):
     """
     def __init__(self, use_cache=True):
         self.use_cache = use_cache
+        # Lookups done in advance by geocode_many().
+        self._prefetched_cache = {}
+        self._prefetched_blocks = {}
+
+    def geocode_many(self, locations):
+        """
+        Geocodes a list of locations. Returns a list with, for each
+        location in order, either the result geocode() would return,
+        or the exception it would raise.
+
+        This is faster than calling geocode() for each location,
+        because the database lookups are batched: cached results are
+        fetched in one query, and the blocks on each street in one
+        query per street.
+        """
+        normalized = [normalize(location) for location in locations]
+        unique = list(set(normalized))
+        results = {}
+        try:
+            if self.use_cache:
+                self._prefetch_cache(unique)
+            self._prefetch_blocks([location for location in unique
+                                   if location not in self._prefetched_cache])
+            for location in unique:
+                try:
+                    results[location] = self.geocode(location)
+                except (GeocodingException, InvalidBlockButValidStreet, ParsingError), e:
+                    results[location] = e
+        finally:
+            self._prefetched_cache = {}
+            self._prefetched_blocks = {}
+        return [results[location] for location in normalized]
+
+    def _prefetch_cache(self, locations):
+        from ebpub.geocoder.models import GeocoderCache
+        cached_list = GeocoderCache.objects.filter(normalized_location__in=locations
+                                                   ).select_related('block', 'intersection')
+        for cached in cached_list:
+            self._prefetched_cache.setdefault(cached.normalized_location, cached)
+
+    def _prefetch_blocks(self, locations):
+        """
+        Searches in advance for the blocks that geocode() would look
+        for, for each of the (normalized) locations.
+        """
+        keys, searches = [], []
+        for location in locations:
+            for address_string in self._address_strings(location):
+                try:
+                    parsed = parse(address_string)
+                except ParsingError:
+                    continue
+                for loc in parsed:
+                    if not loc['number']:
+                        continue
+                    search = _block_search_kwargs(loc)
+                    key = _block_search_key(search)
+                    if key not in self._prefetched_blocks:
+                        self._prefetched_blocks[key] = None
+                        keys.append(key)
+                        searches.append(search)
+        if searches:
+            # Defer this to avoid import cycle.
+            from ebpub.streets.models import Block
+            for key, blocks in zip(keys, Block.objects.search_many(searches)):
+                self._prefetched_blocks[key] = blocks
+
+    def _address_strings(self, location_string):
+        """
+        Returns a list of the address strings that _do_geocode() would
+        look up blocks for. Only used for prefetching.
+        """
+        return []
+
+    def _db_cache_lookup(self, location):
+        """
+        Returns the GeocoderCache for the normalized location, or None.
+        """
+        from ebpub.geocoder.models import GeocoderCache
+        if location in self._prefetched_cache:
+            return self._prefetched_cache[location]
+        try:
+            return GeocoderCache.objects.filter(normalized_location=location
+                                                ).select_related('block', 'intersection')[0]
+        except IndexError:
+            return None
 
     def geocode(self, location):
         """
@@ -136,11 +260,19 @@ class Geocoder(object):
         # Defer import to avoid cyclical imports.
         from ebpub.geocoder.models import GeocoderCache
         if self.use_cache:
-            try:
-                cached = GeocoderCache.objects.filter(normalized_location=location)[0]
-            except IndexError:
-                pass
-            else:
+            cached = memory_cache.get(_memory_cache_key(self, location))
+            if isinstance(cached, GeocodingException):
+                logger.debug('memory cache HIT (failure) for %r' % location)
+                # A copy, so callers can't modify what's cached.
+                raise _copy_failure(cached)
+            elif cached is not None:
+                logger.debug('memory cache HIT for %r' % location)
+                # A copy, so callers can't modify what's cached.
+                result = _copy_address(cached)
+                result._cache_hit = True
+                return result
+            cached = self._db_cache_lookup(location)
+            if cached is not None:
                 logger.debug('GeocoderCache HIT for %r' % location)
                 result = Address.from_cache(cached)
                 cache_hit = True
@@ -148,6 +280,10 @@ class Geocoder(object):
         if result is None:
             try:
                 result = self._do_geocode(location)
+            except DoesNotExist, e:
+                if self.use_cache:
+                    _cache_failure(self, location, e)
+                raise
             except AmbiguousResult, e:
                 # If multiple results were found, check whether they have the
                 # same point. If they all have the same point, don't raise the
@@ -157,25 +293,74 @@ class Geocoder(object):
                 # if the geocoder found locations, not points. In that case,
                 # just raise the AmbiguousResult.
                 result = e.choices[0]
-                if result['point'] is None:
+                if result['point'] is None or [i for i in e.choices[1:]
+                                               if i['point'] != result['point']]:
+                    if self.use_cache:
+                        _cache_failure(self, location, e)
                     raise
-                for i in e.choices[1:]:
-                    if i['point'] != result['point']:
-                        raise
                 logger.debug('Got ambiguous results but all had same point, '
                              'returning the first')
         # Save the result to the cache if it wasn't in there already.
         if not cache_hit and self.use_cache:
             logger.debug('caching result for %r' % location)
             GeocoderCache.populate(location, result)
+        if self.use_cache:
+            memory_cache.set(_memory_cache_key(self, location), _copy_address(result))
 
         logger.debug('geocoded: %r to %s' % (location, result))
         return result
 
+def _block_search_kwargs(location):
+    """
+    Given a location dict as returned by parse(), returns
+    keyword arguments for BlockManager.search().
+    """
+    return {
+        'street': location['street'],
+        'number': location['number'],
+        'predir': location['pre_dir'],
+        'suffix': location['suffix'],
+        'postdir': location['post_dir'],
+        'city': location['city'],
+        'state': location['state'],
+        'zipcode': location['zip'],
+        }
+
+def _block_search_key(search_kwargs):
+    return tuple(sorted(search_kwargs.items()))
+
+def _closest_street_name(street):
+    """
+    Returns the known street name closest to the given misspelled one,
+    if there's a street name index (see ebpub.streets.fuzzy) and it
+    has a single closest name; otherwise None.
+    """
+    # Defer import to avoid cyclical import.
+    from ebpub.streets.fuzzy import get_street_name_index
+    index = get_street_name_index()
+    if index is None or not street:
+        return None
+    closest = index.correct(street)
+    if closest == street:
+        return None
+    return closest
+
+def _is_known_street(street):
+    """
+    Returns False if there's a street name index and it doesn't
+    have this street; otherwise True.
+    """
+    from ebpub.streets.fuzzy import get_street_name_index
+    index = get_street_name_index()
+    return index is None or street in index
+
 class AddressGeocoder(Geocoder):
     """
     Treats the location_string as an address and looks for a matching Block.
     """
+    def _address_strings(self, location_string):
+        return [location_string]
+
     def _do_geocode(self, location_string):
         # Parse the address.
         try:
@@ -195,14 +380,19 @@ class AddressGeocoder(Geocoder):
                 logger.debug('AddressGeocoder: checking for alternate spellings of %r'
                              % loc['street'])
                 try:
-                    misspelling = StreetMisspelling.objects.get(incorrect=loc['street'])
-                    loc['street'] = misspelling.correct
-                    logger.debug(' ... corrected to %r' % loc['street'])
+                    corrected = StreetMisspelling.objects.get(incorrect=loc['street']).correct
                 except StreetMisspelling.DoesNotExist:
                     logger.debug(' ... no StreetMisspellings found.')
-                    pass
-                else:
+                    corrected = _closest_street_name(loc['street'])
+                if corrected:
+                    loc['street'] = corrected
+                    logger.debug(' ... corrected to %r' % loc['street'])
                     loc_results = self._db_lookup(loc)
+                # If we know all the street names, and this isn't one,
+                # there's no point in trying anything else.
+                if not loc_results and not _is_known_street(loc['street']):
+                    logger.debug('No street named %r' % loc['street'])
+                    continue
                 # Next, try removing the street suffix, in case an incorrect
                 # one was given.
                 if not loc_results and loc['suffix']:
@@ -218,8 +408,14 @@ class AddressGeocoder(Geocoder):
                         city_filter = Q(left_city=loc['city']) | Q(right_city=loc['city'])
                         sided_filters.append(city_filter)
                     # Defer this to avoid import cycle.
+                    from ebpub.streets.blockindex import get_block_index
                     from ebpub.streets.models import Block
-                    b_list = Block.objects.filter(*sided_filters, **kwargs).order_by('predir', 'from_num', 'to_num')
+                    index = get_block_index()
+                    if index is not None:
+                        b_list = [b for b, pt in index.search(loc['street'], city=loc['city'])]
+                        b_list.sort(key=lambda b: (b.predir, b.from_num, b.to_num))
+                    else:
+                        b_list = Block.objects.filter(*sided_filters, **kwargs).order_by('predir', 'from_num', 'to_num')
                     if b_list:
                         logger.debug("Street %r exists but block %r doesn't"
                                      % (b_list[0].street_pretty_name, loc['number']))
@@ -246,23 +442,13 @@ class AddressGeocoder(Geocoder):
         if not location['number']:
             return []
 
-        # Query the blocks database.
-        try:
+        # Query the blocks database, unless geocode_many() already did.
+        search = _block_search_kwargs(location)
+        blocks = self._prefetched_blocks.get(_block_search_key(search))
+        if blocks is None:
             # Defer this to avoid import cycle.
             from ebpub.streets.models import Block
-            blocks = Block.objects.search(
-                street=location['street'],
-                number=location['number'],
-                predir=location['pre_dir'],
-                suffix=location['suffix'],
-                postdir=location['post_dir'],
-                city=location['city'],
-                state=location['state'],
-                zipcode=location['zip'],
-            )
-        except:
-            # TODO: replace with Block-specific exception?
-            raise
+            blocks = Block.objects.search(**search)
         return [self._build_result(location, block, geocoded_pt) for block, geocoded_pt in blocks]
 
     def _build_result(self, location, block, geocoded_pt):
@@ -282,6 +468,12 @@ class BlockGeocoder(AddressGeocoder):
     """
     Geocodes the location_string as a streets.Block.
     """
+    def _address_strings(self, location_string):
+        m = block_re.search(location_string)
+        if not m:
+            return []
+        return [' '.join(m.groups())]
+
     def _do_geocode(self, location_string):
         m = block_re.search(location_string)
         if not m:
@@ -303,18 +495,23 @@ class IntersectionGeocoder(Geocoder):
         left_side = parse(sides[0])
         right_side = parse(sides[1])
 
-        all_results = []
-        seen_intersections = set()
         # Defer to avoid cyclical import.
         from ebpub.streets.models import StreetMisspelling
-        for street_a in left_side:
-            street_a['street'] = StreetMisspelling.objects.make_correction(street_a['street'])
-            for street_b in right_side:
-                street_b['street'] = StreetMisspelling.objects.make_correction(street_b['street'])
-                for result in self._db_lookup(street_a, street_b):
-                    if result["intersection_id"] not in seen_intersections:
-                        seen_intersections.add(result["intersection_id"])
-                        all_results.append(result)
+        for street in left_side + right_side:
+            street['street'] = StreetMisspelling.objects.make_correction(street['street'])
+        all_results = self._lookup_pairs(left_side, right_side)
+        if not all_results:
+            # Maybe a street was misspelled in a way we don't know about.
+            corrected = False
+            for street in left_side + right_side:
+                closest = _closest_street_name(street['street'])
+                if closest:
+                    logger.debug('IntersectionGeocoder: corrected %r to %r'
+                                 % (street['street'], closest))
+                    street['street'] = closest
+                    corrected = True
+            if corrected:
+                all_results = self._lookup_pairs(left_side, right_side)
 
         if not all_results:
             raise DoesNotExist("Geocoder db couldn't find this intersection: %r" % location_string)
@@ -323,6 +520,17 @@ class IntersectionGeocoder(Geocoder):
         else:
             raise AmbiguousResult(list(all_results), "Intersections DB returned %s results" % len(all_results))
 
+    def _lookup_pairs(self, left_side, right_side):
+        all_results = []
+        seen_intersections = set()
+        for street_a in left_side:
+            for street_b in right_side:
+                for result in self._db_lookup(street_a, street_b):
+                    if result["intersection_id"] not in seen_intersections:
+                        seen_intersections.add(result["intersection_id"])
+                        all_results.append(result)
+        return all_results
+
     def _db_lookup(self, street_a, street_b):
         # Avoid circular import.
         from ebpub.streets.models import Intersection
@@ -373,7 +581,7 @@ class SmartGeocoder(Geocoder):
     Checks whether the location_string looks like an Intersection, Block,
     or Address, and delegates to the appropriate Geocoder subclass.
     """
-    def _do_geocode(self, location_string):
+    def _delegate(self, location_string):
         if intersection_re.search(location_string):
             logger.debug('%r looks like an intersection' % location_string)
             geocoder = IntersectionGeocoder()
@@ -383,7 +591,14 @@ class SmartGeocoder(Geocoder):
         else:
             logger.debug('%r assumed to be an address' % location_string)
             geocoder = AddressGeocoder()
-        return geocoder._do_geocode(location_string)
+        geocoder._prefetched_blocks = self._prefetched_blocks
+        return geocoder
+
+    def _address_strings(self, location_string):
+        return self._delegate(location_string)._address_strings(location_string)
+
+    def _do_geocode(self, location_string):
+        return self._delegate(location_string)._do_geocode(location_string)
 
 
 
@@ -391,9 +606,10 @@ def full_geocode(query, search_places=True):
     """
     Tries the full geocoding stack on the given query (a string):
         * Normalizes whitespace/capitalization
-        * Searches the Misspelling table to corrects location misspellings
-        * Searches the Location table
-        * Failing that, searches the Place table (if search_places is True)
+        * Looks up location synonyms to correct location misspellings
+        * Looks up Location names
+        * Failing that, looks up Place names and synonyms (if
+          search_places is True)
         * Failing that, uses the SmartGeocoder to parse this as an address, block,
           or intersection
         * Failing that, raises whichever error is raised by the geocoder --
@@ -411,24 +627,72 @@ def full_geocode(query, search_places=True):
 
     If ambiguous is True, result will be a list of objects.
     """
-    # Local import to avoid circular imports.
-    from ebpub.db.models import Location, LocationSynonym
-    from ebpub.streets.models import Place, PlaceSynonym
+    result = _full_geocode_name(query, search_places)
+    if result is not None:
+        return result
 
-    # Search the Location table.
+    # Try geocoding this as an address.
+    geocoder = SmartGeocoder(use_cache=getattr(settings, 'EBPUB_CACHE_GEOCODER', False))
     try:
-        canonical_loc = LocationSynonym.objects.get_canonical(query)
-        loc = Location.objects.get(normalized_name=canonical_loc)
-    except Location.DoesNotExist:
-        pass
-    else:
-        logger.debug('geocoded %r to Location %s' % (query, loc))
-        return {'type': 'location', 'result': loc, 'ambiguous': False}
-
-    # Search the Place table, for stuff like "Sears Tower".
+        result = geocoder.geocode(query)
+    except (AmbiguousResult, InvalidBlockButValidStreet), e:
+        result = e
+    return _full_geocode_address(query, result)
+
+def full_geocode_many(queries, search_places=True):
+    """
+    Like full_geocode(), for a list of queries. Returns a list with,
+    for each query in order, either the dictionary full_geocode()
+    would return, or the exception it would raise.
+
+    The queries that have to be geocoded as addresses are done
+    together with SmartGeocoder.geocode_many().
+    """
+    results = [None] * len(queries)
+    address_indexes = []
+    for i, query in enumerate(queries):
+        results[i] = _full_geocode_name(query, search_places)
+        if results[i] is None:
+            address_indexes.append(i)
+
+    geocoder = SmartGeocoder(use_cache=getattr(settings, 'EBPUB_CACHE_GEOCODER', False))
+    geocoded = geocoder.geocode_many([queries[i] for i in address_indexes])
+    for i, result in zip(address_indexes, geocoded):
+        try:
+            results[i] = _full_geocode_address(queries[i], result)
+        except (GeocodingException, ParsingError), e:
+            results[i] = e
+    return results
+
+def _full_geocode_name(query, search_places=True):
+    """
+    The first part of full_geocode(): looks for a Location or Place by
+    name. Returns a full_geocode() result dictionary, or None.
+    """
+    # Local import to avoid circular imports.
+    from ebpub.db.models import Location
+    from ebpub.geocoder.names import name_registry
+    from ebpub.streets.models import Place
+
+    # Search the Location names. Most queries aren't one, so
+    # don't touch the database unless they are.
+    loc_id = name_registry.location_id(query)
+    if loc_id is not None:
+        try:
+            loc = Location.objects.get(id=loc_id)
+        except Location.DoesNotExist:
+            # Deleted since the registry was loaded.
+            pass
+        else:
+            logger.debug('geocoded %r to Location %s' % (query, loc))
+            return {'type': 'location', 'result': loc, 'ambiguous': False}
+
+    # Search the Place names, for stuff like "Sears Tower".
     if search_places:
-        canonical_place = PlaceSynonym.objects.get_canonical(query)
-        places = Place.objects.filter(normalized_name=canonical_place)
+        places = []
+        place_ids = name_registry.place_ids(query)
+        if place_ids:
+            places = Place.objects.filter(id__in=place_ids)
         if len(places) == 1:
             logger.debug(u'geocoded %r to Place %s' % (query, places[0]))
 
@@ -436,18 +700,21 @@ def full_geocode(query, search_places=True):
         elif len(places) > 1:
             logger.debug(u'geocoded %r to multiple Places: %s' % (query, unicode(places)))
             return {'type': 'place', 'result': places, 'ambiguous': True}
+    return None
 
-    # Try geocoding this as an address.
-    geocoder = SmartGeocoder(use_cache=getattr(settings, 'EBPUB_CACHE_GEOCODER', False))
-    try:
-        result = geocoder.geocode(query)
-    except AmbiguousResult, e:
+def _full_geocode_address(query, result):
+    """
+    The last part of full_geocode(): given the result of geocoding the
+    query as an address, or the exception raised by doing so, returns
+    a full_geocode() result dictionary, or raises the exception.
+    """
+    if isinstance(result, AmbiguousResult):
         logger.debug('Multiple addresses for %r' % query)
-        return {'type': 'address', 'result': e.choices, 'ambiguous': True}
-    except InvalidBlockButValidStreet, e:
+        return {'type': 'address', 'result': result.choices, 'ambiguous': True}
+    elif isinstance(result, InvalidBlockButValidStreet):
         logger.debug('Invalid block for %r, returning all possible blocks' % query)
-        return {'type': 'block', 'result': e.block_list, 'ambiguous': True, 'street_name': e.street_name, 'block_number': e.block_number}
-    except:
-        raise
+        return {'type': 'block', 'result': result.block_list, 'ambiguous': True, 'street_name': result.street_name, 'block_number': result.block_number}
+    elif isinstance(result, Exception):
+        raise result
     logger.debug('SmartGeocoder for %r returned %s' % (query, result))
     return {'type': 'address', 'result': result, 'ambiguous': False}
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures geocoder latency and queries per geocode, on a synthetic grid
+of streets that's created for the run and then rolled back.
+
+Results are JSON, so runs can be saved and compared; see compare().
+"""
+
+from django.conf import settings
+from django.contrib.gis.geos import LineString, Point
+from django.db import connection, transaction
+from ebpub.geocoder import base
+from ebpub.geocoder.parser.parsing import parse, ParsingError
+from ebpub.metros.allmetros import get_metro
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+import random
+import time
+
+logger = logging.getLogger('ebpub.geocoder.benchmark')
+
+# Names of the east-west streets ("St") and north-south avenues ("Ave")
+# of the grid.
+STREET_NAMES = ('ALDER', 'BIRCH', 'CEDAR', 'DOGWOOD', 'ELDER', 'FIR',
+                'GINKGO', 'HAZEL', 'IRONWOOD', 'JUNIPER', 'KATSURA',
+                'LARCH', 'MAPLE', 'NUTMEG', 'OLIVE', 'PEAR', 'QUINCE',
+                'REDWOOD', 'SPRUCE', 'TAMARACK')
+AVENUE_NAMES = ('ARGON', 'BORON', 'CARBON', 'COBALT', 'HELIUM', 'IODINE',
+                'KRYPTON', 'LITHIUM', 'NEON', 'NICKEL', 'OXYGEN',
+                'PLATINUM', 'RADON', 'SODIUM', 'TITANIUM', 'URANIUM',
+                'VANADIUM', 'XENON', 'YTTRIUM', 'ZINC')
+
+# Distance between streets, in degrees.
+SPACING = 0.002
+
+# Kinds of query in the corpus.
+KINDS = ('address', 'block', 'intersection', 'misspelled', 'place', 'garbage')
+
+# Stages measured. 'geocode_cached' makes several passes over the
+# corpus with the geocoder cache on.
+STAGES = ('parse', 'geocode', 'geocode_cached', 'full_geocode')
+
+# Ignore latency changes smaller than this, in milliseconds,
+# when comparing runs.
+NOISE_MS = 0.1
+
+
+def _title(name):
+    return name.title()
+
+def _slug(name):
+    return name.lower().replace(' ', '-')
+
+def build_grid(size=12, origin=None):
+    """
+    Creates a grid of ``size`` streets by ``size`` avenues, with their
+    Blocks and Intersections, a few StreetMisspellings, and a Place
+    at each corner of the grid. Returns a dict describing the grid,
+    for make_corpus().
+
+    Run this inside a transaction you'll roll back.
+    """
+    from ebpub.streets.models import Block, Intersection, Place, PlaceType
+    from ebpub.streets.models import StreetMisspelling
+    size = min(size, len(STREET_NAMES), len(AVENUE_NAMES))
+    metro = get_metro()
+    city = metro['city_name'].upper()
+    state = metro['state'].upper()
+    if origin is None:
+        x0, y0 = metro['extent'][:2]
+    else:
+        x0, y0 = origin
+    streets = [(name, 'ST') for name in STREET_NAMES[:size]]
+    avenues = [(name, 'AVE') for name in AVENUE_NAMES[:size]]
+
+    def point(i, j):
+        return (x0 + i * SPACING, y0 + j * SPACING)
+
+    def make_blocks(name, suffix, points):
+        for i in range(len(points) - 1):
+            from_num, to_num = (i + 1) * 100, (i + 1) * 100 + 98
+            street_pretty_name = u'%s %s.' % (_title(name), _title(suffix))
+            Block.objects.create(
+                pretty_name=u'%d-%d %s' % (from_num, to_num, street_pretty_name),
+                street_pretty_name=street_pretty_name,
+                street_slug=_slug('%s %s' % (name, suffix)),
+                predir='', street=name, suffix=suffix, postdir='',
+                left_from_num=from_num + 1, left_to_num=to_num + 1,
+                right_from_num=from_num, right_to_num=to_num,
+                from_num=from_num, to_num=to_num,
+                left_zip='00000', right_zip='00000',
+                left_city=city, right_city=city,
+                left_state=state, right_state=state,
+                geom=LineString(points[i], points[i + 1], srid=4326))
+
+    for j, (name, suffix) in enumerate(streets):
+        make_blocks(name, suffix, [point(i, j) for i in range(size)])
+    for i, (name, suffix) in enumerate(avenues):
+        make_blocks(name, suffix, [point(i, j) for j in range(size)])
+
+    for j, (street, street_suffix) in enumerate(streets):
+        for i, (avenue, avenue_suffix) in enumerate(avenues):
+            pretty_name = u'%s %s. & %s %s.' % (_title(street), _title(street_suffix),
+                                                _title(avenue), _title(avenue_suffix))
+            Intersection.objects.create(
+                pretty_name=pretty_name, slug=_slug(pretty_name.replace('.', '').replace('&', 'and')),
+                predir_a='', street_a=street, suffix_a=street_suffix, postdir_a='',
+                predir_b='', street_b=avenue, suffix_b=avenue_suffix, postdir_b='',
+                zip='00000', city=city, state=state,
+                location=Point(point(i, j), srid=4326))
+
+    # Drop the last letter for the misspelling.
+    misspellings = []
+    for name, suffix in streets[:3]:
+        misspellings.append(StreetMisspelling.objects.create(
+                incorrect=name[:-1], correct=name).incorrect)
+
+    place_type, created = PlaceType.objects.get_or_create(
+        slug='benchmark-places',
+        defaults={'name': 'Benchmark Place', 'plural_name': 'Benchmark Places',
+                  'indefinite_article': 'a'})
+    places = []
+    for (i, j), name in [((0, 0), 'Alpha Park'), ((0, size - 1), 'Beta Park'),
+                         ((size - 1, 0), 'Gamma Park'), ((size - 1, size - 1), 'Delta Park')]:
+        Place.objects.create(pretty_name=name, place_type=place_type,
+                             location=Point(point(i, j), srid=4326))
+        places.append(name)
+
+    return {'size': size, 'streets': streets, 'avenues': avenues,
+            'misspellings': misspellings, 'places': places}
+
+def make_corpus(grid, length=200, seed=0):
+    """
+    Returns a list of (kind, query string) for the given grid, with
+    roughly equal numbers of each kind of query.
+    """
+    rand = random.Random(seed)
+    size = grid['size']
+    roads = grid['streets'] + grid['avenues']
+
+    def address():
+        name, suffix = rand.choice(roads)
+        number = rand.randint(100, size * 100 - 2)
+        # Sometimes leave off the suffix, or give the wrong one.
+        suffix = rand.choice([suffix, suffix, '', suffix == 'ST' and 'AVE' or 'ST'])
+        return ' '.join([str(number), _title(name), _title(suffix)]).strip()
+
+    def block():
+        name, suffix = rand.choice(roads)
+        return '%d block of %s %s' % (rand.randint(1, size - 1) * 100, _title(name), _title(suffix))
+
+    def intersection():
+        (street, street_suffix), (avenue, avenue_suffix) = \
+            rand.choice(grid['streets']), rand.choice(grid['avenues'])
+        conjunction = rand.choice(['and', '&', 'at'])
+        return '%s %s %s %s %s' % (_title(street), _title(street_suffix), conjunction,
+                                   _title(avenue), _title(avenue_suffix))
+
+    def misspelled():
+        if rand.random() < 0.5:
+            name = rand.choice(grid['misspellings'])
+        else:
+            # Swap two letters.
+            name = rand.choice(roads)[0]
+            i = rand.randint(1, len(name) - 2)
+            name = name[:i] + name[i + 1] + name[i] + name[i + 2:]
+        return '%d %s' % (rand.randint(100, size * 100 - 2), _title(name))
+
+    def place():
+        return rand.choice(grid['places'])
+
+    def garbage():
+        return rand.choice([
+                ' '.join(rand.choice(['asdf', 'qwerty', 'zzz', 'foo', 'bar'])
+                         for i in range(rand.randint(1, 4))),
+                str(rand.randint(1, 99999)),
+                '%d Nowhere St' % rand.randint(1, 9999),
+                '%d %s St' % (rand.randint(100000, 999999), _title(rand.choice(roads)[0])),
+                ])
+
+    makers = {'address': address, 'block': block, 'intersection': intersection,
+              'misspelled': misspelled, 'place': place, 'garbage': garbage}
+    kinds = [KINDS[i % len(KINDS)] for i in range(length)]
+    return [(kind, makers[kind]()) for kind in kinds]
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.9)
+    9
+    >>> percentile([], 0.5)
+    0
+    """
+    if not sorted_values:
+        return 0
+    rank = max(int(round(fraction * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def _latency_stats(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.5) * 1000, 3),
+        'p90_ms': round(percentile(ordered, 0.9) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round((ordered and ordered[-1] or 0) * 1000, 3),
+        }
+
+def _outcome(func, query):
+    try:
+        result = func(query)
+    except base.AmbiguousResult:
+        return 'ambiguous'
+    except base.InvalidBlockButValidStreet:
+        return 'invalid_block'
+    except (base.DoesNotExist, base.UnparseableLocation):
+        return 'not_found'
+    except ParsingError:
+        return 'parse_error'
+    if isinstance(result, dict) and result.get('ambiguous'):
+        return 'ambiguous'
+    return 'ok'
+
+def measure(func, corpus, passes=1):
+    """
+    Calls func on each query in the corpus, ``passes`` times.
+    Returns a dict of latency percentiles, overall and by kind of
+    query; outcome counts; and the number of database queries per call.
+    """
+    latencies = []
+    by_kind = {}
+    outcomes = {}
+    queries = 0
+    old_debug = settings.DEBUG
+    # Needed for connection.queries.
+    settings.DEBUG = True
+    try:
+        start = time.time()
+        for i in range(passes):
+            for kind, query in corpus:
+                connection.queries = []
+                t = time.time()
+                outcome = _outcome(func, query)
+                elapsed = time.time() - t
+                queries += len(connection.queries)
+                latencies.append(elapsed)
+                by_kind.setdefault(kind, []).append(elapsed)
+                if i == 0:
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        total = time.time() - start
+    finally:
+        settings.DEBUG = old_debug
+        connection.queries = []
+    stats = _latency_stats(latencies)
+    stats.update({
+            'per_second': round(len(latencies) / (total or 1e-9), 1),
+            'queries_per_call': round(float(queries) / (len(latencies) or 1), 3),
+            'outcomes': outcomes,
+            'by_kind': dict((kind, _latency_stats(values))
+                            for kind, values in by_kind.items()),
+            })
+    return stats
+
+def _clear_caches():
+    from ebpub.geocoder.names import name_registry
+    from ebpub.streets.blockindex import set_block_index
+    from ebpub.streets.fuzzy import set_street_name_index
+    base.memory_cache.clear()
+    name_registry.clear()
+    set_block_index(None)
+    set_street_name_index(None)
+
+def run(corpus, passes=3):
+    """
+    Measures each of STAGES over the corpus. Returns a dict of results
+    by stage name.
+    """
+    results = {}
+    _clear_caches()
+    results['parse'] = measure(parse, corpus)
+
+    geocoder = base.SmartGeocoder(use_cache=False)
+    results['geocode'] = measure(geocoder.geocode, corpus)
+
+    base.memory_cache.clear()
+    before = base.memory_cache.stats()
+    geocoder = base.SmartGeocoder(use_cache=True)
+    results['geocode_cached'] = measure(geocoder.geocode, corpus, passes)
+    after = base.memory_cache.stats()
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    results['geocode_cached']['memory_cache_hit_rate'] = \
+        round(float(hits) / ((hits + misses) or 1), 3)
+
+    base.memory_cache.clear()
+    results['full_geocode'] = measure(base.full_geocode, corpus)
+    _clear_caches()
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Returns a list of messages about regressions in results since
+    baseline (both as returned by run()): latency more than
+    ``tolerance`` (a fraction) worse, more queries per call, or fewer
+    successful geocodes.
+    """
+    regressions = []
+    for stage in STAGES:
+        new, old = results.get(stage), baseline.get(stage)
+        if new is None or old is None:
+            continue
+        for key in ('p50_ms', 'p90_ms'):
+            if new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > NOISE_MS:
+                regressions.append('%s %s went from %s to %s' % (stage, key, old[key], new[key]))
+        if new['queries_per_call'] > old['queries_per_call'] + 0.01:
+            regressions.append('%s queries_per_call went from %s to %s'
+                               % (stage, old['queries_per_call'], new['queries_per_call']))
+        old_ok = old['outcomes'].get('ok', 0)
+        new_ok = new['outcomes'].get('ok', 0)
+        if new_ok < old_ok:
+            regressions.append('%s successful results went from %d to %d' % (stage, old_ok, new_ok))
+    return regressions
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    from django.utils import simplejson as json
+    optparser = OptionParser(usage='''usage: %prog [options]
+
+Creates a synthetic grid of streets in the database, measures address
+parsing, geocoding, and full_geocode() on a corpus of queries against
+it, and then rolls the grid back. Prints the results as JSON.
+
+Don't run this on a busy production database; the grid is only
+rolled back at the end.
+''')
+    optparser.add_option('-s', '--size', type='int', default=12,
+                         help='Number of streets each way in the grid. Default %default.')
+    optparser.add_option('-n', '--queries', type='int', default=300,
+                         help='Number of queries in the corpus. Default %default.')
+    optparser.add_option('-p', '--passes', type='int', default=3,
+                         help='Passes over the corpus with the geocoder cache on. Default %default.')
+    optparser.add_option('--seed', type='int', default=0,
+                         help='Random seed for the corpus. Default %default.')
+    optparser.add_option('-o', '--output', help='Also save the results to this file.')
+    optparser.add_option('-c', '--compare',
+                         help='Compare to results saved in this file, and exit with '
+                         'status 1 if anything got worse.')
+    optparser.add_option('-t', '--tolerance', type='float', default=0.25,
+                         help='How much slower (as a fraction) counts as worse, with --compare. '
+                         'Default %default.')
+    optparser.add_option('--block-index', action='store_true', default=False,
+                         help='Use an in-memory block index (EBPUB_BLOCK_INDEX).')
+    optparser.add_option('--fuzzy-streets', action='store_true', default=False,
+                         help='Correct street names by edit distance (EBPUB_FUZZY_STREET_NAMES).')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+
+    old_settings = (getattr(settings, 'EBPUB_BLOCK_INDEX', False),
+                    getattr(settings, 'EBPUB_FUZZY_STREET_NAMES', False))
+    settings.EBPUB_BLOCK_INDEX = opts.block_index
+    settings.EBPUB_FUZZY_STREET_NAMES = opts.fuzzy_streets
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        logger.info('Building a %d x %d grid' % (opts.size, opts.size))
+        grid = build_grid(opts.size)
+        corpus = make_corpus(grid, opts.queries, opts.seed)
+        logger.info('Geocoding %d queries' % len(corpus))
+        results = run(corpus, opts.passes)
+    finally:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+        settings.EBPUB_BLOCK_INDEX, settings.EBPUB_FUZZY_STREET_NAMES = old_settings
+        _clear_caches()
+
+    results['options'] = {'size': grid['size'], 'queries': len(corpus),
+                          'passes': opts.passes, 'seed': opts.seed,
+                          'block_index': opts.block_index,
+                          'fuzzy_streets': opts.fuzzy_streets}
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print output
+    if opts.output:
+        f = open(opts.output, 'w')
+        f.write(output)
+        f.close()
+    if opts.compare:
+        baseline = json.load(open(opts.compare))
+        regressions = compare(results, baseline, opts.tolerance)
+        for message in regressions:
+            logger.error(message)
+        if regressions:
+            return 1
+        logger.info('No regressions since %s' % opts.compare)
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Maintenance for the GeocoderCache table: prune stale or expired rows,
+remove duplicates, and warm it up with the locations of existing
+NewsItems and the first address of every Block.
+"""
+
+from django.db import connection, transaction
+from ebpub.db.models import NewsItem
+from ebpub.geocoder.base import SmartGeocoder, memory_cache
+from ebpub.geocoder.models import GeocoderCache
+from ebpub.geocoder.parser.parsing import normalize
+from ebpub.streets.models import Block, Intersection
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import datetime
+import logging
+
+logger = logging.getLogger('ebpub.geocoder.bin.maintain_geocoder_cache')
+
+# How far (in degrees) a cached point can be from its block or
+# intersection before we decide the street was re-imported elsewhere.
+PRUNE_TOLERANCE = 0.00001
+
+# How many locations each warm-up job geocodes at once.
+WARM_CHUNK_SIZE = 200
+
+
+@transaction.commit_on_success
+def prune(max_age=None):
+    """
+    Deletes cached results whose Block or Intersection no longer
+    exists or has moved, and if ``max_age`` (a timedelta) is given,
+    those older than that. Returns the number of rows deleted.
+    """
+    params = {'cache': GeocoderCache._meta.db_table,
+              'blocks': Block._meta.db_table,
+              'intersections': Intersection._meta.db_table}
+    cursor = connection.cursor()
+    deleted = 0
+    cursor.execute("""
+        DELETE FROM %(cache)s c
+        WHERE (c.block_id IS NOT NULL AND NOT EXISTS
+                 (SELECT 1 FROM %(blocks)s b WHERE b.id = c.block_id))
+           OR (c.intersection_id IS NOT NULL AND NOT EXISTS
+                 (SELECT 1 FROM %(intersections)s i WHERE i.id = c.intersection_id))
+    """ % params)
+    logger.info('Pruned %d results for deleted blocks or intersections' % cursor.rowcount)
+    deleted += cursor.rowcount
+    cursor.execute("""
+        DELETE FROM %(cache)s c USING %(blocks)s b
+        WHERE b.id = c.block_id AND NOT ST_DWithin(c.location, b.geom, %%s)
+    """ % params, [PRUNE_TOLERANCE])
+    deleted += cursor.rowcount
+    moved = cursor.rowcount
+    cursor.execute("""
+        DELETE FROM %(cache)s c USING %(intersections)s i
+        WHERE i.id = c.intersection_id AND NOT ST_DWithin(c.location, i.location, %%s)
+    """ % params, [PRUNE_TOLERANCE])
+    deleted += cursor.rowcount
+    moved += cursor.rowcount
+    logger.info('Pruned %d results for moved blocks or intersections' % moved)
+    if max_age is not None:
+        cursor.execute("DELETE FROM %(cache)s WHERE generated_at < %%s" % params,
+                       [datetime.datetime.now() - max_age])
+        logger.info('Pruned %d results older than %s' % (cursor.rowcount, max_age))
+        deleted += cursor.rowcount
+    memory_cache.clear()
+    return deleted
+
+@transaction.commit_on_success
+def dedupe():
+    """
+    Deletes all but the newest cached result for each normalized
+    location. Returns the number of rows deleted.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        DELETE FROM %(cache)s c USING %(cache)s newer
+        WHERE newer.normalized_location = c.normalized_location
+          AND newer.id > c.id
+    """ % {'cache': GeocoderCache._meta.db_table})
+    logger.info('Deleted %d duplicate results' % cursor.rowcount)
+    return cursor.rowcount
+
+
+def newsitem_locations():
+    """
+    Yields the distinct location names of all NewsItems.
+    """
+    qs = NewsItem.objects.exclude(location_name='').order_by()
+    return qs.values_list('location_name', flat=True).distinct().iterator()
+
+def block_addresses():
+    """
+    Yields the address at the start of each Block, eg. "200 S WABASH AVE".
+    """
+    qs = Block.objects.order_by().values_list('from_num', 'predir', 'street', 'suffix', 'postdir')
+    for parts in qs.iterator():
+        if parts[0]:
+            yield u' '.join([unicode(part) for part in parts if part])
+
+def _warm_worker(locations):
+    """
+    Geocodes the locations, caching the results.
+    Returns a dict of counts of results that were already cached,
+    newly cached, or failed.
+    """
+    counts = {'cached': 0, 'added': 0, 'failed': 0}
+    try:
+        results = SmartGeocoder(use_cache=True).geocode_many(locations)
+    except Exception:
+        logger.exception('Geocoding %d locations failed' % len(locations))
+        transaction.rollback_unless_managed()
+        counts['failed'] = len(locations)
+        return counts
+    for result in results:
+        if isinstance(result, Exception) or result['point'] is None:
+            counts['failed'] += 1
+        elif result._cache_hit:
+            counts['cached'] += 1
+        else:
+            counts['added'] += 1
+    return counts
+
+def _close_connection():
+    # Each worker must open its own database connection,
+    # rather than sharing the one inherited from the parent.
+    connection.close()
+
+def warm(locations, processes=1, chunk_size=WARM_CHUNK_SIZE):
+    """
+    Geocodes and caches all the given locations that aren't cached
+    already, in chunks of chunk_size, with that many worker processes.
+    Returns a dict of counts as for _warm_worker().
+    """
+    cached = set(GeocoderCache.objects.values_list('normalized_location', flat=True))
+    todo = set()
+    for location in locations:
+        location = normalize(location)
+        if location and location not in cached:
+            todo.add(location)
+    todo = sorted(todo)
+    logger.info('%d locations to geocode, %d already cached' % (len(todo), len(cached)))
+    jobs = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    if processes > 1 and len(jobs) > 1:
+        import multiprocessing
+        _close_connection()
+        pool = multiprocessing.Pool(min(processes, len(jobs)), _close_connection)
+        try:
+            results = list(pool.imap_unordered(_warm_worker, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_warm_worker(job) for job in jobs]
+
+    counts = {'cached': 0, 'added': 0, 'failed': 0}
+    for result in results:
+        for key, value in result.items():
+            counts[key] += value
+    logger.info('Cached %(added)d new results; %(failed)d locations failed to geocode'
+                % counts)
+    return counts
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options]
+
+Maintains the geocoder's database cache. Run it with --prune --dedupe
+--warm-blocks after importing blocks.
+''')
+    optparser.add_option('-p', '--prune', action='store_true',
+                         help='Delete results for blocks and intersections that were deleted or moved.')
+    optparser.add_option('--max-age', type='int', metavar='DAYS',
+                         help='With --prune, also delete results cached more than this many days ago.')
+    optparser.add_option('-d', '--dedupe', action='store_true',
+                         help='Delete all but the newest result for each location.')
+    optparser.add_option('-n', '--warm-newsitems', action='store_true',
+                         help='Geocode and cache the location names of all NewsItems.')
+    optparser.add_option('-b', '--warm-blocks', action='store_true',
+                         help='Geocode and cache the first address of every block.')
+    optparser.add_option('-j', '--processes', type='int', default=1,
+                         help='How many processes to geocode with. Default %default.')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    if not (opts.prune or opts.dedupe or opts.warm_newsitems or opts.warm_blocks):
+        optparser.error('Nothing to do; see --help.')
+    setup_logging_from_opts(opts, logger)
+
+    if opts.prune:
+        max_age = opts.max_age and datetime.timedelta(days=opts.max_age) or None
+        prune(max_age)
+    if opts.dedupe:
+        dedupe()
+    if opts.warm_newsitems:
+        logger.info('Warming the cache with NewsItem locations')
+        warm(newsitem_locations(), opts.processes)
+    if opts.warm_blocks:
+        logger.info('Warming the cache with block addresses')
+        warm(block_addresses(), opts.processes)
+
+if __name__ == "__main__":
+    main()
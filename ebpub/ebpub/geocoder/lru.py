@@ -0,0 +1,121 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+A small in-process LRU cache with expiration.
+"""
+
+import threading
+import time
+
+# Fields of the links in LRUCache's list.
+PREV, NEXT, KEY, EXPIRES, VALUE = range(5)
+
+class LRUCache(object):
+    """
+    Keeps at most ``maxsize`` items, discarding the least recently
+    used ones first. Items expire after ``timeout`` seconds, unless
+    a different timeout is given to set().
+
+    Keeps count of ``hits``, ``misses``, and ``evictions``.
+
+    >>> cache = LRUCache(maxsize=2, timeout=60)
+    >>> cache.set('a', 1); cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, maxsize=1000, timeout=3600):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # Maps keys to links in a circular doubly linked list, from
+        # least to most recently used, each [prev, next, key, expires,
+        # value]. (collections.OrderedDict needs Python 2.7.)
+        self._data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _append(self, link):
+        # Make it the most recently used.
+        last = self._root[PREV]
+        link[PREV], link[NEXT] = last, self._root
+        last[NEXT] = self._root[PREV] = link
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            if link[EXPIRES] < time.time():
+                self._unlink(link)
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[VALUE]
+
+    def set(self, key, value, timeout=None):
+        if self.maxsize <= 0:
+            return
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            link = self._data.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, time.time() + timeout, value]
+            self._append(link)
+            self._data[key] = link
+            while len(self._data) > self.maxsize:
+                oldest = self._root[NEXT]
+                self._unlink(oldest)
+                del self._data[oldest[KEY]]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            link = self._data.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._root[:] = [self._root, self._root, None, None, None]
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
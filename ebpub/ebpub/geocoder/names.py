@@ -0,0 +1,91 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Process-local dictionary of Location and Place names, so that
+full_geocode() can tell whether a query names one without any
+database queries.
+"""
+
+from ebpub.geocoder.parser.parsing import normalize
+from ebpub.utils.registry import Registry
+
+
+class NameRegistry(Registry):
+    """
+    Maps the normalized names and synonyms of all Locations and
+    Places to their IDs.
+
+    Like ebpub.db.models.SchemaFieldRegistry, it's loaded in one go
+    and kept around. Saving or deleting a Location, Place, or synonym
+    clears it in this process (see the signal handlers at the bottom
+    of ebpub.db.models and ebpub.streets.models), and changes a
+    version key in the Django cache so that other processes notice
+    within check_interval seconds. See ebpub.utils.registry.Registry
+    for details.
+    """
+
+    version_cache_key = 'geocoder_name_registry_version'
+
+    def _load(self):
+        # Local import to avoid circular imports.
+        from ebpub.db.models import Location, LocationSynonym
+        from ebpub.streets.models import Place, PlaceSynonym
+        locations = {}
+        for loc_id, name in Location.objects.order_by('-id').values_list('id', 'normalized_name'):
+            # Lowest ID wins.
+            locations[name] = loc_id
+        places = {}
+        for place_id, name in Place.objects.order_by('id').values_list('id', 'normalized_name'):
+            places.setdefault(name, []).append(place_id)
+        return {
+            'locations': locations,
+            'location_synonyms': dict(LocationSynonym.objects.values_list(
+                    'normalized_name', 'location__normalized_name')),
+            'places': places,
+            'place_synonyms': dict(PlaceSynonym.objects.values_list(
+                    'normalized_name', 'place__normalized_name')),
+            }
+
+    def location_id(self, name):
+        """
+        Returns the ID of the Location with the given name or synonym
+        (after normalizing it), or None.
+        """
+        names = self.get_data()
+        name = normalize(name)
+        name = names['location_synonyms'].get(name, name)
+        return names['locations'].get(name)
+
+    def place_ids(self, name):
+        """
+        Returns a list of IDs of the Places with the given name or
+        synonym (after normalizing it); empty if there are none.
+        """
+        names = self.get_data()
+        name = normalize(name)
+        name = names['place_synonyms'].get(name, name)
+        return list(names['places'].get(name, ()))
+
+name_registry = NameRegistry()
+
+def invalidate_name_registry(sender, **kwargs):
+    """
+    Signal handler for changes to Locations, Places, and synonyms.
+    """
+    name_registry.invalidate()
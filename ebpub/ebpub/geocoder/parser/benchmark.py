@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures address parsing and normalizing throughput over a corpus of
+addresses, one per line (default: benchmark_addresses.txt in this
+directory).
+"""
+
+import os
+import time
+
+from ebpub.geocoder.parser import parsing
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), 'benchmark_addresses.txt')
+
+def read_corpus(path=DEFAULT_CORPUS):
+    addresses = []
+    for line in open(path):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            addresses.append(line.decode('utf8'))
+    return addresses
+
+def benchmark(addresses, repeat=10):
+    """
+    Parses every address ``repeat`` times.
+    Returns (parses per second, number of addresses that failed to parse).
+
+    The first pass starts with an empty token cache; later passes
+    show the benefit of it.
+    """
+    parsing._token_classes.cache.clear()
+    parsing.normalize.cache.clear()
+    parsing.strip_unit.cache.clear()
+    failures = 0
+    start = time.time()
+    for i in range(repeat):
+        for address in addresses:
+            try:
+                parsing.parse(address)
+            except parsing.ParsingError:
+                if i == 0:
+                    failures += 1
+    elapsed = time.time() - start
+    return (len(addresses) * repeat / elapsed, failures)
+
+def benchmark_normalize(addresses, repeat=10, cached=True):
+    """
+    Normalizes every address ``repeat`` times, the way a scraper does
+    when it geocodes items: geocode() normalizes the location, then
+    parse() normalizes it again and strips the unit.
+    Returns normalizations per second.
+
+    If ``cached`` is False, uses the functions without their caches.
+    """
+    if cached:
+        normalize, strip_unit = parsing.normalize, parsing.strip_unit
+        normalize.cache.clear()
+        strip_unit.cache.clear()
+    else:
+        normalize, strip_unit = parsing.normalize.uncached, parsing.strip_unit.uncached
+    start = time.time()
+    for i in range(repeat):
+        for address in addresses:
+            strip_unit(normalize(normalize(address)))
+    elapsed = time.time() - start
+    return len(addresses) * repeat / elapsed
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] [corpus file]
+
+Measures how many addresses per second the geocoder's parser can parse,
+and normalize with and without caching.
+''')
+    optparser.add_option('-r', '--repeat', type='int', default=10,
+                         help='Number of passes over the corpus. Default %default.')
+    opts, args = optparser.parse_args(argv)
+    addresses = read_corpus(*args[:1])
+    rate, failures = benchmark(addresses, opts.repeat)
+    print "%d addresses, %d failed to parse" % (len(addresses), failures)
+    print "%.1f parses per second" % rate
+    print "%.1f normalizations per second, uncached" % benchmark_normalize(
+        addresses, opts.repeat, cached=False)
+    print "%.1f normalizations per second, cached" % benchmark_normalize(
+        addresses, opts.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -120,6 +120,63 @@ half_addresses_re = re.compile(r'(?<=\s)[I1]/2(?=\s)')
 multi_dash_re = re.compile(r'(?<=\d)\s*-+\s*(?=\d)')
 zip_plus_4_re = re.compile(r'(?<=^\d{5})-\d{4}$')
 
+whitespace_re = re.compile(r'\s+')
+unit_re = re.compile(r'(?i)(\s*,)?\s*(?:space\s+|suite\s+|ste\.?\s+|unit:?\s+|apt\.?\s+|\#\s*)[-\#0-9a-z]*$')
+
+# How many results normalize() and strip_unit() each remember.
+NORMALIZE_CACHE_SIZE = 10000
+
+def memoize(cache_size):
+    """
+    Decorator for functions of one string argument, that remembers
+    results for up to cache_size different arguments. The cache is
+    cleared when it gets that big, so a stream of unusual input can't
+    grow it forever.
+
+    The undecorated function is available as ``.uncached``, and the
+    cache as ``.cache``.
+
+    >>> @memoize(2)
+    ... def shout(s):
+    ...     print 'computing', s
+    ...     return s.upper()
+    >>> shout('a')
+    computing a
+    'A'
+    >>> shout('a')
+    'A'
+    >>> shout(u'a')
+    computing a
+    u'A'
+    >>> shout('b')
+    computing b
+    'B'
+    >>> len(shout.cache)
+    1
+    """
+    def decorator(func):
+        cache = {}
+        def wrapper(s):
+            # str and unicode versions of the same text are equal
+            # dict keys, but their results have different types.
+            key = (s.__class__, s)
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = func(s)
+            if len(cache) >= cache_size:
+                cache.clear()
+            cache[key] = result
+            return result
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.uncached = func
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+@memoize(NORMALIZE_CACHE_SIZE)
 def normalize(location):
     """
     Normalizes an address string for parsing, comparisons.
@@ -136,11 +193,12 @@ def normalize(location):
     location = half_addresses_re.sub('', location) # Strip "1/2" addresses.
     location = multi_dash_re.sub('-', location)
     location = punct.sub('', location) # Remove all punctuation except dashes, and ampersands.
-    location = re.sub(r'\s+', ' ', location.strip()) # Strip/normalize whitespace.
+    location = whitespace_re.sub(' ', location.strip()) # Strip/normalize whitespace.
     location = zip_plus_4_re.sub('', location) # Strip the +4 part of a ZIP+4.
-    logger.debug("normalized: %r to %r" % (old_location, location))
+    logger.debug("normalized: %r to %r", old_location, location)
     return location
 
+@memoize(NORMALIZE_CACHE_SIZE)
 def strip_unit(location):
     """
     Given an address string, strips the apartment number, suite number, etc.
@@ -159,7 +217,7 @@ def strip_unit(location):
     '148 lafayette st'
 
     """
-    return re.sub(r'(?i)(\s*,)?\s*(?:space\s+|suite\s+|ste\.?\s+|unit:?\s+|apt\.?\s+|\#\s*)[-\#0-9a-z]*$', '', location)
+    return unit_re.sub('', location)
 
 ###########
 # PARSING #
@@ -260,24 +318,50 @@ def address_combinations():
                                     yield ['number'] * number_times + ['pre_dir'] * pre_dir_times + ['street'] * street_times + ['suffix'] * suffix_times + ['post_dir'] * post_dir_times + ['city'] * city_times + ['state'] * state_times + ['zip'] * zip_times
 
 
+def _combinations_by_length():
+    """
+    Returns a dictionary mapping a number of tokens to a list of
+    all the address_combinations() of that length, as tuples,
+    in the order address_combinations() generates them.
+    """
+    by_length = {}
+    for token_types in address_combinations():
+        by_length.setdefault(len(token_types), []).append(tuple(token_types))
+    return by_length
+
+# Built once, so parse() only has to look at combinations of the right length.
+COMBINATIONS_BY_LENGTH = _combinations_by_length()
+
+# How many results _token_classes() remembers.
+TOKEN_CLASSES_CACHE_SIZE = 10000
+
+@memoize(TOKEN_CLASSES_CACHE_SIZE)
+def _token_classes(token):
+    """
+    Returns the set of token types whose TOKEN_REGEXES match the token.
+
+    >>> sorted(_token_classes('AVE'))
+    ['city', 'state', 'street', 'suffix']
+    >>> sorted(_token_classes('228'))
+    ['number', 'street']
+    """
+    return frozenset([token_type for token_type, regex in TOKEN_REGEXES.items()
+                      if regex.match(token)])
+
 punc_split = re.compile(r"\S+").findall
 
 def parse(location):
     s = strip_unit(normalize(location))
     logger.debug('parse: normalized and stripped %r to %r' % (location, s))
     tokens = punc_split(s)
-    len_tokens = len(tokens)
+    token_classes = [_token_classes(token) for token in tokens]
     result_list = []
 
-    for token_types in address_combinations():
-        if len(token_types) == len_tokens:
-            try:
-                for token, token_type in izip(tokens, token_types):
-                    if not TOKEN_REGEXES[token_type].match(token):
-                        raise StopIteration() # Token regex didn't match.
-            except StopIteration:
-                continue
-
+    for token_types in COMBINATIONS_BY_LENGTH.get(len(tokens), ()):
+        for classes, token_type in izip(token_classes, token_types):
+            if token_type not in classes:
+                break # Token regex didn't match.
+        else:
             # If we made it this far, then all of the tokens are valid.
             # Create the Location object.
             result = Location()
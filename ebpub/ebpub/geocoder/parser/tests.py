@@ -278,5 +278,41 @@ class LocationTestCase(unittest.TestCase):
             {'number': '1110', 'pre_dir': None, 'street': 'BRONX RIVER', 'suffix': 'AVE', 'post_dir': None, 'city': 'THE BRONX', 'state': None, 'zip': None},
         )
 
+class CombinationsTestCase(unittest.TestCase):
+
+    def test_combinations_by_length(self):
+        from ebpub.geocoder.parser.parsing import COMBINATIONS_BY_LENGTH
+        all_combinations = [tuple(c) for c in address_combinations()]
+        flattened = []
+        for length, combinations in COMBINATIONS_BY_LENGTH.items():
+            for combination in combinations:
+                self.assertEqual(len(combination), length)
+            flattened.extend(combinations)
+        self.assertEqual(sorted(flattened), sorted(all_combinations))
+        # Order within a length is preserved, since parse() results
+        # come out in that order.
+        self.assertEqual(COMBINATIONS_BY_LENGTH[1],
+                         [c for c in all_combinations if len(c) == 1])
+
+    def test_token_classes_memoized(self):
+        from ebpub.geocoder.parser import parsing
+        parsing._token_classes.cache.clear()
+        classes = parsing._token_classes('60604')
+        self.assertEqual(classes, frozenset(['number', 'zip']))
+        self.assert_(parsing._token_classes('60604') is classes)
+
+    def test_normalize_memoized(self):
+        from ebpub.geocoder.parser import parsing
+        for func in (parsing.normalize, parsing.strip_unit):
+            func.cache.clear()
+            for location in ('45 carlton ave #12', u'45 carlton ave #12',
+                             '1972 n. dawson ave., chicago il'):
+                result = func(location)
+                self.assertEqual(result, func.uncached(location))
+                self.assertEqual(type(result), type(func.uncached(location)))
+                self.assert_(func(location) is result)
+            self.assertEqual(len(func.cache), 3)
+
+
 if __name__ == "__main__":
     unittest.main()
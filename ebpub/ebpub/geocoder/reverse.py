@@ -16,14 +16,56 @@
 #   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import unittest
-from psycopg2 import Binary
 from django.contrib.gis.geos import Point
 from django.db import connection
+import re
 
 class ReverseGeocodeError(Exception):
     pass
 
+# How many blocks to compare exact distances for, from the nearest by
+# bounding box according to the spatial index.
+KNN_CANDIDATES = 10
+
+# How many points to look up per query in reverse_geocode_many().
+BATCH_SIZE = 500
+
+# Without KNN support, how far (in degrees) to search for blocks at
+# first, and how much to multiply that by each time nothing is found.
+MIN_DISTANCE = 0.007
+DISTANCE_FACTOR = 8
+# Give up beyond this; it covers the whole world.
+MAX_DISTANCE = 360
+
+_knn_supported = None
+
+def _parse_version(version):
+    return tuple([int(n) for n in re.findall(r'\d+', version)[:2]])
+
+def knn_supported():
+    """
+    Whether the database can do the KNN query in
+    _reverse_geocode_batch(): that needs LATERAL (PostgreSQL 9.3),
+    and <-> ordering by true distance rather than by bounding box
+    centers (PostGIS 2.2).
+    """
+    global _knn_supported
+    if _knn_supported is None:
+        cursor = connection.cursor()
+        cursor.execute("SELECT current_setting('server_version_num'), postgis_lib_version()")
+        server_version, postgis_version = cursor.fetchone()
+        _knn_supported = (int(server_version) >= 90300
+                          and _parse_version(postgis_version) >= (2, 2))
+    return _knn_supported
+
+def _to_point(point):
+    if isinstance(point, basestring):
+        from django.contrib.gis.geos import fromstr
+        point = fromstr(point, srid=4326)
+    elif isinstance(point, tuple) or isinstance(point, list):
+        point = Point(tuple(point))
+    return point
+
 def reverse_geocode(point):
     """
     Looks up the nearest block to the point.
@@ -33,52 +75,108 @@ def reverse_geocode(point):
 
     Returns (block, distance (in degrees I think??))
     """
+    result = reverse_geocode_many([point])[0]
+    if result is None:
+        raise ReverseGeocodeError('No results')
+    return result
+
+def reverse_geocode_many(points):
+    """
+    Like reverse_geocode(), for a list of points, but with one query
+    per BATCH_SIZE points. Returns a list with, for each point in order,
+    either (block, distance) or None if there are no blocks at all.
+
+    If there's an in-memory BlockIndex (see ebpub.streets.blockindex),
+    it's used instead of the database.
+    """
     # Defer import to avoid cyclical import.
-    from ebpub.streets.models import Block
+    from ebpub.streets.blockindex import get_block_index
+    points = [_to_point(point) for point in points]
+    index = get_block_index()
+    if index is not None:
+        return [index.nearest(point.x, point.y) for point in points]
+    if knn_supported():
+        reverse_geocode_batch = _reverse_geocode_batch
+    else:
+        reverse_geocode_batch = _reverse_geocode_batch_dwithin
+    results = []
+    for start in range(0, len(points), BATCH_SIZE):
+        results.extend(reverse_geocode_batch(points[start:start + BATCH_SIZE]))
+    return results
 
-    if isinstance(point, basestring):
-        from django.contrib.gis.geos import fromstr
-        point = fromstr(point, srid=4326)
-    elif isinstance(point, tuple) or isinstance(point, list):
-        point = Point(tuple(point))
+def _reverse_geocode_batch(points):
+    if not points:
+        return []
+    # The <-> operator uses the spatial index to find the nearest
+    # blocks, with no fixed search radius; then we compare the exact
+    # distances of a few of those.
+    # LATERAL lets us do that for every point in one query.
     # In degrees for now because transforming to a projected space is
     # too slow for this purpose. TODO: store projected versions of the
     # locations alongside the canonical lng/lat versions.
-    min_distance = 0.007
-    # We use min_distance to cut down on the searchable space, because
-    # the distance query we do next that actually compares distances
-    # between geometries does not use the spatial index. TODO: convert
-    # this to GeoDjango syntax. Should be possible but there are some
-    # subtleties / performance issues with the DB API.
-    cursor = connection.cursor()
-    # Switched to WKT rather than WKB, because constructing WKB as a
-    # string leads to psycopg2 getting confused by '%' as per
-    # http://stackoverflow.com/questions/1734814/why-isnt-psycopg2-executing-any-of-my-sql-functions-indexerror-tuple-index-ou
-    # We could probably do something like
-    # str(Binary(point.wkb)).replace('%', '%%') ... but I don't know
-    # if that could have other problems?
-    # Or maybe a Binary() could be passed as a parameter to cursor.execute().
-    # Anyway, WKT is safe.
-    params = {'field_list': ', '.join([f.column for f in Block._meta.fields]),
-              'pt_wkt': point.wkt,
-              'geom_fieldname': 'geom',
-              'tablename': Block._meta.db_table,
-              'min_distance': min_distance
-              }
+    params = _batch_params(points)
+    params['candidates'] = KNN_CANDIDATES
     sql = """
-        SELECT %(field_list)s, ST_Distance(ST_GeomFromText('%(pt_wkt)s', 4326), %(geom_fieldname)s) AS "dist"
-        FROM %(tablename)s
-        WHERE id IN
-            (SELECT id
-             FROM %(tablename)s
-             WHERE ST_DWithin(%(geom_fieldname)s, ST_GeomFromText('%(pt_wkt)s', 4326), %(min_distance)s))
-        ORDER BY "dist"
-        LIMIT 1;
+        SELECT pts.idx, nearest.*
+        FROM (VALUES %(values)s) AS pts (idx, wkt),
+        LATERAL (
+            SELECT %(field_list)s,
+                ST_Distance(ST_GeomFromText(pts.wkt, 4326), b.%(geom_fieldname)s) AS "dist"
+            FROM (SELECT * FROM %(tablename)s
+                  ORDER BY %(geom_fieldname)s <-> ST_GeomFromText(pts.wkt, 4326)
+                  LIMIT %(candidates)s) AS b
+            ORDER BY "dist"
+            LIMIT 1
+        ) AS nearest
     """ % params
-    cursor.execute(sql)
+    cursor = connection.cursor()
+    cursor.execute(sql, [point.wkt for point in points])
+    results = [None] * len(points)
+    _fill_results(results, range(len(points)), cursor.fetchall())
+    return results
+
+def _reverse_geocode_batch_dwithin(points):
+    """
+    Like _reverse_geocode_batch(), for older PostgreSQL and PostGIS.
+    Searches within MIN_DISTANCE of each point, then further away for
+    the points that had no blocks that close.
+    """
+    results = [None] * len(points)
+    todo = range(len(points))
+    distance = MIN_DISTANCE
+    while todo:
+        # We use the distance to cut down on the searchable space,
+        # because ST_Distance() doesn't use the spatial index.
+        params = _batch_params([points[i] for i in todo])
+        sql = """
+            SELECT DISTINCT ON (pts.idx) pts.idx, %(field_list)s,
+                ST_Distance(ST_GeomFromText(pts.wkt, 4326), b.%(geom_fieldname)s) AS "dist"
+            FROM (VALUES %(values)s) AS pts (idx, wkt), %(tablename)s b
+            WHERE ST_DWithin(b.%(geom_fieldname)s, ST_GeomFromText(pts.wkt, 4326), %%s)
+            ORDER BY pts.idx, "dist"
+        """ % params
+        cursor = connection.cursor()
+        cursor.execute(sql, [points[i].wkt for i in todo] + [distance])
+        _fill_results(results, todo, cursor.fetchall())
+        todo = [i for i in todo if results[i] is None]
+        if distance >= MAX_DISTANCE:
+            break
+        distance *= DISTANCE_FACTOR
+    return results
+
+def _batch_params(points):
+    # Defer import to avoid cyclical import.
+    from ebpub.streets.models import Block
+    return {'field_list': ', '.join(['b.%s' % f.column for f in Block._meta.fields]),
+            'geom_fieldname': 'geom',
+            'tablename': Block._meta.db_table,
+            'values': ', '.join(['(%s, %%s)' % i for i in range(len(points))]),
+            }
+
+def _fill_results(results, indexes, rows):
+    # Each row is (index into indexes, block fields..., distance).
+    # Defer import to avoid cyclical import.
+    from ebpub.streets.models import Block
     num_fields = len(Block._meta.fields)
-    rows = cursor.fetchall()
-    if not rows:
-        raise ReverseGeocodeError('No results')
-    block, distance = [(Block(*row[:num_fields]), row[-1]) for row in rows][0]
-    return block, distance
+    for row in rows:
+        results[indexes[row[0]]] = (Block(*row[1:num_fields + 1]), row[-1])
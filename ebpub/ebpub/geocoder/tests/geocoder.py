@@ -17,6 +17,7 @@
 #
 
 from ebpub.geocoder import SmartGeocoder, AmbiguousResult, InvalidBlockButValidStreet
+from ebpub.geocoder import DoesNotExist, memory_cache
 import os.path
 import unittest
 import django.test
@@ -84,5 +85,351 @@ class BaseGeocoderTestCase(django.test.TestCase):
         address = self.geocoder.geocode('Wabash and Jackson')
         self.assertEqual(address['city'], 'CHICAGO')
 
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_geocode_many(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        locations = ['200 S Wabash', '220 Wabash', '100000 S Wabash',
+                     '200 block of Wabash', 'Wabash and Jackson', '200 S Wabash']
+        results = self.geocoder.geocode_many(locations)
+        self.assertEqual(len(results), len(locations))
+        self.assertEqual(results[0]['city'], 'Chicago')
+        self.assert_(isinstance(results[1], AmbiguousResult))
+        self.assert_(isinstance(results[2], InvalidBlockButValidStreet))
+        self.assertEqual(results[3]['city'], 'Chicago')
+        self.assertEqual(results[4]['city'], 'CHICAGO')
+        self.assertEqual(results[5]['point'], results[0]['point'])
+        # Same point as geocoding it alone.
+        single = self.geocoder.geocode('200 S Wabash')
+        self.assertAlmostEqual(single['point'].x, results[0]['point'].x, places=6)
+        self.assertAlmostEqual(single['point'].y, results[0]['point'].y, places=6)
+
+    def test_reverse_geocode(self):
+        from ebpub.geocoder.reverse import reverse_geocode
+        block, distance = reverse_geocode((-87.6261, 41.8789))
+        self.assertEqual(block.pretty_name, u'200-298 S. Wabash Ave.')
+        self.assert_(distance < 0.0001)
+
+    def test_reverse_geocode_many(self):
+        from ebpub.geocoder.reverse import reverse_geocode_many
+        points = [(-87.6261, 41.8789), (-87.6262, 41.8820), (-80.0, 40.0)]
+        results = reverse_geocode_many(points)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0].pretty_name, u'200-298 S. Wabash Ave.')
+        self.assertEqual(results[1][0].street_pretty_name, u'Wabash Ave.')
+        # There's no maximum distance; far away points still get the
+        # nearest block.
+        self.assertNotEqual(results[2], None)
+        self.assert_(results[2][1] > 1.0)
+
+    def test_reverse_geocode_many__without_knn(self):
+        from ebpub.geocoder.reverse import _reverse_geocode_batch_dwithin
+        from django.contrib.gis.geos import Point
+        points = [Point(-87.6261, 41.8789), Point(-87.6262, 41.8820), Point(-80.0, 40.0)]
+        results = _reverse_geocode_batch_dwithin(points)
+        self.assertEqual(results[0][0].pretty_name, u'200-298 S. Wabash Ave.')
+        self.assertEqual(results[1][0].street_pretty_name, u'Wabash Ave.')
+        self.assert_(results[2][1] > 1.0)
+
+class IndexedGeocoderTestCase(BaseGeocoderTestCase):
+    """
+    Runs the same tests with an in-memory BlockIndex
+    instead of searching blocks in the database.
+    """
+
+    def setUp(self):
+        super(IndexedGeocoderTestCase, self).setUp()
+        from ebpub.streets.blockindex import BlockIndex, set_block_index
+        from ebpub.streets.models import Block
+        set_block_index(BlockIndex.from_queryset(Block.objects.all()))
+
+    def tearDown(self):
+        from ebpub.streets.blockindex import set_block_index
+        set_block_index(None)
+        super(IndexedGeocoderTestCase, self).tearDown()
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_address_geocoder__no_block_queries(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        from ebpub.streets.models import BlockManager
+        with mock.patch.object(BlockManager, '_search_queryset') as mock_search:
+            address = self.geocoder.geocode('200 S Wabash')
+            self.assertEqual(mock_search.call_count, 0)
+        self.assertEqual(address['city'], 'Chicago')
+
+    def test_pickled_index(self):
+        import cPickle as pickle
+        from ebpub.streets.blockindex import get_block_index
+        index = get_block_index()
+        copied = pickle.loads(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(len(copied), len(index))
+        self.assertEqual([b.id for b, pt in copied.search('WABASH', '200', 'S')],
+                         [b.id for b, pt in index.search('WABASH', '200', 'S')])
+
+    def test_nearest__same_as_database(self):
+        from ebpub.geocoder.reverse import _reverse_geocode_batch
+        from ebpub.streets.blockindex import get_block_index
+        from django.contrib.gis.geos import Point
+        index = get_block_index()
+        points = [Point(-87.6261, 41.8789), Point(-87.6262, 41.8820),
+                  Point(-87.6300, 41.8780)]
+        for point, (db_block, db_distance) in zip(points, _reverse_geocode_batch(points)):
+            block, distance = index.nearest(point.x, point.y)
+            self.assertAlmostEqual(distance, db_distance, places=6)
+
+
+class FuzzyStreetNamesTestCase(django.test.TestCase):
+    fixtures = ['wabash.yaml']
+
+    def setUp(self):
+        from ebpub.streets.fuzzy import StreetNameIndex, set_street_name_index
+        set_street_name_index(StreetNameIndex.from_blocks())
+        self.geocoder = SmartGeocoder(use_cache=False)
+
+    def tearDown(self):
+        from ebpub.streets.fuzzy import set_street_name_index
+        set_street_name_index(None)
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_address_geocoder__misspelled(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        address = self.geocoder.geocode('200 S Wabsh')
+        self.assertEqual(address['address'], u'200 S Wabash Ave.')
+
+    def test_address_geocoder__unknown_street(self):
+        # Doesn't retry without the suffix, or look for the street.
+        from ebpub.geocoder.base import AddressGeocoder
+        from ebpub.streets.models import Block
+        with mock.patch.object(AddressGeocoder, '_db_lookup') as mock_lookup:
+            mock_lookup.return_value = []
+            with mock.patch.object(Block.objects, 'filter') as mock_filter:
+                self.assertRaises(DoesNotExist, self.geocoder.geocode, '200 Nowhere St')
+                self.assertEqual(mock_filter.call_count, 0)
+            for args, kwargs in mock_lookup.call_args_list:
+                self.assertEqual(args[0]['suffix'], 'ST')
+
+    def test_intersection_geocoder__misspelled(self):
+        address = self.geocoder.geocode('Wabahs and Jackson')
+        self.assertEqual(address['intersection_id'], 1000)
+
+    def test_correct__ambiguous(self):
+        from ebpub.streets.fuzzy import StreetNameIndex
+        index = StreetNameIndex(['WABASH', 'WABASE'])
+        self.assertEqual(index.correct('WABASX'), None)
+        self.assertEqual(index.correct('WABAHS'), 'WABASH')
+        self.assertEqual(index.correct('OAK'), None)
+
+
+class MemoryCacheTestCase(django.test.TestCase):
+    fixtures = ['wabash.yaml']
+
+    def setUp(self):
+        memory_cache.clear()
+        self.geocoder = SmartGeocoder(use_cache=True)
+
+    def tearDown(self):
+        memory_cache.clear()
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_memory_cache_hit(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        address = self.geocoder.geocode('200 S Wabash')
+        self.assertEqual(memory_cache.stats()['hits'], 0)
+        with mock.patch.object(self.geocoder, '_do_geocode') as mock_do_geocode:
+            with self.assertNumQueries(0):
+                cached = self.geocoder.geocode('200 s. wabash')
+            self.assertEqual(mock_do_geocode.call_count, 0)
+        self.assertEqual(cached['point'], address['point'])
+        self.assertEqual(cached['block'], address['block'])
+        self.assertEqual(cached._cache_hit, True)
+        self.assertEqual(memory_cache.stats()['hits'], 1)
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_memory_cache_copies(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        address = self.geocoder.geocode('200 S Wabash')
+        x = address['point'].x
+        address['point'].transform(3395)
+        address['block'].pretty_name = 'Changed'
+        cached = self.geocoder.geocode('200 S Wabash')
+        self.assertEqual(cached['point'].x, x)
+        self.assertEqual(cached['block'].pretty_name, u'200-298 S. Wabash Ave.')
+        cached['point'].transform(3395)
+        self.assertEqual(self.geocoder.geocode('200 S Wabash')['point'].x, x)
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_memory_cache_failures(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        self.assertRaises(AmbiguousResult, self.geocoder.geocode, '220 Wabash')
+        self.assertRaises(DoesNotExist, self.geocoder.geocode, '200 Nonexistent St')
+        with mock.patch.object(self.geocoder, '_do_geocode') as mock_do_geocode:
+            self.assertRaises(AmbiguousResult, self.geocoder.geocode, '220 Wabash')
+            self.assertRaises(DoesNotExist, self.geocoder.geocode, '200 Nonexistent St')
+            self.assertEqual(mock_do_geocode.call_count, 0)
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_memory_cache_failures_copied(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        def choices():
+            try:
+                self.geocoder.geocode('220 Wabash')
+            except AmbiguousResult, e:
+                return e.choices
+            self.fail('AmbiguousResult not raised')
+        first = choices()
+        count, x = len(first), first[0]['point'].x
+        first[0]['point'].transform(3395)
+        first.pop()
+        cached = choices()
+        self.assertEqual(len(cached), count)
+        self.assertEqual(cached[0]['point'].x, x)
+        cached[0]['point'].transform(3395)
+        cached.pop()
+        cached = choices()
+        self.assertEqual(len(cached), count)
+        self.assertEqual(cached[0]['point'].x, x)
+
+    def test_memory_cache_disabled(self):
+        geocoder = SmartGeocoder(use_cache=False)
+        self.assertRaises(DoesNotExist, geocoder.geocode, '200 Nonexistent St')
+        self.assertEqual(len(memory_cache), 0)
+
 if __name__ == '__main__':
     pass
+
+
+class NameRegistryTestCase(django.test.TestCase):
+    fixtures = ['test-locationdetail-views.json']
+
+    def setUp(self):
+        from ebpub.geocoder.names import name_registry
+        name_registry.clear()
+
+    def test_full_geocode_location(self):
+        from ebpub.geocoder.base import full_geocode
+        result = full_geocode('  hood 1', search_places=False)
+        self.assertEqual(result['type'], 'location')
+        self.assertEqual(result['result'].id, 2000)
+
+    def test_no_queries_for_misses(self):
+        from ebpub.geocoder.names import name_registry
+        name_registry.location_id('hood 1')  # Make sure it's loaded.
+        with self.assertNumQueries(0):
+            self.assertEqual(name_registry.location_id('nowhere'), None)
+            self.assertEqual(name_registry.place_ids('nowhere'), [])
+
+    def test_invalidated_on_save(self):
+        from ebpub.db.models import LocationSynonym
+        from ebpub.geocoder.names import name_registry
+        self.assertEqual(name_registry.location_id('the hood'), None)
+        LocationSynonym(pretty_name='The Hood', location_id=3000).save()
+        self.assertEqual(name_registry.location_id('the hood'), 3000)
+
+    @mock.patch('ebpub.utils.registry.cache')
+    def test_reloaded_when_old(self, mock_cache):
+        from ebpub.db.models import Location
+        from ebpub.geocoder.names import NameRegistry
+        mock_cache.get.return_value = None
+        registry = NameRegistry()
+        self.assertEqual(registry.location_id('hood 1'), 2000)
+        # Bypass the signals, as if another process did it.
+        Location.objects.filter(id=2000).update(normalized_name='HOOD 3')
+        self.assertEqual(registry.location_id('hood 3'), None)
+        with mock.patch.object(registry, 'max_age', -1):
+            self.assertEqual(registry.location_id('hood 3'), 2000)
+
+
+class BenchmarkTestCase(django.test.TestCase):
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    @mock.patch('ebpub.geocoder.benchmark.get_metro')
+    def test_benchmark(self, mock_get_metro, mock_streets_get_metro):
+        from ebpub.geocoder import benchmark
+        mock_get_metro.return_value = mock_streets_get_metro.return_value = {
+            'city_name': 'Benchmark', 'state': 'XX', 'multiple_cities': False,
+            'extent': (0.0, 0.0, 1.0, 1.0)}
+        grid = benchmark.build_grid(size=3)
+        corpus = benchmark.make_corpus(grid, length=30)
+        self.assertEqual(len(corpus), 30)
+        results = benchmark.run(corpus, passes=2)
+        self.assertEqual(sorted(results.keys()), sorted(benchmark.STAGES))
+        self.assertEqual(results['geocode_cached']['count'], 60)
+        self.assert_(results['geocode']['outcomes']['ok'] > 0)
+        self.assert_(results['geocode']['queries_per_call'] > 0)
+        self.assert_(results['geocode_cached']['memory_cache_hit_rate'] > 0)
+        self.assertEqual(benchmark.compare(results, results), [])
+
+    def test_compare(self):
+        from ebpub.geocoder.benchmark import compare
+        baseline = {'geocode': {'p50_ms': 1.0, 'p90_ms': 2.0, 'queries_per_call': 2.0,
+                                'outcomes': {'ok': 10}}}
+        results = {'geocode': {'p50_ms': 1.1, 'p90_ms': 3.0, 'queries_per_call': 2.5,
+                               'outcomes': {'ok': 9}}}
+        self.assertEqual(compare(results, baseline, tolerance=0.25),
+                         ['geocode p90_ms went from 2.0 to 3.0',
+                          'geocode queries_per_call went from 2.0 to 2.5',
+                          'geocode successful results went from 10 to 9'])
+
+
+class MaintainGeocoderCacheTestCase(django.test.TestCase):
+    fixtures = ['wabash.yaml']
+
+    def setUp(self):
+        memory_cache.clear()
+
+    def tearDown(self):
+        memory_cache.clear()
+
+    def _cache(self, location, block_id=1000, point=None):
+        from django.contrib.gis.geos import Point
+        from ebpub.geocoder.models import GeocoderCache
+        from ebpub.streets.models import Block
+        from ebpub.utils.geodjango import interpolate_coords
+        block = Block.objects.get(id=block_id)
+        if point is None:
+            point = Point(interpolate_coords(block.geom.coords, 0.5), srid=4326)
+        GeocoderCache.populate(location, {
+                'address': location, 'city': 'CHICAGO', 'state': 'IL', 'zip': '60605',
+                'point': point, 'block': block})
+
+    def test_dedupe(self):
+        from ebpub.geocoder.bin.maintain_geocoder_cache import dedupe
+        from ebpub.geocoder.models import GeocoderCache
+        for i in range(3):
+            self._cache('200 S WABASH AVE')
+        self._cache('210 S WABASH AVE')
+        newest = GeocoderCache.objects.filter(normalized_location='200 S WABASH AVE').order_by('-id')[0]
+        self.assertEqual(dedupe(), 2)
+        self.assertEqual(list(GeocoderCache.objects.filter(normalized_location='200 S WABASH AVE')),
+                         [newest])
+        self.assertEqual(GeocoderCache.objects.count(), 2)
+
+    def test_prune(self):
+        from django.contrib.gis.geos import Point
+        from ebpub.geocoder.bin.maintain_geocoder_cache import prune
+        from ebpub.geocoder.models import GeocoderCache
+        self._cache('200 S WABASH AVE')
+        self._cache('210 S WABASH AVE', point=Point(-87.0, 41.0, srid=4326))
+        self.assertEqual(prune(), 1)
+        self.assertEqual(list(GeocoderCache.objects.values_list('normalized_location', flat=True)),
+                         ['200 S WABASH AVE'])
+
+    @mock.patch('ebpub.streets.models.get_metro')
+    def test_warm(self, mock_get_metro):
+        mock_get_metro.return_value = {'city_name': 'CHICAGO',
+                                       'multiple_cities': False}
+        from ebpub.geocoder.bin.maintain_geocoder_cache import warm, block_addresses
+        from ebpub.geocoder.models import GeocoderCache
+        addresses = list(block_addresses())
+        self.assert_(u'200 S WABASH AVE' in addresses)
+        counts = warm(addresses + ['200 s. wabash ave', 'Nowhere'])
+        self.assert_(counts['added'] > 0)
+        self.assertEqual(GeocoderCache.objects.filter(normalized_location='200 S WABASH AVE').count(), 1)
+        # Nothing new to cache the second time.
+        self.assertEqual(warm(addresses)['added'], 0)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Microbenchmark of the API throttle implementations.
+
+Simulates a few clients making lots of requests, doing what
+throttle_check() does for each one, and reports the time per request.
+"""
+
+from django.core.cache import get_cache
+from django.core.urlresolvers import get_callable
+from ebpub.openblockapi import throttle as throttle_module
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+import time
+
+logger = logging.getLogger('ebpub.openblockapi.bin.benchmark_throttle')
+
+DEFAULT_CLASSES = ('ebpub.openblockapi.throttle.CacheThrottle',
+                   'ebpub.openblockapi.throttle.SlidingWindowThrottle')
+
+def benchmark(throttle, requests, clients=1):
+    """
+    Returns the average seconds per request.
+    """
+    identifiers = ['client%d' % i for i in range(clients)]
+    start = time.time()
+    for i in xrange(requests):
+        identifier = identifiers[i % clients]
+        if throttle.should_be_throttled(identifier):
+            throttle.seconds_till_unthrottling(identifier)
+        else:
+            throttle.accessed(identifier)
+    return (time.time() - start) / requests
+
+def benchmark_throttles(class_paths=DEFAULT_CLASSES, requests=5000, clients=1,
+                        throttle_at=None, cache_backend=None):
+    """
+    Runs benchmark() for each throttle class, using a fresh cache
+    for each. Returns a list of (class path, seconds per request).
+
+    By default throttle_at is high enough that no client gets throttled,
+    which is the worst case for throttles that remember every access.
+    """
+    if throttle_at is None:
+        throttle_at = requests + 1
+    if cache_backend is None:
+        cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+    results = []
+    original_cache = throttle_module.cache
+    try:
+        for path in class_paths:
+            throttle_module.cache = get_cache(cache_backend)
+            throttle_module.cache.clear()
+            throttle = get_callable(path)(throttle_at=throttle_at, timeframe=3600)
+            seconds = benchmark(throttle, requests, clients)
+            logger.info("%s: %.1f microseconds per request" % (path, seconds * 1e6))
+            results.append((path, seconds))
+    finally:
+        throttle_module.cache = original_cache
+    return results
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] [throttle class ...]
+
+Times the API throttle classes (default: CacheThrottle and
+SlidingWindowThrottle), simulating lots of requests.
+''')
+    add_verbosity_options(optparser)
+    optparser.add_option('-n', '--requests', type='int', default=5000,
+                         help='Number of requests to simulate. Default %default.')
+    optparser.add_option('-c', '--clients', type='int', default=1,
+                         help='Number of clients to spread them over. Default %default.')
+    optparser.add_option('-t', '--throttle-at', type='int', default=None,
+                         help='throttle_at for the throttles. Default: more than --requests.')
+    optparser.add_option('--cache', default=None,
+                         help='Cache backend to use, as for get_cache(). Default: local memory.')
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    results = benchmark_throttles(args or DEFAULT_CLASSES, requests=opts.requests,
+                                  clients=opts.clients, throttle_at=opts.throttle_at,
+                                  cache_backend=opts.cache)
+    for path, seconds in results:
+        print "%-55s %10.1f us/request" % (path, seconds * 1e6)
+
+if __name__ == "__main__":
+    main()
@@ -39,10 +39,11 @@ the API documentation.
 from django.contrib.gis import geos
 from ebpub.utils.dates import parse_date
 from ebpub.db.models import NewsItem
+from ebpub.db.utils import make_cursor, parse_cursor
 from ebpub.streets.models import Place
 import pyrfc3339
 
-__all__ = ['build_item_query', 'build_place_query']
+__all__ = ['build_item_query', 'build_place_query', 'next_page_params']
 
 
 class QueryError(Exception):
@@ -218,23 +219,40 @@ def _radius_filter(query, params, state):
 
     return query, params, state
 
+def _get_limit(params):
+    try: 
+        limit = int(params.get('limit', 50))
+        if limit > 1000: 
+            limit = 1000
+    except:
+        raise QueryError('Invalid limit')
+    return limit
+
 def _object_limit(query, params, state):
     """
     handles limiting the number of results and skipping results
-    parameters: limit, offset
+    parameters: limit, offset, cursor
     """
     try: 
         offset = int(params.get('offset', 0))
     except:
         raise QueryError('Invalid offset')
     
-    try: 
-        limit = int(params.get('limit', 50))
-        if limit > 1000: 
-            limit = 1000
-    except:
-        raise QueryError('Invalid limit')
-    
+    limit = _get_limit(params)
+
+    cursor = params.get('cursor')
+    if cursor is not None:
+        if 'offset' in params:
+            raise QueryError('Use either cursor or offset, not both')
+        if not state.get('ordered_by_item_date'):
+            raise QueryError('cursor not supported for this query')
+        try:
+            item_date, item_id = parse_cursor(cursor)
+        except ValueError:
+            raise QueryError('Invalid cursor')
+        query = query.after_item(item_date, item_id)
+        del params['cursor']
+
     if 'limit' in params: 
         del params['limit']
     if 'offset' in params: 
@@ -244,13 +262,32 @@ def _object_limit(query, params, state):
     
     return query, params, state
 
+def next_page_params(request, count, last_item):
+    """
+    Given the number of items returned by a query built by
+    build_item_query(request), and the last of them, returns a
+    dictionary of query parameters for fetching the next page of
+    results, or None if this is the last page.
+
+    The next page is found by a cursor, which is much faster than
+    an offset when paging deep into the results.
+    """
+    if not count or count < _get_limit(request.GET):
+        return None
+    params = _copy_nomulti(request.GET)
+    params.pop('offset', None)
+    params['cursor'] = make_cursor(last_item)
+    return params
+
 def _order_by(query, params, state):
     """
     handles order of results.
     parameters: None, currently fixed
     """
-    # it is always by item date currently
-    query = query.order_by('-item_date')
+    # it is always by item date currently.
+    # Ordering by ID too makes paging by cursor consistent.
+    query = query.order_by('-item_date', '-id')
+    state['ordered_by_item_date'] = True
     return query, params, state
 
 
@@ -334,6 +334,18 @@ class TestItemSearchAPI(BaseTestCase):
 
             assert len(ritems['features']) == len(items)
 
+    def test_items_json__geometry_matches_single_item(self):
+        schema1 = Schema.objects.get(slug='type1')
+        item = _make_items(1, schema1)[0]
+        item.location = geos.Point(-71.123456789123, 42.987654321987)
+        item.save()
+        response = self.client.get(reverse('items_json'))
+        streamed = simplejson.loads(response.content)['features'][0]['geometry']
+        response = self.client.get(reverse('single_item_json', kwargs={'id_': item.id}))
+        single = simplejson.loads(response.content)['geometry']
+        self.assertEqual(streamed, single)
+        self.assertEqual(streamed['coordinates'], [-71.123457, 42.987654])
+
     def test_items_atom_nofilter(self):
         zone = 'America/Chicago'
         with self.settings(TIME_ZONE=zone):
@@ -598,6 +610,51 @@ class TestItemSearchAPI(BaseTestCase):
             assert len(ritems['features']) == 5
             assert self._items_exist_in_result(items[2:7], ritems)
 
+    def test_items_cursor(self):
+        zone = 'Europe/Vienna'
+        with self.settings(TIME_ZONE=zone):
+            schema1 = Schema.objects.get(slug='type1')
+            items = _make_items(10, schema1)
+            for item in items:
+                item.save()
+
+            # Walk all the items, 4 at a time, following the next links.
+            url = reverse('items_json') + '?limit=4'
+            seen = []
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                ritems = simplejson.loads(response.content)
+                seen.extend([f['properties']['id'] for f in ritems['features']])
+                url = ritems.get('next')
+            self.assertEqual(len(seen), 10)
+            self.assertEqual(sorted(seen), sorted([item.id for item in items]))
+
+            response = self.client.get(reverse('items_json') + '?cursor=bogus')
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(reverse('items_json') + '?cursor=MjAxMS0wMS0wMSwx&offset=2')
+            self.assertEqual(response.status_code, 400)
+
+    def test_items_compact(self):
+        zone = 'Europe/Madrid'
+        with self.settings(TIME_ZONE=zone):
+            schema1 = Schema.objects.get(slug='type1')
+            items = _make_items(3, schema1)
+            for item in items:
+                item.save()
+            response = self.client.get(reverse('items_json') + '?compact=1')
+            self.assertEqual(response.status_code, 200)
+            assert '\n' not in response.content
+            ritems = simplejson.loads(response.content)
+            self.assertEqual(len(ritems['features']), 3)
+            self.assertEqual(ritems['features'][0]['geometry']['type'], 'Point')
+            assert self._items_exist_in_result(items, ritems)
+
+            response = self.client.get(reverse('items_json') + '?compact=1&jsonp=foo')
+            self.assertEqual(response['content-type'], 'application/javascript')
+            assert response.content.startswith('foo({')
+            assert response.content.endswith('});')
+
     def test_items_predefined_location(self):
         zone = 'Europe/Zurich'
         with self.settings(TIME_ZONE=zone):
@@ -773,6 +830,25 @@ class TestGeocoderAPI(BaseTestCase):
         assert "Chestnut Sq. & Chestnut Ave." in names
         assert "Chestnut Pl. & Chestnut Ave." in names
 
+    def test_post_many(self):
+        queries = ['100 Adams St', '100 Nowhere St', 'Hood 1', '', '100 Adams St']
+        response = self.client.post(reverse('geocoder_api'), simplejson.dumps(queries),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        collections = simplejson.loads(response.content)
+        self.assertEqual(len(collections), 5)
+        self.assertEqual([len(c['features']) for c in collections], [1, 0, 1, 0, 1])
+        self.assertEqual(collections[0]['features'][0]['properties']['address'],
+                         '100 Adams St.')
+        self.assertEqual(collections[4], collections[0])
+        self.assertEqual(collections[2]['features'][0]['properties']['name'], 'Hood 1')
+
+    def test_post_many__invalid(self):
+        for body in ('not json', '{"q": "100 Adams St"}', '[1, 2]'):
+            response = self.client.post(reverse('geocoder_api'), body,
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
 
 @mock.patch('ebpub.openblockapi.views.throttle_check', mock.Mock(return_value=0))
 class TestLocationsAPI(BaseTestCase):
@@ -858,6 +934,22 @@ class TestLocationsAPI(BaseTestCase):
             self.assertEqual(type(coord[0]), float)
             self.assertEqual(type(coord[1]), float)
 
+    def test_location_detail_json__resolution(self):
+        url = reverse('location_detail_json', kwargs={'slug': 'hood-1', 'loctype': 'neighborhoods'})
+        def count_coords(resolution):
+            response = self.client.get(url, {'resolution': resolution})
+            self.assertEqual(response.status_code, 200)
+            geom = simplejson.loads(response.content)['geometry']
+            return sum(len(ring) for polygon in geom['coordinates'] for ring in polygon)
+        full = count_coords('full')
+        self.assert_(count_coords('high') <= full)
+        self.assert_(count_coords('low') <= count_coords('high'))
+
+    def test_location_detail_json__bad_resolution(self):
+        url = reverse('location_detail_json', kwargs={'slug': 'hood-1', 'loctype': 'neighborhoods'})
+        response = self.client.get(url, {'resolution': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
     def test_location_types(self):
         response = self.client.get(reverse('location_types_json'))
         self.assertEqual(response.status_code, 200)
@@ -1064,6 +1156,36 @@ class TestUtilFunctions(TestCase):
         mock_cache.get.return_value = [int(time.time())] * (throttle_at + 1)
         self.assertEqual(True, throttle.should_be_throttled('some_id'))
 
+    @mock.patch('ebpub.openblockapi.throttle.time')
+    def test_slidingwindowthrottle(self, mock_time):
+        from django.core.cache import get_cache
+        from ebpub.openblockapi import throttle as throttle_module
+        locmem = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        throttle = throttle_module.SlidingWindowThrottle(throttle_at=10, timeframe=100)
+        with mock.patch.object(throttle_module, 'cache', locmem):
+            # Middle of a window.
+            mock_time.time.return_value = 1050.0
+            for i in range(9):
+                throttle.accessed('some_id')
+            self.assertEqual(False, throttle.should_be_throttled('some_id'))
+            self.assertEqual(0, throttle.seconds_till_unthrottling('some_id'))
+            for i in range(3):
+                throttle.accessed('some_id')
+            self.assertEqual(True, throttle.should_be_throttled('some_id'))
+            self.assertEqual(False, throttle.should_be_throttled('other_id'))
+            # Next window starts at 1100; then the old count of 12 is
+            # weighted down until it's below the limit, after 1116.67.
+            self.assertEqual(67, throttle.seconds_till_unthrottling('some_id'))
+
+            mock_time.time.return_value = 1105.0
+            self.assertEqual(True, throttle.should_be_throttled('some_id'))
+            self.assertEqual(12, throttle.seconds_till_unthrottling('some_id'))
+            mock_time.time.return_value = 1117.0
+            self.assertEqual(False, throttle.should_be_throttled('some_id'))
+            # Long after, everything's forgotten.
+            mock_time.time.return_value = 1300.0
+            self.assertEqual(False, throttle.should_be_throttled('some_id'))
+
     @mock.patch('ebpub.openblockapi.views.check_api_authorization')
     @mock.patch('ebpub.openblockapi.views._throttle')
     def test_throttlecheck(self, mock_throttle, mock_check_api_auth):
@@ -1084,6 +1206,87 @@ class TestUtilFunctions(TestCase):
         self.assertEqual(mock_throttle.accessed.call_count, 1)
 
 
+class TestStreamingMiddleware(TestCase):
+
+    def _response(self):
+        return views.StreamingHttpResponse(iter(['{"a": ', '"%s"}' % ('x' * 500)]),
+                                           content_type='application/json')
+
+    def test_gzip(self):
+        import gzip
+        from cStringIO import StringIO
+        from django.test.client import RequestFactory
+        from ebpub.utils.middleware import GZipMiddleware
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = GZipMiddleware().process_response(request, self._response())
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.failIf(response._is_string)
+        self.failIf(response.has_header('Content-Length'))
+        body = ''.join(response)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(body)).read(),
+                         '{"a": "%s"}' % ('x' * 500))
+
+    def test_conditional_get(self):
+        from django.test.client import RequestFactory
+        from ebpub.utils.middleware import ConditionalGetMiddleware
+        request = RequestFactory().get('/')
+        response = ConditionalGetMiddleware().process_response(request, self._response())
+        # Not buffered.
+        self.failIf(response._is_string)
+        self.failIf(response.has_header('Content-Length'))
+        self.assert_(response.has_header('Date'))
+        self.assertEqual(''.join(response), '{"a": "%s"}' % ('x' * 500))
+
+
+@mock.patch('ebpub.openblockapi.views.throttle_check', mock.Mock(return_value=0))
+class TestStreamingWSGI(TransactionTestCase):
+
+    # Goes through the WSGI handler, which (unlike the test client)
+    # closes the database connection before the response is iterated,
+    # so it can't be in a test transaction.
+
+    fixtures = ('test-item-search.json', 'test-schema.yaml')
+
+    def _get(self, url):
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.test.client import RequestFactory
+        environ = RequestFactory().get(url).environ
+        statuses = []
+        response = WSGIHandler()(environ, lambda status, headers: statuses.append(status))
+        return statuses, response
+
+    def test_items_json__closes_connection(self):
+        from django.db import connection
+        schema1 = Schema.objects.get(slug='type1')
+        for item in _make_items(3, schema1):
+            item.save()
+        statuses, response = self._get(reverse('items_json'))
+        self.assertEqual(statuses, ['200 OK'])
+        # Django has already closed it...
+        self.assertEqual(connection.connection, None)
+        try:
+            body = ''.join(response)
+        finally:
+            response.close()
+        self.assertEqual(len(simplejson.loads(body)['features']), 3)
+        # ... and it's closed again after streaming the items.
+        self.assertEqual(connection.connection, None)
+
+    def test_items_atom__closes_connection(self):
+        from django.db import connection
+        schema1 = Schema.objects.get(slug='type1')
+        for item in _make_items(3, schema1):
+            item.save()
+        statuses, response = self._get(reverse('items_atom'))
+        self.assertEqual(statuses, ['200 OK'])
+        try:
+            body = ''.join(response)
+        finally:
+            response.close()
+        self.assertEqual(len(feedparser.parse(body).entries), 3)
+        self.assertEqual(connection.connection, None)
+
+
 class TestMoreUtilFunctions(TransactionTestCase):
 
     # For things that mess with the db too much and need to be in a
@@ -23,6 +23,7 @@ http://github.com/toastdriven/django-tastypie/
 Copyright 2011 Daniel Lindsley.  BSD license.
 """
 
+import math
 import time
 from django.core.cache import cache
 
@@ -141,3 +142,82 @@ class CacheThrottle(BaseThrottle):
         when = oldest + self.timeframe
         return when - int(time.time())
 
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    A throttling mechanism that uses just the cache, and a fixed amount
+    of it per user, no matter how high ``throttle_at`` is.
+
+    Requests are counted in fixed windows of ``timeframe`` seconds,
+    using the cache's atomic incr(). The number of requests in the
+    last ``timeframe`` seconds is estimated from the current window's
+    count, plus the previous window's count weighted by how much of it
+    still overlaps the sliding window.
+
+    ``expiration`` is ignored; the counts only need to be kept for two
+    timeframes.
+    """
+
+    def _window_keys(self, identifier, now):
+        key = self.convert_identifier_to_key(identifier)
+        window = int(now // self.timeframe)
+        return ('%s_%d' % (key, window), '%s_%d' % (key, window - 1))
+
+    def _counts(self, identifier, now):
+        """
+        Returns (current count, previous count, seconds elapsed in
+        the current window).
+        """
+        current_key, previous_key = self._window_keys(identifier, now)
+        counts = cache.get_many([current_key, previous_key])
+        elapsed = now % self.timeframe
+        return (counts.get(current_key, 0), counts.get(previous_key, 0), elapsed)
+
+    def _estimate(self, current, previous, elapsed):
+        weight = 1.0 - (float(elapsed) / self.timeframe)
+        return current + previous * weight
+
+    def should_be_throttled(self, identifier, **kwargs):
+        """
+        Returns whether or not the user has exceeded their throttle limit.
+
+        Returns ``False`` if the user should NOT be throttled or ``True`` if
+        the user should be throttled.
+        """
+        current, previous, elapsed = self._counts(identifier, time.time())
+        return self._estimate(current, previous, elapsed) >= int(self.throttle_at)
+
+    def accessed(self, identifier, **kwargs):
+        """
+        Handles recording the user's access.
+
+        Increments the count for the current window within the cache.
+        """
+        current_key, previous_key = self._window_keys(identifier, time.time())
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            # First access in this window. If another process beat
+            # us to it, add() fails and we can incr() after all.
+            if not cache.add(current_key, 1, int(self.timeframe) * 2):
+                cache.incr(current_key)
+
+    def seconds_till_unthrottling(self, identifier):
+        """
+        Try to figure out when the user will be un-throttled.
+        """
+        now = time.time()
+        current, previous, elapsed = self._counts(identifier, now)
+        throttle_at = int(self.throttle_at)
+        timeframe = float(self.timeframe)
+        if self._estimate(current, previous, elapsed) < throttle_at:
+            return 0
+        if current < throttle_at:
+            # The previous window's weight has to drop far enough.
+            wait = timeframe * (1 - float(throttle_at - current) / previous) - elapsed
+        else:
+            # Wait for the next window, and then for this window's
+            # weight to drop far enough.
+            wait = (timeframe - elapsed) + timeframe * (1 - float(throttle_at) / max(current, 1))
+        return max(1, int(math.ceil(wait)))
@@ -19,39 +19,60 @@ from apikey.auth import KEY_HEADER  # relative import
 from apikey.auth import check_api_authorization  # relative import
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import get_callable
 from django.core.urlresolvers import reverse
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseNotAllowed
 from django.http import HttpResponseRedirect
+from django.db import connections
 from django.shortcuts import get_object_or_404
 from django.utils import feedgenerator
 from django.utils import simplejson
 from django.utils.cache import patch_response_headers
 from django.utils.cache import patch_vary_headers
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views.decorators.csrf import csrf_exempt
 from ebpub.db import models
+from ebpub.db.constants import LOCATION_RESOLUTIONS
 from ebpub.geocoder import DoesNotExist
 from ebpub.geocoder.base import full_geocode
+from ebpub.geocoder.base import full_geocode_many
 from ebpub.openblockapi.itemquery import _copy_nomulti
 from ebpub.openblockapi.itemquery import build_item_query, build_place_query, QueryError
+from ebpub.openblockapi.itemquery import next_page_params
 from ebpub.streets.models import PlaceType
 from ebpub.utils.dates import parse_date, parse_time
 from ebpub.utils.geodjango import ensure_valid
 from ebpub.utils.view_utils import get_schema_manager
 from functools import wraps
+from cStringIO import StringIO
 import copy
 import datetime
 import logging
+import psycopg2
 import pyrfc3339
 import pytz
 import re
+import urllib
+import uuid
 
 JSONP_QUERY_PARAM = 'jsonp'
 ATOM_CONTENT_TYPE = "application/atom+xml"
 JSON_CONTENT_TYPE = 'application/json'
 JAVASCRIPT_CONTENT_TYPE = 'application/javascript'
 
+# How many NewsItems to load at once when streaming a response.
+STREAMING_CHUNK_SIZE = 200
+
+# Decimal places of GeoJSON coordinates for NewsItems, whether the
+# database or GeoDjango serializes them; about 10 cm.
+GEOJSON_PRECISION = 6
+
+# Max number of queries in one POST to the geocode API.
+MAX_GEOCODE_QUERIES = 200
+
 LOCAL_TZ = pytz.timezone(settings.TIME_ZONE)
 
 logger = logging.getLogger('openblockapi')
@@ -60,6 +81,71 @@ logger = logging.getLogger('openblockapi')
 # Util functions.
 ############################################################
 
+class StreamingHttpResponse(HttpResponse):
+    """
+    An HttpResponse whose content is an iterator that's sent as it's
+    generated. If something (eg. Django's ConditionalGetMiddleware or
+    GZipMiddleware) needs the whole content, it's buffered once, so
+    the response can still be iterated afterward. The versions of
+    those in ebpub.utils.middleware don't.
+    """
+
+    streaming = True
+
+    def _get_content(self):
+        if not self._is_string:
+            self._container = [''.join(self._container)]
+            self._is_string = True
+        return super(StreamingHttpResponse, self)._get_content()
+
+    content = property(_get_content, HttpResponse._set_content)
+
+def _jsonp_callback(request):
+    jsonp = request.GET.get(JSONP_QUERY_PARAM)
+    if jsonp is not None:
+        jsonp = re.sub(r'[^a-zA-Z0-9_]+', '', jsonp)
+    return jsonp
+
+def StreamingAPIGETResponse(request, chunks, **kw):
+    """
+    Like APIGETResponse, but ``chunks`` is an iterable of strings
+    that's sent as it's generated, rather than all built up in memory
+    first. (Middleware that looks at response.content, such as
+    Django's ConditionalGetMiddleware, will buffer it anyway.)
+    """
+    kw.setdefault('content_type', JSON_CONTENT_TYPE)
+    jsonp = _jsonp_callback(request)
+    if jsonp is not None and kw['content_type'] == JSON_CONTENT_TYPE:
+        kw['content_type'] = JAVASCRIPT_CONTENT_TYPE
+        def wrap(chunks):
+            yield '%s(' % jsonp
+            for chunk in chunks:
+                yield chunk
+            yield ');'
+        chunks = wrap(chunks)
+    return StreamingHttpResponse(_closing_connections(chunks), **kw)
+
+def _closing_connections(chunks):
+    """
+    Yields the chunks, then closes any database connection that
+    generating them opened.
+
+    Django closes the connection when the request is finished, which
+    (under WSGI) is before the response is iterated; so if the chunks
+    come from database queries, they reopen it, outside of any
+    request, and nothing else would close it.
+    """
+    closed = [conn for conn in connections.all() if conn.connection is None]
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        # Let the chunks clean up (eg. close cursors) first.
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        for conn in closed:
+            conn.close()
+
 def APIGETResponse(request, body, **kw):
     """
     constructs either a normal HTTPResponse using the
@@ -70,14 +156,13 @@ def APIGETResponse(request, body, **kw):
     This may alter the content type of the response
     if JSONP/JSONPX is triggered. Status is preserved.
     """
-    jsonp = request.GET.get(JSONP_QUERY_PARAM)
+    jsonp = _jsonp_callback(request)
     format = kw.setdefault('content_type', JSON_CONTENT_TYPE)
     if format == JSON_CONTENT_TYPE and not isinstance(body, basestring):
         body = simplejson.dumps(body, indent=1, default=_serialize_unknown)
     if jsonp is None:
         return HttpResponse(body, **kw)
     else:
-        jsonp = re.sub(r'[^a-zA-Z0-9_]+', '', jsonp)
         body = '%s(%s);' % (jsonp, body)
         kw['content_type'] = JAVASCRIPT_CONTENT_TYPE
         return HttpResponse(body, **kw)
@@ -114,12 +199,32 @@ def api_items_geojson(items):
 
 def _item_geojson_dict(item):
     # Prepare a single NewsItem as a structure that can be JSON-encoded.
-    props = {}
     geom = simplejson.loads(item.location.geojson)
+    # Match the precision of the streamed output; see _items_geojson_stream.
+    _round_geojson(geom, GEOJSON_PRECISION)
     result = {
         'type': 'Feature',
         'geometry': geom,
+        'properties': _item_geojson_properties(item),
         }
+    return result
+
+def _round_geojson(geom, places):
+    # Rounds the coordinates of a GeoJSON geometry dictionary in place.
+    if geom['type'] == 'GeometryCollection':
+        for part in geom['geometries']:
+            _round_geojson(part, places)
+    else:
+        geom['coordinates'] = _round_coordinates(geom['coordinates'], places)
+
+def _round_coordinates(coords, places):
+    # Rounds every number in a GeoJSON coordinates array, however nested.
+    if isinstance(coords, (list, tuple)):
+        return [_round_coordinates(c, places) for c in coords]
+    return round(coords, places)
+
+def _item_geojson_properties(item):
+    props = {}
     for attr in item.attributes_for_template():
         key = attr.sf.name
         if attr.sf.is_many_to_many_lookup():
@@ -140,8 +245,105 @@ def _item_geojson_dict(item):
          'color': item.schema.map_color,
          'location_name': item.location_name,
          })
-    result['properties'] = props
-    return result
+    return props
+
+def _server_side_rows(values_qs, chunk_size=STREAMING_CHUNK_SIZE):
+    """
+    Yields the rows of a ValuesQuerySet as dictionaries, using a
+    server-side cursor, so we never have the whole result set in memory
+    at once (as the normal psycopg2 cursor would).
+
+    The cursor is declared WITH HOLD, so it survives if the transaction
+    is committed (eg. by TransactionMiddleware) while we're reading,
+    but not if it's rolled back.
+    """
+    conn = connections[values_qs.db]
+    # Make sure we're connected. If we're streaming a response,
+    # _closing_connections() closes this connection afterward.
+    conn.cursor()
+    sql, params = values_qs.query.get_compiler(using=values_qs.db).as_sql()
+    name = 'openblockapi_%s' % uuid.uuid4().hex
+    cursor = conn.connection.cursor()
+    cursor.execute('DECLARE %s NO SCROLL CURSOR WITH HOLD FOR %s' % (name, sql), params)
+    try:
+        names = None
+        while True:
+            cursor.execute('FETCH FORWARD %d FROM %s' % (chunk_size, name))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            if names is None:
+                names = [col[0] for col in cursor.description]
+            for row in rows:
+                yield dict(zip(names, row))
+    finally:
+        try:
+            cursor.execute('CLOSE %s' % name)
+        except psycopg2.DatabaseError:
+            # Eg. the transaction was rolled back, which closed it.
+            pass
+        cursor.close()
+
+def _load_items(rows, defer_location=False, chunk_size=STREAMING_CHUNK_SIZE):
+    """
+    Given dictionaries with an 'id' key, yields (NewsItem, row) pairs
+    in the same order, loading the NewsItems (and their attributes)
+    ``chunk_size`` at a time.
+    """
+    def load(chunk):
+        qs = models.NewsItem.objects.filter(id__in=[row['id'] for row in chunk])
+        if defer_location:
+            qs = qs.defer('location')
+        by_id = dict((item.id, item) for item in qs.with_attributes())
+        return [(by_id[row['id']], row) for row in chunk if row['id'] in by_id]
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            for pair in load(chunk):
+                yield pair
+            chunk = []
+    if chunk:
+        for pair in load(chunk):
+            yield pair
+
+def _items_geojson_stream(request, items, compact=False):
+    """
+    Yields a GeoJSON FeatureCollection of the given NewsItem QuerySet
+    in pieces, one Feature at a time, plus a 'next' link if there
+    may be more results.
+
+    Geometries are serialized by the database, rounded to
+    GEOJSON_PRECISION decimal places like _item_geojson_dict() does.
+    """
+    if compact:
+        dump_kw = {'separators': (',', ':')}
+    else:
+        dump_kw = {'indent': 1}
+    # The query is usually sliced already, so extra() isn't allowed.
+    items = items._clone()
+    items.query.add_extra({'geometry_json': 'ST_AsGeoJSON(db_newsitem.location, %d)'
+                           % GEOJSON_PRECISION},
+                          None, None, None, None, None)
+    rows = _server_side_rows(items.values('id', 'item_date', 'geometry_json'))
+    yield '{"type": "FeatureCollection", "features": ['
+    count, last_row, separator = 0, None, ''
+    for item, row in _load_items(rows, defer_location=True):
+        count += 1
+        last_row = row
+        if row['geometry_json'] is None:
+            continue
+        props = simplejson.dumps(_item_geojson_properties(item),
+                                 default=_serialize_unknown, **dump_kw)
+        yield '%s{"type": "Feature", "geometry": %s, "properties": %s}' % (
+            separator, row['geometry_json'], props)
+        separator = ','
+    yield ']'
+    next_url = _next_page_url(request, count, last_row)
+    if next_url:
+        yield ', "next": %s' % simplejson.dumps(next_url)
+    yield '}'
 
 def is_instance_of_model(obj, model):
     # isinstance(foo, model) seems to work *sometimes* with django models,
@@ -227,11 +429,12 @@ def rest_view(methods, cache_timeout=None):
         return wrapper
     return inner
 
-from ebpub.openblockapi.throttle import CacheThrottle
 
 
 # We could have more than one throttle instance to be more flexible.
-_throttle = CacheThrottle(
+_throttle_class = get_callable(getattr(settings, 'API_THROTTLE_CLASS',
+                                      'ebpub.openblockapi.throttle.SlidingWindowThrottle'))
+_throttle = _throttle_class(
     throttle_at=getattr(settings, 'API_THROTTLE_AT', 150), # max requests per timeframe.
     timeframe=getattr(settings, 'API_THROTTLE_TIMEFRAME', 60 * 60), # default 1 hour.
     expiration=getattr(settings, 'API_THROTTLE_EXPIRATION', 60 * 60 * 24 * 7)  # default 1 week.
@@ -305,11 +508,9 @@ def items_json(request):
     try:
         items, params = build_item_query(request)
         # could test for extra params aside from jsonp...
-        items = [item for item in items if item.location is not None]
-        items_geojson_dict = {'type': 'FeatureCollection',
-                              'features': items
-                              }
-        return APIGETResponse(request, items_geojson_dict, content_type=JSON_CONTENT_TYPE)
+        compact = params.get('compact', '').lower() in ('1', 'true', 'yes')
+        chunks = _items_geojson_stream(request, items, compact=compact)
+        return StreamingAPIGETResponse(request, chunks, content_type=JSON_CONTENT_TYPE)
     except QueryError as err:
         return HttpResponseBadRequest(err.message)
 
@@ -320,11 +521,27 @@ def items_atom(request):
     """
     try:
         items, params = build_item_query(request)
+        # We need the next link before the entries, but the IDs
+        # and dates are cheap to get up front.
+        rows = list(_server_side_rows(items.values('id', 'item_date')))
+        next_url = _next_page_url(request, len(rows), rows and rows[-1] or None)
+        items = (item for item, row in _load_items(rows))
         # could test for extra params aside from jsonp...
-        return APIGETResponse(request, _items_atom(items), content_type=ATOM_CONTENT_TYPE)
+        return StreamingAPIGETResponse(request, _items_atom(items, next_url),
+                                       content_type=ATOM_CONTENT_TYPE)
     except QueryError as err:
         return HttpResponseBadRequest(err.message)
 
+def _next_page_url(request, count, last_row):
+    if last_row is None:
+        return None
+    # A stand-in NewsItem, just for making the cursor.
+    last_item = models.NewsItem(id=last_row['id'], item_date=last_row['item_date'])
+    params = next_page_params(request, count, last_item)
+    if params is None:
+        return None
+    return '%s?%s' % (request.path, urllib.urlencode(sorted(params.items()), doseq=True))
+
 @rest_view(['GET', 'POST'])
 def items_index(request):
     """
@@ -447,44 +664,58 @@ def single_item_json(request, id_=None):
 
 
 
-def _items_atom(items):
+def _items_atom(items, next_url=None):
+    """
+    Yields an Atom feed of the given NewsItems, in pieces.
+    """
     # XXX needs tests
     feed_url = reverse('items_atom')
     atom = OpenblockAtomFeed(
         title='openblock news item atom feed', description='',
         link=reverse('items_json'),  # For the rel=alternate link.
         feed_url=feed_url,
-        id=feed_url,)
-
-    for item in items:
-        location = item.location
-        if location:
-            location = location.centroid
-        attributes = []
-        for attr in item.attributes_for_template():
-            datatype = get_datatype(attr.sf)
-            for val in attr.values:
-                if attr.sf.is_lookup:
-                    val = val.name
-                attributes.append((attr.sf.name, datatype, val))
-        atom.add_item(item.title,
-                      item.url, # XXX should this be a local url?
-                      item.description,
-                      location=location,
-                      location_name=item.location_name,
-                      pubdate=normalize_datetime(item.pub_date),
-                      schema_slug=item.schema.slug,
-                      attributes=attributes,
-                      )
-
-    return atom.writeString('utf8')
-
-
-@rest_view(['GET'], cache_timeout=3600)
+        id=feed_url,
+        next_url=next_url)
+
+    def entries():
+        for item in items:
+            location = item.location
+            if location:
+                location = location.centroid
+            attributes = []
+            for attr in item.attributes_for_template():
+                datatype = get_datatype(attr.sf)
+                for val in attr.values:
+                    if attr.sf.is_lookup:
+                        val = val.name
+                    attributes.append((attr.sf.name, datatype, val))
+            yield dict(title=item.title,
+                       link=item.url, # XXX should this be a local url?
+                       description=item.description,
+                       location=location,
+                       location_name=item.location_name,
+                       pubdate=normalize_datetime(item.pub_date),
+                       schema_slug=item.schema.slug,
+                       attributes=attributes,
+                       )
+
+    return atom.iter_write(entries(), 'utf8')
+
+
+@csrf_exempt
+@rest_view(['GET', 'POST'], cache_timeout=3600)
 def geocode(request):
+    """
+    GET: Geocodes the ``q`` parameter, giving a GeoJSON FeatureCollection.
+
+    POST: Takes a JSON list of strings, and gives a JSON list of
+    FeatureCollections, one for each.
+    """
     # TODO: this will obsolete:
     # ebdata.geotagger.views.geocode and 
     # ebpub.db.views.ajax_wkt
+    if request.method == 'POST':
+        return _geocode_many(request)
     q = request.GET.get('q', '').strip()
     if not q:
         return HttpResponseBadRequest('Missing or empty q parameter.')
@@ -497,13 +728,41 @@ def geocode(request):
     return APIGETResponse(request, simplejson.dumps(collection, indent=1),
                           content_type=JSON_CONTENT_TYPE, status=status)
 
-def _geocode_geojson(query):
+def _geocode_many(request):
+    try:
+        queries = simplejson.loads(request.raw_post_data)
+    except ValueError:
+        queries = None
+    if not isinstance(queries, list) or [q for q in queries if not isinstance(q, basestring)]:
+        return HttpResponseBadRequest('Body must be a JSON list of strings.')
+    if len(queries) > MAX_GEOCODE_QUERIES:
+        return HttpResponseBadRequest('At most %d queries allowed.' % MAX_GEOCODE_QUERIES)
+    queries = [q.strip() for q in queries]
+    nonempty = [q for q in queries if q]
+    results = dict(zip(nonempty, full_geocode_many(nonempty)))
+    collections = []
+    for q in queries:
+        collections.append({'type': 'FeatureCollection',
+                            'features': _geocode_geojson(q, results.get(q))})
+    return APIGETResponse(request, simplejson.dumps(collections, indent=1),
+                          content_type=JSON_CONTENT_TYPE)
+
+def _geocode_geojson(query, res=None):
+    """
+    Returns a list of GeoJSON features for the query.  ``res`` is the
+    result of full_geocode(query), if that's already been done.
+    """
     if not query: 
         return []
         
+    if isinstance(res, Exception):
+        # Couldn't geocode it.
+        return []
     try: 
-        res = full_geocode(query)
+        if res is None:
+            res = full_geocode(query)
         # normalize a bit
+        res = dict(res)
         if not res['ambiguous']: 
             res['result'] = [res['result']]
     except DoesNotExist:
@@ -597,7 +856,8 @@ def locations_json(request):
     if loctype is not None:
         locations = locations.filter(location_type__slug=loctype)
 
-    locations = locations.order_by('display_order').select_related().defer('location')
+    locations = locations.order_by('display_order').select_related().defer(
+        'location', *models.SIMPLIFIED_LOCATION_FIELDS)
     
     loc_objs = [
         {'id': "%s/%s" % (loc.location_type.slug, loc.slug),
@@ -618,11 +878,21 @@ def location_detail_json(request, loctype, slug):
         loctype_obj = models.LocationType.objects.get(slug=loctype)
     except (ValueError, models.LocationType.DoesNotExist):
         raise Http404("No such location type %r" % loctype)
+    resolution = request.GET.get('resolution') or 'full'
+    if resolution != 'full' and resolution not in dict(LOCATION_RESOLUTIONS):
+        return HttpResponseBadRequest('Unknown resolution %r' % resolution)
+    if resolution != 'full':
+        field_name = 'location_simplified_%s' % resolution
+    else:
+        field_name = 'location'
     try:
-        location = models.Location.objects.geojson().get(
+        location = models.Location.objects.geojson(field_name=field_name).get(
             location_type=loctype_obj, slug=slug)
     except (ValueError, models.Location.DoesNotExist):
         raise Http404("No such location %r/%r" % (loctype, slug))
+    if location.geojson is None:
+        # Not simplified yet.
+        location.geojson = location.location.geojson
     geojson = {'type': 'Feature',
                'id': '%s/%s' % (loctype, slug),
                'geometry': simplejson.loads(location.geojson),
@@ -710,6 +980,43 @@ class OpenblockAtomFeed(feedgenerator.Atom1Feed):
         attrs['xmlns:openblock'] = 'http://openblock.org/ns/0'
         return attrs
 
+    def iter_write(self, entries, encoding):
+        """
+        Like write(), but yields the feed in pieces instead of writing
+        it to a file. ``entries`` is an iterable of add_item() keyword
+        argument dictionaries, so they needn't all be in memory at once.
+
+        Note the feed's updated date is the current time,
+        since we don't look at the entries in advance.
+        """
+        out = StringIO()
+        def flush():
+            value = out.getvalue()
+            out.seek(0)
+            out.truncate()
+            return value
+        handler = SimplerXMLGenerator(out, encoding)
+        handler.startDocument()
+        handler.startElement(u'feed', self.root_attributes())
+        self.add_root_elements(handler)
+        yield flush()
+        for kwargs in entries:
+            self.add_item(**kwargs)
+            item = self.items.pop()
+            handler.startElement(u'entry', self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(u'entry')
+            yield flush()
+        handler.endElement(u'feed')
+        yield flush()
+
+    def add_root_elements(self, handler):
+        super(OpenblockAtomFeed, self).add_root_elements(handler)
+        if self.feed.get('next_url'):
+            # As per RFC 5005 (Feed Paging).
+            handler.addQuickElement(u'link', u'', {u'rel': u'next',
+                                                   u'href': self.feed['next_url']})
+
     def add_item_elements(self, handler, item):
         super(OpenblockAtomFeed, self).add_item_elements(handler, item)
         location = item['location']
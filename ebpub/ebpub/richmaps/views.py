@@ -26,7 +26,8 @@ from django.utils.cache import patch_response_headers
 from django.utils.datastructures import SortedDict
 from django.utils import simplejson
 from ebpub.utils.view_utils import eb_render
-from ebpub.db.models import NewsItem, Schema, SchemaField
+from ebpub.db.models import NewsItem, Schema
+from ebpub.db.models import schemafield_registry
 from ebpub.openblockapi.views import _copy_nomulti, JSON_CONTENT_TYPE
 from ebpub.openblockapi.itemquery import build_item_query
 from ebpub.db.schemafilters import FilterError
@@ -47,8 +48,8 @@ def bigmap_filter(request, slug, args_from_url):
     if not s.allow_charting:
         return HttpResponse(status=404)
 
-    filter_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_filter=True).order_by('display_order'))
-    textsearch_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_searchable=True).order_by('display_order'))
+    filter_sf_list = schemafield_registry.get_fields(s.id, is_filter=True)
+    textsearch_sf_list = schemafield_registry.get_fields(s.id, is_searchable=True)
 
     # Use SortedDict to preserve the display_order.
     filter_sf_dict = SortedDict([(sf.name, sf) for sf in filter_sf_list] + [(sf.name, sf) for sf in textsearch_sf_list])
@@ -149,14 +149,16 @@ MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
 SKIP_SOUTH_TESTS = True
 SOUTH_TESTS_MIGRATE = True
 
+# ebpub's GZipMiddleware and ConditionalGetMiddleware are like
+# Django's, but don't buffer the streaming API responses.
 MIDDLEWARE_CLASSES = (
-    'django.middleware.gzip.GZipMiddleware',
+    'ebpub.utils.middleware.GZipMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'ebpub.accounts.middleware.UserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.http.ConditionalGetMiddleware',
+    'ebpub.utils.middleware.ConditionalGetMiddleware',
 )
 
 SITE_ID = 1
@@ -365,6 +367,10 @@ API_THROTTLE_AT=150  # max requests per timeframe.
 API_THROTTLE_TIMEFRAME = 60 * 60 # default 1 hour.
 # How long to retain the times the user has accessed the API. Default 1 week.
 API_THROTTLE_EXPIRATION = 60 * 60 * 24 * 7
+# Which throttle implementation to use. SlidingWindowThrottle keeps
+# two counters per user; the older CacheThrottle keeps a list of every
+# access time, which gets slow if API_THROTTLE_AT is large.
+API_THROTTLE_CLASS = 'ebpub.openblockapi.throttle.SlidingWindowThrottle'
 
 # NOTE in order to enable throttling, you MUST also configure
 # CACHES['default'] to something other than a DummyCache.  See the CACHES
@@ -409,6 +415,24 @@ RECAPTCHA_PRIVATE_KEY = ''
 EBPUB_CACHE_GEOCODER = True
 required_settings.append('EBPUB_CACHE_GEOCODER')
 
+# If EBPUB_CACHE_GEOCODER is True, geocoder results are also kept in
+# memory, in each process: up to this many of them, for this many
+# seconds. Failures (no results, ambiguous results) are kept for the
+# shorter NEGATIVE_TIMEOUT. Set the size to 0 to disable.
+EBPUB_GEOCODER_MEMORY_CACHE_SIZE = 1000
+EBPUB_GEOCODER_MEMORY_CACHE_TIMEOUT = 60 * 60
+EBPUB_GEOCODER_MEMORY_CACHE_NEGATIVE_TIMEOUT = 60 * 5
+
+# Set this True to keep an index of all Blocks in memory, so that
+# geocoding addresses needs no database queries. It takes a while to
+# build in each process, so you can instead set it to the path of a
+# snapshot made by the build_block_index script.
+EBPUB_BLOCK_INDEX = False
+
+# Set this True to correct misspelled street names, when there's no
+# matching StreetMisspelling, to the closest known street name.
+EBPUB_FUZZY_STREET_NAMES = False
+
 # Required by openblockapi.apikey to associate keys with user profiles.
 AUTH_PROFILE_MODULE = 'preferences.Profile'
 
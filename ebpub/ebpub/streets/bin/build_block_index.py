@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Saves a snapshot of the in-memory block index, for the
+EBPUB_BLOCK_INDEX setting. See ebpub.streets.blockindex.
+"""
+
+from ebpub.streets.blockindex import BlockIndex
+from ebpub.streets.models import Block
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+
+logger = logging.getLogger('ebpub.streets.bin.build_block_index')
+
+def build_block_index(path):
+    index = BlockIndex.from_queryset(Block.objects.all())
+    index.save(path)
+    logger.info("Saved %d blocks to %s" % (len(index), path))
+    return index
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] path
+
+Saves an index of all blocks to the given file, for fast geocoding.
+Point the EBPUB_BLOCK_INDEX setting at the file to use it, and
+re-run this after importing blocks.
+''')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    if len(args) != 1:
+        optparser.error('Please give a path to save the index to.')
+    setup_logging_from_opts(opts, logger)
+    build_block_index(args[0])
+
+if __name__ == "__main__":
+    main()
@@ -196,8 +196,8 @@ def populate_intersections(*args, **kwargs):
             if bi.block.left_city != bi.block.right_city:
                 # If we have Locations representing cities,
                 # find one that contains this bi's center.
-                from ebpub.db.models import get_city_locations
-                overlapping_cities = get_city_locations().filter(location__contains=bi.location)
+                from ebpub.db.locationindex import city_locations_containing
+                overlapping_cities = city_locations_containing(bi.location)
                 if overlapping_cities:
                     city = overlapping_cities[0].name.upper()
                 else:
@@ -181,8 +181,8 @@ class TigerImporter(BlockImporter):
     def _get_city(self, feature, side):
         city = ''
         if self.fix_cities:
-            from ebpub.db.models import get_city_locations
-            overlapping_cities = list(get_city_locations().filter(location__intersects=feature.geom.geos))
+            from ebpub.db.locationindex import city_locations_intersecting
+            overlapping_cities = city_locations_intersecting(feature.geom.geos)
             if overlapping_cities:
                 city = overlapping_cities[0].name
                 logger.debug("overriding city to %s" % city)
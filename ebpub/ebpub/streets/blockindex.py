@@ -0,0 +1,295 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+An optional in-memory index of Blocks, so that geocoding a street
+address doesn't need any database queries.
+
+Enable it with the EBPUB_BLOCK_INDEX setting:
+
+* False (the default): don't use an index; search the database.
+* True: build the index from the database, the first time it's
+  needed in each process.
+* A file path: load the index from a snapshot made by the
+  ``build_block_index`` script, or if that file doesn't exist,
+  build it from the database and save it there.
+
+The index isn't updated when Blocks change; restart the process
+(and rebuild any snapshot) after importing blocks.
+"""
+
+from array import array
+from bisect import bisect_right
+from math import floor
+from django.conf import settings
+from django.contrib.gis.geos import LineString, Point
+from ebpub.utils.geodjango import interpolate_coords
+import cPickle as pickle
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger('ebpub.streets.blockindex')
+
+# Block fields kept in the index, besides geom.
+FIELDS = ('id', 'pretty_name', 'street_pretty_name', 'street_slug',
+          'predir', 'street', 'suffix', 'postdir',
+          'left_from_num', 'left_to_num', 'right_from_num', 'right_to_num',
+          'from_num', 'to_num', 'left_zip', 'right_zip',
+          'left_city', 'right_city', 'left_state', 'right_state',
+          'parent_id')
+
+_FIELD_INDEX = dict((name, i) for i, name in enumerate(FIELDS))
+
+
+class BlockIndex(object):
+    """
+    Maps each street name to its blocks' field values and geometries,
+    sorted by from_num.
+
+    Geometries are kept as flat arrays of coordinates, and Block
+    instances are only created for search results.
+    """
+
+    # Size of grid cells for nearest(), in coordinate units (degrees).
+    grid_size = 0.005
+
+    def __init__(self, srid=4326):
+        self.srid = srid
+        # street -> ([from_num, ...], [(field values, coords), ...])
+        self.streets = {}
+        self._grid = None
+        self._grid_bounds = None
+
+    def __getstate__(self):
+        # The grid is quick to rebuild, so don't pickle it.
+        state = self.__dict__.copy()
+        state['_grid'] = None
+        state['_grid_bounds'] = None
+        return state
+
+    @classmethod
+    def from_queryset(cls, blocks):
+        """
+        Builds an index of the given Block QuerySet.
+        """
+        index = cls()
+        strings = {}
+        entries = {}
+        count = 0
+        for block in blocks.only(*(FIELDS + ('geom',))).iterator():
+            # Lots of blocks share the same cities, states, etc.
+            values = tuple([strings.setdefault(v, v) if isinstance(v, basestring) else v
+                            for v in [getattr(block, name) for name in FIELDS]])
+            coords = array('d')
+            for x, y in block.geom.coords:
+                coords.append(x)
+                coords.append(y)
+            index.srid = block.geom.srid or index.srid
+            entries.setdefault(values[_FIELD_INDEX['street']], []).append((values, coords))
+            count += 1
+        for street, street_entries in entries.items():
+            street_entries.sort(key=lambda entry: entry[0][_FIELD_INDEX['from_num']])
+            from_nums = [entry[0][_FIELD_INDEX['from_num']] for entry in street_entries]
+            index.streets[street] = (from_nums, street_entries)
+        logger.info('Indexed %d blocks on %d streets' % (count, len(index.streets)))
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return sum(len(entries) for from_nums, entries in self.streets.values())
+
+    def _make_block(self, values, coords):
+        from ebpub.streets.models import Block
+        block = Block(**dict(zip(FIELDS, values)))
+        block.geom = LineString(zip(coords[0::2], coords[1::2]), srid=self.srid)
+        return block
+
+    def _build_grid(self):
+        grid = {}
+        size = self.grid_size
+        for from_nums, entries in self.streets.values():
+            for entry in entries:
+                coords = entry[1]
+                xs, ys = coords[0::2], coords[1::2]
+                for cx in range(int(floor(min(xs) / size)), int(floor(max(xs) / size)) + 1):
+                    for cy in range(int(floor(min(ys) / size)), int(floor(max(ys) / size)) + 1):
+                        grid.setdefault((cx, cy), []).append(entry)
+        if grid:
+            # (min x, min y, max x, max y) of the cells with blocks.
+            self._grid_bounds = (min([cx for cx, cy in grid]), min([cy for cx, cy in grid]),
+                                 max([cx for cx, cy in grid]), max([cy for cx, cy in grid]))
+        self._grid = grid
+
+    def nearest(self, x, y):
+        """
+        Returns (block, distance) for the block nearest the point, or
+        None if there are no blocks. Like reverse_geocode(), but
+        without the database.
+        """
+        if self._grid is None:
+            self._build_grid()
+        if not self._grid:
+            return None
+        size = self.grid_size
+        cx, cy = int(floor(x / size)), int(floor(y / size))
+        min_gx, min_gy, max_gx, max_gy = self._grid_bounds
+        max_ring = max(cx - min_gx, max_gx - cx, cy - min_gy, max_gy - cy, 0)
+        best, best_distance = None, None
+        seen = set()
+        for ring in range(max_ring + 1):
+            # Check the cells in a square "ring" around the point's
+            # cell, skipping any outside the grid.
+            for gx in range(max(cx - ring, min_gx), min(cx + ring, max_gx) + 1):
+                if abs(gx - cx) == ring:
+                    gys = range(max(cy - ring, min_gy), min(cy + ring, max_gy) + 1)
+                else:
+                    # Just the top and bottom of the ring.
+                    gys = [gy for gy in set([cy - ring, cy + ring]) if min_gy <= gy <= max_gy]
+                for gy in gys:
+                    for entry in self._grid.get((gx, gy), ()):
+                        if id(entry) in seen:
+                            continue
+                        seen.add(id(entry))
+                        distance = _line_distance(x, y, entry[1])
+                        if best_distance is None or distance < best_distance:
+                            best, best_distance = entry, distance
+            # Anything in cells further out is at least this far away.
+            if best_distance is not None and best_distance <= ring * size:
+                break
+        return (self._make_block(*best), best_distance)
+
+    def search(self, street, number=None, predir=None, suffix=None, postdir=None, city=None, state=None, zipcode=None):
+        """
+        Like BlockManager.search(), but without the database.
+        """
+        from_nums, entries = self.streets.get(street.upper(), ((), ()))
+        if number:
+            number = int(re.sub(r'\D', '', number))
+            # Only blocks starting at or before the number can contain it.
+            entries = entries[:bisect_right(from_nums, number)]
+        predir, suffix, postdir, city, state = [
+            (s or '').upper() or None for s in (predir, suffix, postdir, city, state)]
+        f = _FIELD_INDEX
+        results = []
+        for values, coords in entries:
+            if number and (values[f['to_num']] is None or values[f['to_num']] < number
+                           or values[f['from_num']] is None):
+                continue
+            if predir and values[f['predir']] != predir:
+                continue
+            if suffix and values[f['suffix']] != suffix:
+                continue
+            if postdir and values[f['postdir']] != postdir:
+                continue
+            if city and city not in (values[f['left_city']], values[f['right_city']]):
+                continue
+            if state and state not in (values[f['left_state']], values[f['right_state']]):
+                continue
+            if zipcode and zipcode not in (values[f['left_zip']], values[f['right_zip']]):
+                continue
+            block = self._make_block(values, coords)
+            if not number:
+                results.append((block, None))
+                continue
+            contains, from_num, to_num = block.contains_number(number)
+            if not contains:
+                continue
+            try:
+                fraction = (float(number) - from_num) / (to_num - from_num)
+            except ZeroDivisionError:
+                fraction = 0.5
+            x, y = interpolate_coords(zip(coords[0::2], coords[1::2]), fraction)
+            results.append((block, Point(x, y, srid=self.srid)))
+        # Same order as Block's default ordering.
+        results.sort(key=lambda result: result[0].pretty_name)
+        return results
+
+
+def _line_distance(x, y, coords):
+    """
+    Returns the distance from (x, y) to the nearest point on the line
+    given as a flat sequence of coordinates [x0, y0, x1, y1, ...].
+
+    >>> _line_distance(5, 3, [0, 0, 10, 0])
+    3.0
+    >>> _line_distance(13, 4, [0, 0, 10, 0])
+    5.0
+    """
+    if len(coords) == 2:
+        return ((x - coords[0]) ** 2 + (y - coords[1]) ** 2) ** 0.5
+    best = None
+    for i in range(0, len(coords) - 2, 2):
+        x1, y1, x2, y2 = coords[i:i + 4]
+        dx, dy = x2 - x1, y2 - y1
+        length2 = dx * dx + dy * dy
+        if length2:
+            t = min(max(float((x - x1) * dx + (y - y1) * dy) / length2, 0.0), 1.0)
+        else:
+            t = 0.0
+        px, py = x1 + t * dx, y1 + t * dy
+        distance = ((x - px) ** 2 + (y - py) ** 2) ** 0.5
+        if best is None or distance < best:
+            best = distance
+    return best
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_block_index():
+    """
+    Returns the BlockIndex to use, per the EBPUB_BLOCK_INDEX setting,
+    loading or building it if necessary; or None if there isn't one.
+    """
+    global _index
+    if _index is not None:
+        return _index
+    setting = getattr(settings, 'EBPUB_BLOCK_INDEX', False)
+    if not setting:
+        return None
+    with _index_lock:
+        if _index is None:
+            if isinstance(setting, basestring) and os.path.exists(setting):
+                logger.info('Loading block index from %s' % setting)
+                _index = BlockIndex.load(setting)
+            else:
+                from ebpub.streets.models import Block
+                index = BlockIndex.from_queryset(Block.objects.all())
+                if isinstance(setting, basestring):
+                    logger.info('Saving block index to %s' % setting)
+                    index.save(setting)
+                _index = index
+    return _index
+
+def set_block_index(index):
+    """
+    Use the given BlockIndex from now on, in this process; or if
+    index is None, go back to what the EBPUB_BLOCK_INDEX setting says.
+    """
+    global _index
+    _index = index
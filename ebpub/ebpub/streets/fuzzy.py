@@ -0,0 +1,214 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+An optional in-memory index of street names, for correcting
+misspelled streets that don't have a StreetMisspelling.
+
+Names are found by the trigrams they share with the misspelled name,
+and the closest few are then checked by edit distance.
+
+Enable it with the EBPUB_FUZZY_STREET_NAMES setting. Like the
+BlockIndex, it's built the first time it's needed in each process,
+and isn't updated when Blocks change.
+"""
+
+from django.conf import settings
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger('ebpub.streets.fuzzy')
+
+# How many names, sharing the most trigrams with a misspelled name,
+# to check the edit distance of.
+MAX_CANDIDATES = 20
+
+
+def trigrams(name):
+    """
+    Returns the set of 3-character substrings of name, padded with
+    spaces so the start and end of the name count for more.
+
+    >>> sorted(trigrams('ELM'))
+    ['  E', ' EL', 'ELM', 'LM ']
+    """
+    padded = '  %s ' % name
+    return set([padded[i:i + 3] for i in range(len(padded) - 2)])
+
+
+def max_edit_distance(name):
+    """
+    How many typos to allow in a street name of this length. Very
+    short names aren't corrected at all.
+
+    >>> [max_edit_distance(name) for name in ('ELM', 'OAK ST', 'MASSACHUSETTS')]
+    [0, 1, 2]
+    """
+    if len(name) < 4:
+        return 0
+    elif len(name) < 8:
+        return 1
+    return 2
+
+
+def edit_distance(a, b, limit):
+    """
+    Returns the number of insertions, deletions, substitutions and
+    transpositions of adjacent characters needed to turn a into b,
+    or None if that's more than limit.
+
+    >>> edit_distance('WABASH', 'WABASH', 2)
+    0
+    >>> edit_distance('WABAHS', 'WABASH', 2)
+    1
+    >>> edit_distance('WBASH', 'WABASH', 2)
+    1
+    >>> edit_distance('WASHINGTON', 'WABASH', 2) is None
+    True
+    """
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = None
+    row = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1] and 1 or 0
+            current[j] = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if (previous is not None and j > 1 and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous[j - 2] + 1)
+        if min(current) > limit:
+            return None
+        previous, row = row, current
+    if row[-1] > limit:
+        return None
+    return row[-1]
+
+
+class StreetNameIndex(object):
+    """
+    An inverted index from trigrams to the street names containing them.
+    """
+
+    def __init__(self, names=()):
+        self.names = set()
+        self._trigrams = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name):
+        if not name or name in self.names:
+            return
+        self.names.add(name)
+        for gram in trigrams(name):
+            self._trigrams.setdefault(gram, []).append(name)
+
+    def suggestions(self, name):
+        """
+        Returns a list of (distance, street name) for known street names
+        within max_edit_distance(name) of the given (uppercase) name,
+        closest first.
+        """
+        if name in self.names:
+            return [(0, name)]
+        limit = max_edit_distance(name)
+        if not limit:
+            return []
+        grams = trigrams(name)
+        counts = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        # Each edit changes at most 4 trigrams (3, except for
+        # transpositions), so names sharing fewer than this can't be
+        # close enough.
+        min_shared = len(grams) - 4 * limit
+        candidates = heapq.nlargest(
+            MAX_CANDIDATES,
+            [(count, candidate) for candidate, count in counts.iteritems()
+             if count >= min_shared and abs(len(candidate) - len(name)) <= limit])
+        results = []
+        for count, candidate in candidates:
+            distance = edit_distance(name, candidate, limit)
+            if distance is not None:
+                results.append((distance, candidate))
+        results.sort()
+        return results
+
+    def correct(self, name):
+        """
+        Returns the one known street name closest to the given
+        (uppercase) name, or None if there isn't a single closest one.
+        """
+        results = self.suggestions(name)
+        if not results:
+            return None
+        if len(results) > 1 and results[1][0] == results[0][0]:
+            logger.debug('%r is equally close to %r and %r' % (name, results[0][1], results[1][1]))
+            return None
+        return results[0][1]
+
+    @classmethod
+    def from_blocks(cls):
+        """
+        Builds an index of the street names of all Blocks, using the
+        BlockIndex if there is one.
+        """
+        from ebpub.streets.blockindex import get_block_index
+        block_index = get_block_index()
+        if block_index is not None:
+            return cls(block_index.streets.keys())
+        from ebpub.streets.models import Block
+        return cls(Block.objects.values_list('street', flat=True).distinct())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_street_name_index():
+    """
+    Returns the StreetNameIndex to use, building it if necessary;
+    or None if the EBPUB_FUZZY_STREET_NAMES setting is False.
+    """
+    global _index
+    if _index is not None:
+        return _index
+    if not getattr(settings, 'EBPUB_FUZZY_STREET_NAMES', False):
+        return None
+    with _index_lock:
+        if _index is None:
+            logger.info('Building street name index')
+            _index = StreetNameIndex.from_blocks()
+    return _index
+
+def set_street_name_index(index):
+    """
+    Use the given StreetNameIndex from now on, in this process; or if
+    index is None, go back to what the EBPUB_FUZZY_STREET_NAMES
+    setting says.
+    """
+    global _index
+    _index = index
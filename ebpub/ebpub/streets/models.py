@@ -18,11 +18,12 @@
 
 from django.contrib.localflavor.us.models import USStateField
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import fromstr
+from django.contrib.gis.geos import Point
 from django.core import urlresolvers
 from django.db.models import Q
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.metros.allmetros import get_metro
+from ebpub.utils.geodjango import interpolate_coords
 import logging
 import operator
 import re
@@ -94,7 +95,68 @@ class BlockManager(models.GeoManager):
 
         Note we don't enforce parity (even/odd) matching.
         So 3181 would match the block 3180-3188.
+
+        If there's a BlockIndex (see ebpub.streets.blockindex),
+        this doesn't query the database.
+        """
+        from ebpub.streets.blockindex import get_block_index
+        index = get_block_index()
+        if index is not None:
+            return index.search(street, number, predir, suffix, postdir, city, state, zipcode)
+
+        qs = self._search_queryset(street, predir, suffix, postdir, city, state, zipcode)
+
+        # If a number was given, search against the address ranges in the
+        # Block table.
+        if number:
+            number = int(re.sub(r'\D', '', number))
+            return self._blocks_containing(qs.filter(from_num__lte=number, to_num__gte=number),
+                                           number)
+        else:
+            return list([(b, None) for b in qs])
+
+    def search_many(self, searches):
+        """
+        Like calling search() for each of a list of dictionaries of
+        search() keyword arguments, but with only one query for all
+        the searches on the same street (with the same predir, suffix,
+        postdir, city, state, and zipcode).
+
+        Returns a list of search() results, in the same order.
         """
+        from ebpub.streets.blockindex import get_block_index
+        index = get_block_index()
+        if index is not None:
+            return [index.search(**search) for search in searches]
+
+        key_names = ('street', 'predir', 'suffix', 'postdir', 'city', 'state', 'zipcode')
+        groups = {}
+        for i, search in enumerate(searches):
+            key = tuple([search.get(name) for name in key_names])
+            groups.setdefault(key, []).append(i)
+
+        results = [None] * len(searches)
+        for key, indexes in groups.items():
+            qs = self._search_queryset(*key)
+            numbers = []
+            for i in indexes:
+                number = searches[i].get('number')
+                numbers.append(number and int(re.sub(r'\D', '', number)) or None)
+            if None in numbers:
+                blocks = list(qs)
+            else:
+                blocks = list(qs.filter(from_num__lte=max(numbers), to_num__gte=min(numbers)))
+            for i, number in zip(indexes, numbers):
+                if number is None:
+                    results[i] = [(b, None) for b in blocks]
+                else:
+                    candidates = [b for b in blocks
+                                  if None not in (b.from_num, b.to_num)
+                                  and b.from_num <= number <= b.to_num]
+                    results[i] = self._blocks_containing(candidates, number)
+        return results
+
+    def _search_queryset(self, street, predir=None, suffix=None, postdir=None, city=None, state=None, zipcode=None):
         filters = {'street': street.upper()}
         sided_filters = []
         if predir:
@@ -113,34 +175,25 @@ class BlockManager(models.GeoManager):
             zip_filter = Q(left_zip=zipcode) | Q(right_zip=zipcode)
             sided_filters.append(zip_filter)
 
-        qs = self.filter(*sided_filters, **filters)
+        return self.filter(*sided_filters, **filters)
 
-        # If a number was given, search against the address ranges in the
-        # Block table.
-        if number:
-            number = int(re.sub(r'\D', '', number))
-            block_tuples = []
-            for block in qs.filter(from_num__lte=number, to_num__gte=number):
-                contains, from_num, to_num = block.contains_number(number)
-                if contains:
-                    block_tuples.append((block, from_num, to_num))
-            blocks = []
-            if block_tuples:
-                from django.db import connection
-                cursor = connection.cursor()
-                for block, from_num, to_num in block_tuples:
-                    try:
-                        fraction = (float(number) - from_num) / (to_num - from_num)
-                    except ZeroDivisionError:
-                        fraction = 0.5
-                    # We rely on PostGIS line_interpolate_point() because there
-                    # isn't a matching GeoDjango/Python API.
-                    cursor.execute('SELECT line_interpolate_point(%s, %s)', [block.geom.wkt, fraction])
-                    wkb_hex = cursor.fetchone()[0]
-                    blocks.append((block, fromstr(wkb_hex)))
-        else:
-            blocks = list([(b, None) for b in qs])
-        return blocks
+    def _blocks_containing(self, blocks, number):
+        """
+        Returns a list of (block, geocoded_pt) for those of the blocks
+        whose address ranges contain the number.
+        """
+        result = []
+        for block in blocks:
+            contains, from_num, to_num = block.contains_number(number)
+            if not contains:
+                continue
+            try:
+                fraction = (float(number) - from_num) / (to_num - from_num)
+            except ZeroDivisionError:
+                fraction = 0.5
+            x, y = interpolate_coords(block.geom.coords, fraction)
+            result.append((block, Point(x, y, srid=block.geom.srid)))
+        return result
 
 class Block(models.Model):
 
@@ -719,3 +772,12 @@ class Suburb(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+from django.db.models.signals import post_save, post_delete
+from ebpub.geocoder.names import invalidate_name_registry
+
+post_save.connect(invalidate_name_registry, sender=Place)
+post_delete.connect(invalidate_name_registry, sender=Place)
+post_save.connect(invalidate_name_registry, sender=PlaceSynonym)
+post_delete.connect(invalidate_name_registry, sender=PlaceSynonym)
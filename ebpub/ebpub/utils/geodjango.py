@@ -120,6 +120,34 @@ def flatten_geomcollection(geom):
                     " Munged it into a %s." % geom.geom_type)
     return geom
 
+def interpolate_coords(coords, fraction):
+    """
+    Returns the (x, y) point that is ``fraction`` (0 to 1) of the way
+    along a line given as a sequence of (x, y) coordinates.
+    Like PostGIS' ST_Line_Interpolate_Point(), but needs no
+    round trip to the database.
+
+    >>> interpolate_coords([(0, 0), (10, 0)], 0.25)
+    (2.5, 0.0)
+    >>> interpolate_coords([(0, 0), (10, 0), (10, 10)], 0.75)
+    (10.0, 5.0)
+    >>> interpolate_coords([(0, 0), (10, 0)], 1.5)
+    (10.0, 0.0)
+    >>> interpolate_coords([(3, 4)], 0.5)
+    (3.0, 4.0)
+    """
+    fraction = min(max(fraction, 0.0), 1.0)
+    coords = [(float(c[0]), float(c[1])) for c in coords]
+    lengths = [((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
+               for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:])]
+    target = sum(lengths) * fraction
+    for (x1, y1), (x2, y2), length in zip(coords[:-1], coords[1:], lengths):
+        if target <= length and length > 0:
+            ratio = target / length
+            return (x1 + (x2 - x1) * ratio, y1 + (y2 - y1) * ratio)
+        target -= length
+    return coords[-1]
+
 def smart_transform(geom, srid, clone=True):
     """
     Returns a new geometry transformed to the srid given. Assumes if
@@ -0,0 +1,106 @@
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Versions of Django's GZipMiddleware and ConditionalGetMiddleware that
+don't read the whole content of streaming responses (those with a
+true ``streaming`` attribute, such as
+ebpub.openblockapi.views.StreamingHttpResponse).
+"""
+
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+from django.middleware.gzip import re_accepts_gzip
+from django.middleware.http import ConditionalGetMiddleware as BaseConditionalGetMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from gzip import GzipFile
+
+class _StreamingBuffer(object):
+    # A file-like object that GzipFile writes to, and we read from.
+    def __init__(self):
+        self.vals = []
+
+    def write(self, val):
+        self.vals.append(val)
+
+    def read(self):
+        ret = ''.join(self.vals)
+        self.vals = []
+        return ret
+
+    def flush(self):
+        return
+
+    def close(self):
+        return
+
+def compress_sequence(sequence):
+    """
+    Yields the gzipped contents of an iterable of strings, piece by
+    piece.
+    """
+    buf = _StreamingBuffer()
+    zfile = GzipFile(mode='wb', compresslevel=6, fileobj=buf)
+    # The header.
+    yield buf.read()
+    for item in sequence:
+        zfile.write(item)
+        zfile.flush()
+        yield buf.read()
+    zfile.close()
+    yield buf.read()
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """
+    Like Django's GZipMiddleware, but compresses streaming responses
+    as they're sent.
+    """
+
+    def process_response(self, request, response):
+        if not getattr(response, 'streaming', False):
+            return super(GZipMiddleware, self).process_response(request, response)
+        if response.status_code != 200:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.has_header('Content-Encoding'):
+            return response
+        # MSIE has issues with gzipped responses of various content types.
+        if "msie" in request.META.get('HTTP_USER_AGENT', '').lower():
+            ctype = response.get('Content-Type', '').lower()
+            if not ctype.startswith("text/") or "javascript" in ctype:
+                return response
+        if not re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+        response._container = compress_sequence(response._container)
+        response['Content-Encoding'] = 'gzip'
+        return response
+
+
+class ConditionalGetMiddleware(BaseConditionalGetMiddleware):
+    """
+    Like Django's ConditionalGetMiddleware, but doesn't add a
+    Content-Length or handle ETags for streaming responses, since
+    that would mean reading the whole thing.
+    """
+
+    def process_response(self, request, response):
+        if not getattr(response, 'streaming', False):
+            return super(ConditionalGetMiddleware, self).process_response(request, response)
+        response['Date'] = http_date()
+        return response
@@ -0,0 +1,103 @@
+#   Copyright 2011 OpenPlans and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Base class for process-local copies of data that rarely changes,
+such as ebpub.db.models.schemafield_registry.
+"""
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+import time
+import uuid
+
+class Registry(object):
+    """
+    Loads some data (by calling _load(), which subclasses must
+    define) the first time get_data() is called, and keeps it until:
+
+    * clear() or invalidate() is called in this process;
+
+    * another process calls invalidate(), which changes a version key
+      in the Django cache; we check that key every ``check_interval``
+      seconds;
+
+    * or it's ``max_age`` seconds old, in case some process changed
+      things without calling invalidate(), or the cache isn't shared
+      between processes. If the cache backend is a DummyCache or
+      LocMemCache, which can't be shared, it's only kept for
+      ``check_interval`` seconds.
+    """
+
+    version_cache_key = None
+
+    # How often (in seconds) to check whether another process has
+    # changed things.
+    check_interval = 10
+
+    # How long (in seconds) to keep the data, regardless.
+    max_age = 60 * 5
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._last_checked = 0
+        self._loaded_at = 0
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _get_max_age(self):
+        if isinstance(cache, (DummyCache, LocMemCache)):
+            return min(self.check_interval, self.max_age)
+        return self.max_age
+
+    def get_data(self):
+        now = time.time()
+        data = self._data
+        if data is not None:
+            if now - self._loaded_at > self._get_max_age():
+                data = None
+            elif now - self._last_checked > self.check_interval:
+                self._last_checked = now
+                if cache.get(self.version_cache_key) != self._version:
+                    data = None
+        if data is None:
+            # Get the version *before* loading, so if somebody changes
+            # things while we load, we'll notice next time.
+            version = cache.get(self.version_cache_key)
+            data = self._load()
+            self._data = data
+            self._version = version
+            self._last_checked = self._loaded_at = now
+        return data
+
+    def clear(self):
+        """
+        Forget everything in this process.
+        """
+        self._data = None
+
+    def invalidate(self):
+        """
+        Forget everything in this process, and tell other processes
+        to do the same.
+        """
+        self.clear()
+        cache.set(self.version_cache_key, uuid.uuid4().hex)
@@ -24,6 +24,7 @@ from django.template.context import RequestContext
 from django.utils import simplejson as json
 from ebpub.accounts.utils import login_required
 from ebpub.db.models import NewsItem
+from ebpub.db.utils import populate_attributes
 from ebpub.utils.logutils import log_exception
 from ebpub.utils.text import smart_title
 from ebpub.widgets.models import Widget, PinnedItem
@@ -60,6 +61,9 @@ def render_widget(widget, items=None):
     """
     if items is None:
         items = widget.fetch_items()
+    # Fetch all the attributes in bulk, rather than one item at a time
+    # in template_context_for_item().
+    populate_attributes(items)
     info = {
         'items': [template_context_for_item(x, widget) for x in items],
         'widget': widget
@@ -104,6 +104,13 @@ setup(
             'import_zips_tiger = ebpub.db.bin.import_zips:main',
             # 'import_zips_esri = ebpub.streets.blockimport.esri.importers.zipcodes:TODO',
             'update_aggregates = ebpub.db.bin.update_aggregates:main',
+            'sync_m2m_lookups = ebpub.db.bin.sync_m2m_lookups:main',
+            'reconcile_newsitem_locations = ebpub.db.bin.reconcile_newsitem_locations:main',
+            'benchmark_throttle = ebpub.openblockapi.bin.benchmark_throttle:main',
+            'benchmark_address_parser = ebpub.geocoder.parser.benchmark:main',
+            'benchmark_geocoder = ebpub.geocoder.benchmark:main',
+            'maintain_geocoder_cache = ebpub.geocoder.bin.maintain_geocoder_cache:main',
+            'build_block_index = ebpub.streets.bin.build_block_index:main',
             'populate_streets = ebpub.streets.bin.populate_streets:main',
             'populate_suburbs = ebpub.streets.bin.populate_suburbs:main',
             'fix_block_numbers = ebpub.streets.bin.fix_block_numbers:main',